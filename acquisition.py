@@ -0,0 +1,409 @@
+#!/usr/bin/env python
+"""
+Acquisition scheduling on top of the PressureGauge classes.
+
+ConcurrentSampler queries every gauge it is given at the same time, one worker thread per serial port,
+and merges the replies into a single Row. Each Reading is timestamped when its reply arrives,
+so readings from gauges on different ports are aligned to within one reply time of each other instead of
+being a full round-trip apart.
+
+FixedRateScheduler paces the sampling loop on a fixed grid; AdaptiveScheduler varies the period with how fast
+the pressure is changing. Deadband decides which samples are worth recording.
+"""
+
+from sys import stderr
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import nullcontext
+import metrics
+import math, threading, time
+
+# name -- label the gauge was registered under; timestamp -- time.time() when the reply arrived;
+# values -- the list returned by PressureGauge.getPressure(), or NaNs if the gauge failed;
+# error -- None, or why the gauge gave no reading
+Reading = namedtuple('Reading', ['name', 'timestamp', 'values', 'error'], defaults=(None,))
+
+_sampleTime = metrics.histogram("vacuum_sample_seconds", "Time to read every gauge once (one Row)")
+_jitter = metrics.histogram("vacuum_loop_jitter_seconds", "Lateness of the sampling loop behind each deadline")
+_gaugeFailures = metrics.counter("vacuum_gauge_failures_total", "Samples in which a gauge gave no reading (recorded as NaN)")
+_missed = metrics.counter("vacuum_loop_missed_total", "Sampling deadlines skipped because the loop fell a whole period behind")
+
+
+class Row(object):
+    """ One merged sample: a Reading per gauge, in the order the gauges were registered """
+
+    def __init__(self, readings):
+        self.readings = readings
+        self.timestamp = max(r.timestamp for r in readings)
+
+    def __getitem__(self, name):
+        for r in self.readings:
+            if r.name == name:
+                return r
+        raise KeyError(name)
+
+    def values(self):
+        """ Returns every gauge's values flattened into one list, in registration order """
+        out = []
+        for r in self.readings:
+            out.extend(r.values)
+        return out
+
+    def split(self):
+        """
+        For rows whose gauge names are (group, name) pairs, e.g. (chamber, 'pirani'),
+        returns a dict of group -> Row holding that group's readings under their plain names
+        """
+        groups = {}
+        for r in self.readings:
+            group, name = r.name
+            groups.setdefault(group, []).append(Reading(name, r.timestamp, r.values, r.error))
+        return dict((group, Row(readings)) for group, readings in groups.items())
+
+    def skew(self):
+        """ Seconds between the first and last reply in this row """
+        return self.timestamp - min(r.timestamp for r in self.readings)
+
+
+def portKey(ser):
+    """ What identifies a serial port (or stand-in) to the sampler: its device name, else the object itself """
+    return getattr(ser, 'port', None) or id(ser)
+
+
+class SharedPort(object):
+    """
+    Owner of a serial port that several gauges use, one after the other (e.g. the gauges of two chambers on one
+    device in vacuum_daemon.py). The sampler holds its lock around every read and job on the port, and the
+    gauges' reconnect() goes through it, so the port is never closed under another gauge's command and is
+    reopened once for all of them rather than once per failing gauge.
+    """
+
+    def __init__(self, gauges):
+        self.gauges = list(gauges)
+        self.lock = threading.RLock()
+        self.reopened = None # time.monotonic() of the last reopen
+        for gauge in self.gauges:
+            gauge.sharedPort = self
+
+    def reconnect(self, gauge):
+        """ Reopens the port for a failing gauge, unless another of its gauges had it reopened within its downtime """
+        with self.lock:
+            now = time.monotonic()
+            if self.reopened is not None and now - self.reopened < gauge.downtime:
+                return
+            self.reopened = now
+            gauge.reopen()
+
+    def release(self):
+        for gauge in self.gauges:
+            if gauge.sharedPort is self:
+                gauge.sharedPort = None
+
+
+class ConcurrentSampler(object):
+    """
+    Samples a set of gauges in parallel.
+    Each serial port gets its own single-thread executor, so commands to one port are never interleaved
+    (gauges sharing a port are read one after the other), while different ports are read at the same time.
+    The gauges of a port that are all addressed Piranis (an RS-485 line) are polled together by a PiraniBus;
+    the other gauges of a shared port get a SharedPort, the only one allowed to reopen it.
+
+    A gauge that fails is recorded as NaN values (with the error in its Reading) and the others are unaffected.
+    With a timeout, sample() returns after that many seconds whatever has answered; the gauges of a port still
+    busy with an earlier sample are recorded as NaN, without queueing more commands behind the stuck one.
+    """
+
+    def __init__(self, gauges, debug, timeout=None, busDepth=None):
+        """
+        Constructor
+        arguments:
+        gauges -- list of (name, PressureGauge) pairs; names must be unique
+        debug -- true to print debugging statements, false otherwise
+        timeout -- longest wait for the gauges in sample(), in seconds; None waits for all of them
+        busDepth -- dict of portKey(serial port) -> commands in flight on that RS-485 line (see PiraniBus);
+                    only for 4-wire lines, the others keep the default of 1
+        """
+        self.gauges = list(gauges)
+        self.debug = debug
+        self.timeout = timeout
+        self.busDepth = dict(busDepth or {})
+        byPort = {}
+        for name, gauge in self.gauges:
+            byPort.setdefault(self._portKey(gauge), []).append((name, gauge))
+        self.portGroups = list(byPort.values())
+        self.buses = [self._bus(group) for group in self.portGroups]
+        self.shared = [SharedPort([gauge for name, gauge in group]) if len(group) > 1 and bus is None else None
+                       for group, bus in zip(self.portGroups, self.buses)]
+        self.executors = [ThreadPoolExecutor(max_workers=1) for g in self.portGroups]
+        self.inflight = [None] * len(self.portGroups) # each port's unfinished read, if it overran a sample
+
+    def _portKey(self, gauge):
+        return portKey(gauge.innerSerial)
+
+    def _bus(self, group):
+        """ Returns a PiraniBus for a port group of several addressed Pirani gauges, else None """
+        if len(group) < 2 or any(getattr(gauge, 'address', None) is None for name, gauge in group):
+            return None
+        from pirani_bus import PiraniBus
+        depth = self.busDepth.get(self._portKey(group[0][1]), 1)
+        return PiraniBus([gauge for name, gauge in group], depth=depth, debug=self.debug)
+
+    def _missing(self, name, gauge, error):
+        _gaugeFailures.inc()
+        return Reading(name, time.time(), [float('nan')] * getattr(gauge, 'channels', 1), error)
+
+    def _read(self, group, bus=None, shared=None):
+        with shared.lock if shared is not None else nullcontext():
+            return self._readGroup(group, bus)
+
+    def _readGroup(self, group, bus):
+        out = []
+        if bus is not None:
+            for (name, gauge), (timestamp, result) in zip(group, bus.poll()):
+                if isinstance(result, Exception):
+                    out.append(self._missing(name, gauge, str(result)))
+                else:
+                    out.append(Reading(name, timestamp, result))
+            return out
+        for name, gauge in group:
+            try:
+                values = gauge.getPressure()
+                out.append(Reading(name, time.time(), values)) # stamped when the reply arrived
+            except Exception as err:
+                if self.debug:
+                    stderr.write("sample: %s failed: %s\n" % (name, err))
+                out.append(self._missing(name, gauge, str(err)))
+        return out
+
+    def sample(self):
+        """
+        Requests the pressure from every gauge at once and waits for the replies (at most self.timeout seconds).
+        Returns a Row; a gauge that failed, or had not answered in time, has NaN values and an error.
+        """
+        start = time.monotonic()
+        futures = []
+        for i, (ex, group) in enumerate(zip(self.executors, self.portGroups)):
+            if self.inflight[i] is not None and not self.inflight[i].done():
+                futures.append(None) # still stuck on an earlier sample
+            else:
+                self.inflight[i] = None
+                futures.append(ex.submit(self._read, group, self.buses[i], self.shared[i]))
+        wait([f for f in futures if f is not None], timeout=self.timeout)
+        _sampleTime.observe(time.monotonic() - start)
+        byName = {}
+        for i, (f, group) in enumerate(zip(futures, self.portGroups)):
+            if f is not None and f.done():
+                for r in f.result():
+                    byName[r.name] = r
+                continue
+            if f is not None:
+                self.inflight[i] = f
+            for name, gauge in group:
+                byName[name] = self._missing(name, gauge, "no reply within %s s" % self.timeout if f is not None else "port busy")
+        readings = [byName[name] for name, gauge in self.gauges]
+        row = Row(readings)
+        if self.debug:
+            stderr.write("sample: %d gauges, skew %.6f s\n" % (len(readings), row.skew()))
+            stderr.flush()
+        return row
+
+    def submit(self, gauge, fn, *args):
+        """
+        Runs fn(*args) on the worker thread of gauge's port, between samples, so its commands never interleave
+        with theirs (e.g. a background re-read of the gauge units). Returns a concurrent.futures.Future.
+        """
+        key = self._portKey(gauge)
+        for ex, group, shared in zip(self.executors, self.portGroups, self.shared):
+            if self._portKey(group[0][1]) == key:
+                return ex.submit(self._job, shared, fn, *args)
+        raise KeyError("gauge is not sampled by this sampler")
+
+    def _job(self, shared, fn, *args):
+        with shared.lock if shared is not None else nullcontext():
+            return fn(*args)
+
+    def close(self):
+        for ex in self.executors:
+            ex.shutdown(wait=True)
+        for shared in self.shared:
+            if shared is not None:
+                shared.release()
+
+
+class FixedRateScheduler(object):
+    """
+    Paces a sampling loop at a fixed rate on the monotonic clock.
+
+    Deadlines are start + n*period, so time spent reading, writing and plotting between calls to wait()
+    does not accumulate as drift. If the loop falls more than a whole period behind, the missed deadlines
+    are counted and skipped rather than fired back to back, keeping samples on the original grid.
+    """
+
+    def __init__(self, period, sleep=time.sleep, clock=time.monotonic):
+        """
+        Constructor
+        arguments:
+        period -- seconds between samples
+        sleep -- function used to wait; e.g. plt.pause, so a live plot keeps handling GUI events
+        clock -- monotonic time source
+        """
+        self.period = float(period)
+        self.sleep = sleep
+        self.clock = clock
+        self.starttime = None
+        self.tick = 0
+        self.fired = 0
+        self.missed = 0
+        self.jitterSum = 0.
+        self.jitterMax = 0.
+
+    def start(self):
+        """ Sets the time of the first deadline to now """
+        self.starttime = self.clock()
+        self.tick = 0
+
+    def wait(self):
+        """
+        Blocks until the next deadline and returns it, as a clock() value.
+        The first call returns immediately if start() has not been called yet.
+        """
+        if self.starttime is None:
+            self.start()
+        deadline = self.starttime + self.tick * self.period
+        now = self.clock()
+        if now - deadline >= self.period:
+            skipped = int((now - deadline) // self.period)
+            self.missed += skipped
+            _missed.inc(skipped)
+            self.tick += skipped
+            deadline = self.starttime + self.tick * self.period
+        if deadline > now:
+            self.sleep(deadline - now)
+            now = self.clock()
+        jitter = now - deadline
+        _jitter.observe(jitter)
+        self.jitterSum += jitter
+        self.jitterMax = max(self.jitterMax, jitter)
+        self.fired += 1
+        self.tick += 1
+        return deadline
+
+    def observe(self, t, values, key=None):
+        """ Readings taken at time t; a fixed-rate schedule ignores them (see AdaptiveScheduler) """
+        pass
+
+    def elapsed(self):
+        """ Seconds since start(), with sub-second precision """
+        return self.clock() - self.starttime
+
+    def stats(self):
+        """ Returns a dict with the number of samples fired and missed and the mean/max wake-up jitter in seconds """
+        mean = self.jitterSum / self.fired if self.fired else 0.
+        return {"fired": self.fired, "missed": self.missed, "jitter_mean": mean, "jitter_max": self.jitterMax}
+
+
+class AdaptiveScheduler(FixedRateScheduler):
+    """
+    Paces a sampling loop at a period that follows the pressure dynamics.
+
+    After each sample, observe() is given the readings; the scheduler estimates how fast log10(pressure) is
+    changing on the fastest-moving channel and picks the period that lets it move `target` decades between
+    samples, bounded by minPeriod and maxPeriod. The period shortens at once when the pressure starts moving
+    (a vent, the start of a pumpdown) but lengthens by at most a factor `growth` per sample, so one quiet
+    sample does not stretch the interval during a fast transient. With several chambers (observe(..., key)),
+    the fastest-moving chamber sets the period.
+
+    Deadlines are the previous deadline plus the current period, rather than a fixed grid.
+    """
+
+    def __init__(self, minPeriod, maxPeriod, target=0.02, growth=1.5, smoothing=0.5, sleep=time.sleep, clock=time.monotonic):
+        """
+        Constructor
+        arguments:
+        minPeriod, maxPeriod -- bounds of the sampling period, in seconds
+        target -- change in log10(pressure), in decades, wanted between two samples
+        growth -- largest factor by which the period may grow from one sample to the next
+        smoothing -- weight of the newest rate estimate in the running average (1 uses it alone)
+        sleep, clock -- as for FixedRateScheduler
+        """
+        super(AdaptiveScheduler, self).__init__(maxPeriod, sleep, clock)
+        self.minPeriod = float(minPeriod)
+        self.maxPeriod = float(maxPeriod)
+        self.target = target
+        self.growth = growth
+        self.smoothing = smoothing
+        self.deadline = None
+        self.last = {} # key -> (time, [log10 of each reading])
+        self.rates = {} # key -> smoothed decades per second
+        self.wanted = {} # key -> period that key asks for
+
+    def start(self):
+        super(AdaptiveScheduler, self).start()
+        self.deadline = None
+
+    def observe(self, t, values, key=None):
+        """ Updates the period from readings `values` taken at time t (seconds, any origin) """
+        logs = [math.log10(v) if v > 0 and not math.isinf(v) else float('nan') for v in values]
+        prev = self.last.get(key)
+        self.last[key] = (t, logs)
+        if prev is None or t <= prev[0]:
+            return
+        steps = [abs(a - b) for a, b in zip(logs, prev[1]) if not (math.isnan(a) or math.isnan(b))]
+        if not steps:
+            return
+        rate = max(steps) / (t - prev[0])
+        if key in self.rates:
+            rate = self.smoothing * rate + (1 - self.smoothing) * self.rates[key]
+        self.rates[key] = rate
+        want = self.target / rate if rate > 0 else self.maxPeriod
+        want = min(want, self.wanted.get(key, self.period) * self.growth)
+        self.wanted[key] = min(max(want, self.minPeriod), self.maxPeriod)
+        self.period = min(self.wanted.values())
+
+    def wait(self):
+        """ Blocks until the next deadline (previous deadline plus the current period) and returns it """
+        if self.starttime is None:
+            self.start()
+        now = self.clock()
+        deadline = self.starttime if self.deadline is None else self.deadline + self.period
+        if now - deadline >= self.period:
+            skipped = int((now - deadline) // self.period)
+            self.missed += skipped
+            _missed.inc(skipped)
+            deadline += skipped * self.period
+        if deadline > now:
+            self.sleep(deadline - now)
+            now = self.clock()
+        jitter = now - deadline
+        _jitter.observe(jitter)
+        self.jitterSum += jitter
+        self.jitterMax = max(self.jitterMax, jitter)
+        self.fired += 1
+        self.tick += 1
+        self.deadline = deadline
+        return deadline
+
+
+class Deadband(object):
+    """
+    On-change recording: accept() passes a sample only if some reading has moved by more than `relative`
+    (as a fraction of its last recorded value) since the last sample it passed, or if `heartbeat` seconds
+    have gone by, so a steady chamber still writes a row now and then and a gap in a file means a stopped run.
+    """
+
+    def __init__(self, relative=0.02, heartbeat=300.):
+        self.relative = relative
+        self.heartbeat = heartbeat
+        self.lastTime = None
+        self.lastValues = None
+        self.skipped = 0
+
+    def accept(self, t, values):
+        """ Returns True if the sample at time t should be recorded (and remembers it as the last recorded one) """
+        if self.lastValues is not None and t - self.lastTime < self.heartbeat and len(values) == len(self.lastValues):
+            if all(abs(v - last) <= self.relative * abs(last) for v, last in zip(values, self.lastValues)):
+                self.skipped += 1
+                return False
+        self.lastTime = t
+        self.lastValues = list(values)
+        return True
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+Pumpdown analytics computed as the samples arrive, in constant time per sample.
+
+For each gauge channel, Analytics keeps:
+* RunningStats -- count, min, max, mean and variance since the start (Welford's algorithm)
+* ExponentialFit -- a least-squares fit of ln(pressure) against time with exponential forgetting, so it
+  follows the current phase of the run; a falling pressure gives the pumpdown time constant tau
+* RateOfRise -- the least-squares slope of pressure against time over a sliding window (torr/s), the
+  leak-up rate when the chamber is valved off
+* time to threshold -- from the fit while pumping down, from the rate of rise while the pressure climbs
+
+Nothing is re-read: each update adds the new sample to running sums (the window subtracts the samples it
+drops), so the cost per sample does not grow with the length of the run. summary() returns the current
+estimates as a dict, which VacuumReader writes into the output stream as '# Analytics:' comment lines,
+publishes with each sample, and shows on the live plot.
+"""
+
+import collections, json, math
+
+
+def _finite(x):
+    return x is not None and not math.isnan(x) and not math.isinf(x)
+
+
+class RunningStats(object):
+    """ Count, min, max, mean and variance of a stream of numbers (Welford's online algorithm) """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.min = float('inf')
+        self.max = float('-inf')
+
+    def update(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+
+    def variance(self):
+        """ Sample variance; 0 with fewer than two values """
+        return self.m2 / (self.n - 1) if self.n > 1 else 0.
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+
+class ExponentialFit(object):
+    """
+    Fit of p(t) = p0 * exp(-t / tau) by least squares on ln(p), over exponentially weighted past samples:
+    a sample `halfLife` seconds old counts half as much as a new one.
+    """
+
+    def __init__(self, halfLife=600.):
+        self.halfLife = halfLife
+        self.t0 = None # times are taken relative to the first sample, for numerical stability
+        self.last = None
+        self.w = self.sx = self.sy = self.sxx = self.sxy = 0.
+
+    def update(self, t, p):
+        if not p > 0:
+            return
+        if self.t0 is None:
+            self.t0 = t
+        x = t - self.t0
+        y = math.log(p)
+        if self.last is not None and t > self.last:
+            decay = 0.5 ** ((t - self.last) / self.halfLife)
+            self.w *= decay
+            self.sx *= decay
+            self.sy *= decay
+            self.sxx *= decay
+            self.sxy *= decay
+        self.last = t
+        self.w += 1.
+        self.sx += x
+        self.sy += y
+        self.sxx += x * x
+        self.sxy += x * y
+
+    def slope(self):
+        """ d ln(p) / dt, in 1/s; None until there is enough spread in time """
+        det = self.w * self.sxx - self.sx * self.sx
+        if self.w < 2 or det <= 1e-12 * max(self.w * self.sxx, 1.):
+            return None
+        return (self.w * self.sxy - self.sx * self.sy) / det
+
+    def tau(self):
+        """ Pumpdown time constant in seconds, or None if the pressure is not falling """
+        slope = self.slope()
+        if slope is None or slope >= 0:
+            return None
+        return -1. / slope
+
+
+class RateOfRise(object):
+    """ Least-squares slope of p against t over the samples of the last `window` seconds """
+
+    def __init__(self, window=300.):
+        self.window = window
+        self.samples = collections.deque()
+        self.t0 = None
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = 0.
+
+    def _add(self, x, y, sign):
+        self.n += sign
+        self.sx += sign * x
+        self.sy += sign * y
+        self.sxx += sign * x * x
+        self.sxy += sign * x * y
+
+    def update(self, t, p):
+        if self.t0 is None:
+            self.t0 = t
+        x = t - self.t0
+        self.samples.append((x, p))
+        self._add(x, p, 1)
+        while self.samples and self.samples[0][0] < x - self.window:
+            ox, op = self.samples.popleft()
+            self._add(ox, op, -1)
+
+    def rate(self):
+        """ dp/dt over the window, in pressure units per second; None with fewer than two samples """
+        det = self.n * self.sxx - self.sx * self.sx
+        if self.n < 2 or det <= 0:
+            return None
+        return (self.n * self.sxy - self.sx * self.sy) / det
+
+
+class ChannelAnalytics(object):
+    """ All the running estimates for one gauge channel """
+
+    def __init__(self, threshold=None, halfLife=600., window=300.):
+        self.threshold = threshold
+        self.stats = RunningStats()
+        self.fit = ExponentialFit(halfLife)
+        self.rise = RateOfRise(window)
+        self.latest = None
+
+    def update(self, t, p):
+        if not _finite(p):
+            return
+        self.latest = p
+        self.stats.update(p)
+        self.fit.update(t, p)
+        self.rise.update(t, p)
+
+    def timeToThreshold(self):
+        """
+        Estimated seconds until the pressure crosses the threshold: down to it along the fitted exponential
+        while pumping down, up to it at the current rate of rise while the pressure climbs. 0 once crossed
+        in the direction of travel; None if there is no threshold or no trend towards it.
+        """
+        p = self.latest
+        if self.threshold is None or p is None:
+            return None
+        tau = self.fit.tau()
+        if p > self.threshold and tau is not None:
+            return tau * math.log(p / self.threshold)
+        rate = self.rise.rate()
+        if p < self.threshold and rate is not None and rate > 0:
+            return (self.threshold - p) / rate
+        if tau is not None or (rate is not None and rate > 0):
+            return 0.
+        return None
+
+    def summary(self):
+        s = self.stats
+        return {
+            "n": s.n,
+            "min": s.min if s.n else None,
+            "max": s.max if s.n else None,
+            "mean": s.mean if s.n else None,
+            "std": s.std() if s.n else None,
+            "tau": self.fit.tau(),
+            "rate_of_rise": self.rise.rate(),
+            "time_to_threshold": self.timeToThreshold(),
+        }
+
+
+class Analytics(object):
+    """ ChannelAnalytics for each named column of a sample, updated together """
+
+    def __init__(self, columns, threshold=None, halfLife=600., window=300.):
+        """
+        Constructor
+        arguments:
+        columns -- name of each value in a sample, e.g. ['pirani', 'capacitance 0', 'capacitance 1']
+        threshold -- pressure for the time-to-threshold estimates (None disables them)
+        halfLife -- seconds after which a sample's weight in the exponential fit has halved
+        window -- seconds of samples in the rate-of-rise window
+        """
+        self.columns = list(columns)
+        self.channels = [ChannelAnalytics(threshold, halfLife, window) for c in self.columns]
+
+    def update(self, t, values):
+        """ Adds one sample: time t (e.g. elapsed seconds) and one value per column; NaN values are skipped """
+        for channel, v in zip(self.channels, values):
+            channel.update(t, v)
+
+    def summary(self):
+        """ Returns {column: {n, min, max, mean, std, tau, rate_of_rise, time_to_threshold}} """
+        return dict((name, channel.summary()) for name, channel in zip(self.columns, self.channels))
+
+    def comment(self, summary=None):
+        """ The summary (computed now if not given) as an output-stream comment line """
+        if summary is None:
+            summary = self.summary()
+        return "# Analytics: %s\n" % json.dumps(summary, sort_keys=True)
+
+    def status(self):
+        """ Short one-line text for the live plot """
+        parts = []
+        for name, channel in zip(self.columns, self.channels):
+            tau = channel.fit.tau()
+            rate = channel.rise.rate()
+            eta = channel.timeToThreshold()
+            text = "%s:" % name
+            if tau is not None:
+                text += " tau %.0f s" % tau
+            if rate is not None:
+                text += " dp/dt %.2e/s" % rate
+            if eta is not None:
+                text += " eta %.0f s" % eta
+            parts.append(text)
+        return "   ".join(parts)
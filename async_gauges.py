@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+"""
+asyncio versions of the gauges: `await gauge.get_pressure()` instead of a thread blocked in select().
+
+AsyncPirani and AsyncCapacitance speak the same protocols as Pirani and Capacitance (the replies are checked and
+decoded by the same _checkResponse() and _cleanPressureFormat()), and keep the same retry / backoff / reconnect
+behaviour and metrics. Only the transport differs: a command registers a reader callback on the port's file
+descriptor with the event loop (loop.add_reader), writes the command, and awaits a future that the callback
+completes once the reply is framed -- at a terminator, at the expected length, or after idleTimeout of silence,
+which is a loop timer rather than a sleep. Nothing blocks while a reply is on the wire, so one event loop can
+poll many gauges and serve network clients at the same time:
+
+    async def poll(gauges):
+        return await asyncio.gather(*(g.get_pressure() for g in gauges), return_exceptions=True)
+
+Each gauge must own its port (the event loop allows one reader per file descriptor), and commands to one gauge
+are serialized by an asyncio.Lock. Writes go straight to the port: commands are a few bytes, which the tty
+driver takes at once. Needs a selector event loop (the default on Linux and macOS).
+
+For tests, tests/fakeSerial.py has AsyncMockPirani and AsyncMockCapacitance, whose canned replies arrive
+through a pipe, so the same file-descriptor path is exercised.
+"""
+
+import asyncio, os, select, time
+from sys import stderr
+from pressure_gauges import Pirani, Capacitance, response_timeout
+
+
+class _FrameReader(object):
+    """ Reader callback for one command: collects bytes from fd until the reply is framed, then completes `future` """
+
+    def __init__(self, gauge, cmd, size, loop):
+        self.gauge = gauge
+        self.cmd = cmd
+        self.size = size
+        self.loop = loop
+        self.buf = bytearray()
+        self.future = loop.create_future()
+        self.idle = None # TimerHandle that closes the frame after idleTimeout of silence
+
+    def readable(self, fd):
+        try:
+            data = os.read(fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as err:
+            self._finish(exception=err)
+            return
+        if not data:
+            self._finish(exception=OSError("port closed while waiting for the reply to %s" % self.cmd))
+            return
+        if self.size is not None:
+            data = data[:self.size - len(self.buf)]
+        self.buf += data
+        self.gauge._skipTerminators(self.buf)
+        if not self.buf:
+            return
+        ends = [self.buf.find(term) + len(term) for term in self.gauge.responseTerminators if term in self.buf]
+        if ends:
+            self._finish(bytes(self.buf[:min(ends)]))
+        elif self.size is not None and len(self.buf) >= self.size:
+            self._finish(bytes(self.buf))
+        elif self.gauge.idleTimeout is not None:
+            if self.idle is not None:
+                self.idle.cancel()
+            self.idle = self.loop.call_later(self.gauge.idleTimeout, self._finish, bytes(self.buf))
+
+    def _finish(self, frame=None, exception=None):
+        self.cancel()
+        if self.future.done():
+            return
+        if exception is not None:
+            self.future.set_exception(exception)
+        else:
+            self.future.set_result(frame)
+
+    def cancel(self):
+        if self.idle is not None:
+            self.idle.cancel()
+            self.idle = None
+
+
+class AsyncPressureGauge(object):
+    """
+    Mixin for the PressureGauge classes: coroutine versions of their commands, driven by the event loop.
+    The synchronous methods (getPressure() etc.) still work, but block.
+    """
+
+    _lock = None
+
+    def _drain(self, fd):
+        """ Discards input that is already waiting on fd (stale replies), without blocking """
+        while select.select([fd], [], [], 0)[0]:
+            if not os.read(fd, 4096):
+                return
+
+    async def _atransact(self, cmd, size=None):
+        """ Coroutine version of _transact(): discards stale input, sends cmd, and returns the framed response as bytes """
+        loop = asyncio.get_running_loop()
+        fd = self.innerSerial.fileno()
+        self._drain(fd)
+        frame = _FrameReader(self, cmd, size, loop)
+        loop.add_reader(fd, frame.readable, fd)
+        start = time.monotonic()
+        try:
+            self.innerSerial.write(cmd.encode())
+            response = await asyncio.wait_for(frame.future, self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts.inc()
+            raise response_timeout(cmd, bytes(frame.buf))
+        finally:
+            loop.remove_reader(fd)
+            frame.cancel()
+        rtt = time.monotonic() - start
+        self.rtt.observe(rtt)
+        if self.debug:
+            stderr.write("%s: %d bytes in %.6f s\n" % (cmd, len(response), rtt))
+            stderr.flush()
+        return response
+
+    async def _acommand(self, cmd, decode=None):
+        """ Coroutine version of _command(): bounded retries with backoff, then gauge_unavailable while the gauge is down """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        self._checkAvailable()
+        delay = self.backoff
+        async with self._lock:
+            for attempt in range(self.retries + 1):
+                try:
+                    reply = self._checkResponse(cmd, await self._atransact(cmd, self._frameSize(cmd)))
+                    value = decode(reply) if decode is not None else reply
+                except self.recoverable as err:
+                    if self.debug:
+                        stderr.write("%s: attempt %d failed: %s\n" % (cmd, attempt + 1, err))
+                    if attempt == self.retries:
+                        self._failed()
+                        raise
+                    self.retryCount.inc()
+                    await asyncio.sleep(delay)
+                    delay *= 2
+                    continue
+                self._succeeded()
+                return value
+
+    async def get_units(self):
+        return await self._acommand(self.unitsCommand)
+
+    async def get_pressure(self):
+        """ Coroutine version of getPressure(): returns a LIST of floats, one per gauge on this controller """
+        return await self._acommand(self.pressureCommand, self._cleanPressureFormat)
+
+
+class AsyncPirani(AsyncPressureGauge, Pirani):
+    """ Pirani gauge driven by the event loop. Initialize with serial.Serial or AsyncMockPirani """
+
+
+class AsyncCapacitance(AsyncPressureGauge, Capacitance):
+    """ Pair of capacitance gauges driven by the event loop. Initialize with serial.Serial or AsyncMockCapacitance """
+
+    async def get_fullscale(self):
+        return await self._acommand(self.fullscaleCommand)
+
+
+if __name__ == '__main__':
+    # reads the mock gauges concurrently a few times, e.g. to check the event loop setup of a machine
+    from tests.fakeSerial import AsyncMockPirani, AsyncMockCapacitance
+
+    async def main():
+        pirani = AsyncPirani(AsyncMockPirani(), False)
+        cap = AsyncCapacitance(AsyncMockCapacitance(), False)
+        print("units: %s %s" % tuple(await asyncio.gather(pirani.get_units(), cap.get_units())))
+        for i in range(5):
+            start = time.monotonic()
+            p, c = await asyncio.gather(pirani.get_pressure(), cap.get_pressure())
+            print("%.02e\t%.02e\t%.02e\t(%.1f ms)" % (p[0], c[0], c[1], (time.monotonic() - start) * 1e3))
+        pirani.close()
+        cap.close()
+
+    asyncio.run(main())
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+"""
+Compact binary recording format for pressure data, written alongside the CSV.
+
+A file is a self-describing header followed by fixed-width records:
+
+    magic       8 bytes   b"VACBIN1\\n"
+    length      4 bytes   little-endian uint32, length of the JSON header that follows
+    header      JSON      format version, columns, units, capacitance fullscale/minscale, chamber, start time;
+                          padded with spaces so the records start on an 8-byte boundary, with room to spare
+    records     one little-endian float64 per column: unix time, elapsed seconds, one per gauge channel, and
+                the interval since the previous record
+
+Because every record has the same width, a file can be memory-mapped and read as a NumPy structured array
+without parsing or copying (BinaryLog). A record cut short by a crash is ignored. toCSV() converts a file
+back into the text format read_vacuum.py writes.
+
+The units in the header are the ones in use when the file was opened. When they change during the run (e.g.
+the session cache held stale units, see session_cache.py), the header is rewritten in place, using its spare
+room, with an entry in "units_changes": {"elapsed": ..., "pirani_units": ..., "capacitance_units": ...}
+applying from the first record whose elapsed time is that or later. BinaryLog.unitsAt() looks them up.
+
+Usage:
+    python binary_log.py info FILE.vbin
+    python binary_log.py csv FILE.vbin [OUT.csv]
+"""
+
+import datetime, json, struct, sys
+
+MAGIC = b"VACBIN1\n"
+FORMAT_VERSION = "1.2"
+# "interval" (seconds since the previous record) was added in 1.1, "units_changes" in 1.2
+HEADER_SPARE = 512 # bytes of padding kept in the header for later units_changes
+COLUMNS = ("time", "elapsed", "pirani", "capacitance 0", "capacitance 1", "interval")
+CSV_ISOFORMAT = "%Y-%m-%d-%H-%M-%S"
+
+
+class bad_binary_log(Exception):
+    def __init__(self, path, reason):
+        self.path = path
+        self.reason = reason
+
+    def __str__(self):
+        return repr("Not a vacuum binary log: %s (%s)" % (self.path, self.reason))
+
+
+def makeHeader(header, spare=0, size=None):
+    """
+    Returns the bytes that start a file: magic, length and the JSON header, padded to an 8-byte boundary with
+    at least `spare` bytes of padding, or to exactly `size` bytes (ValueError if the header does not fit)
+    """
+    body = json.dumps(header, sort_keys=True).encode('utf8')
+    used = len(MAGIC) + 4 + len(body)
+    if size is None:
+        pad = spare + (-(used + spare)) % 8
+    else:
+        pad = size - used
+        if pad < 0:
+            raise ValueError("header needs %d bytes, has %d" % (used, size))
+    body += b" " * pad
+    return MAGIC + struct.pack("<I", len(body)) + body
+
+
+class BinaryRecorder(object):
+    """
+    Encodes samples as fixed-width records. Bytes go to `sink`, any object with write(bytes) --
+    a binary file, or a BufferedWriter around one. Unit changes rewrite the header, which takes a seekable
+    file or a BufferedWriter (writeAt).
+    """
+
+    def __init__(self, sink, columns=COLUMNS, **meta):
+        """
+        Constructor
+        arguments:
+        sink -- where the encoded header and records are written
+        columns -- name of each float64 field in a record
+        meta -- extra header entries (units, fullscale, minscale, chamber, starttime, ...)
+        """
+        self.sink = sink
+        self.columns = list(columns)
+        self.record = struct.Struct("<%dd" % len(self.columns))
+        self.header = {"format_version": FORMAT_VERSION, "columns": self.columns}
+        self.header.update(meta)
+        encoded = makeHeader(self.header, HEADER_SPARE)
+        self.headerSize = len(encoded)
+        self.sink.write(encoded)
+
+    def write(self, values):
+        """ Appends one record; values holds one number per column """
+        self.sink.write(self.record.pack(*values))
+
+    def units(self):
+        """ Returns the (pirani_units, capacitance_units) in effect for the next record """
+        changes = self.header.get("units_changes")
+        current = changes[-1] if changes else self.header
+        return current.get("pirani_units"), current.get("capacitance_units")
+
+    def changeUnits(self, elapsed, pirani_units, capacitance_units):
+        """ Records that the units are these from `elapsed` on, by rewriting the header in place """
+        changes = self.header.setdefault("units_changes", [])
+        changes.append({"elapsed": elapsed, "pirani_units": pirani_units, "capacitance_units": capacitance_units})
+        try:
+            encoded = makeHeader(self.header, size=self.headerSize)
+        except ValueError as err:
+            changes.pop()
+            sys.stderr.write("Binary log: units change at %.3f s not recorded, the header is full (%s)\n" % (elapsed, err))
+            return
+        writeAt = getattr(self.sink, 'writeAt', None)
+        if writeAt is not None:
+            writeAt(0, encoded)
+        else:
+            end = self.sink.tell()
+            self.sink.seek(0)
+            self.sink.write(encoded)
+            self.sink.seek(end)
+
+
+def readHeader(f, path="<file>"):
+    """ Reads and returns (header dict, offset of the first record) from an open binary file """
+    magic = f.read(len(MAGIC))
+    if magic != MAGIC:
+        raise bad_binary_log(path, "bad magic %r" % magic)
+    raw = f.read(4)
+    if len(raw) != 4:
+        raise bad_binary_log(path, "truncated header")
+    length, = struct.unpack("<I", raw)
+    body = f.read(length)
+    if len(body) != length:
+        raise bad_binary_log(path, "truncated header")
+    return json.loads(body.decode('utf8')), len(MAGIC) + 4 + length
+
+
+class BinaryLog(object):
+    """
+    Read access to a binary log. `header` is the decoded JSON header and `records` a read-only NumPy
+    structured array memory-mapped onto the file, with one float64 field per column.
+    """
+
+    def __init__(self, path):
+        import numpy as np
+        self.path = path
+        with open(path, 'rb') as f:
+            self.header, self.offset = readHeader(f, path)
+            f.seek(0, 2)
+            size = f.tell()
+        self.columns = self.header["columns"]
+        self.dtype = np.dtype([(name, '<f8') for name in self.columns])
+        count = (size - self.offset) // self.dtype.itemsize
+        if count > 0:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=self.offset, shape=(count,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, column):
+        """ Returns one column as a (zero-copy) NumPy array """
+        return self.records[column]
+
+    def unitsAt(self, elapsed):
+        """ Returns the (pirani_units, capacitance_units) of a record with this elapsed time """
+        current = self.header
+        for change in self.header.get("units_changes", []):
+            if elapsed >= change["elapsed"]:
+                current = change
+        return current.get("pirani_units"), current.get("capacitance_units")
+
+
+def toCSV(path, out):
+    """ Writes the binary log at path to the open text file out, in the read_vacuum.py CSV format """
+    log = BinaryLog(path)
+    h = log.header
+    out.write("# Converted from %s\n" % path)
+    hasInterval = "interval" in log.columns
+    version = "3.0"
+    if hasInterval:
+        version = "3.2" if "chamber" in h else "3.1"
+    out.write("# Format Version: %s\n" % version)
+    if "chamber" in h:
+        out.write("# Chamber: %s\n" % h["chamber"])
+    out.write("# Columns: DateTime [localtime];Elapsed [s];Pirani; High Range Capacitance Manometer; Low Range Capacitance Manometer%s\n" % ("; Interval [s]" if hasInterval else ""))
+    out.write("# Gauge Units: %s %s\n" % (h.get("pirani_units", "?"), h.get("capacitance_units", "?")))
+    gauges = [c for c in log.columns[2:] if c != "interval"]
+    fmt = "%s\t%.3f" + "\t%.02e" * len(gauges) + ("\t%.3f" if hasInterval else "") + "\n"
+    changes = list(h.get("units_changes", []))
+    for rec in log.records:
+        stamp = datetime.datetime.fromtimestamp(rec["time"]).strftime(CSV_ISOFORMAT)
+        while changes and rec["elapsed"] >= changes[0]["elapsed"]:
+            change = changes.pop(0)
+            out.write("# %s Gauge Units changed: %s %s\n" % (stamp, change["pirani_units"], change["capacitance_units"]))
+        fields = (stamp, rec["elapsed"]) + tuple(rec[g] for g in gauges)
+        if hasInterval:
+            fields += (rec["interval"],)
+        out.write(fmt % fields)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ("info", "csv"):
+        sys.stdout.write("Usage: `python binary_log.py info FILE.vbin` or `python binary_log.py csv FILE.vbin [OUT.csv]`\n")
+        sys.exit()
+    if sys.argv[1] == "info":
+        log = BinaryLog(sys.argv[2])
+        sys.stdout.write("%s\n" % json.dumps(log.header, indent=2, sort_keys=True))
+        sys.stdout.write("%d records\n" % len(log))
+    elif len(sys.argv) > 3:
+        with open(sys.argv[3], 'w') as out:
+            toCSV(sys.argv[2], out)
+    else:
+        toCSV(sys.argv[2], sys.stdout)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+"""
+Gauge broker: one process owns the serial ports, any number of local tools share the gauges.
+
+The broker opens each serial port the first time a client asks for it and keeps it open. Every port has one
+worker thread that runs the queued commands for the gauges on that port in arrival order, so commands from
+different clients are never interleaved on the wire. Replies are cached: a request that a cached reply no
+older than its max_age can answer is answered at once, and a request for a command that is already queued or
+in flight for that gauge joins it instead of being sent again. Ten tools polling the same Pirani cost one
+gauge query per freshness window.
+
+Protocol (JSON lines over a Unix socket or TCP; see publisher.listen):
+    request   {"id": 7, "port": "/dev/ttyUSB0", "gauge": "pirani", "command": "pressure", "max_age": 0.5}
+    reply     {"id": 7, "value": "7.60E+2", "time": 1715090001.2, "cached": false}
+    error     {"id": 7, "error": "'Bad ack: NAK'"}
+"gauge" is "pirani" or "capacitance"; "command" is "pressure", "units" or "fullscale" (capacitance only).
+"value" is the gauge's reply text, as returned by its _sendCmdGetResp(); each client decodes it with its own
+settings (e.g. capacitance minscale). Ports named "test-pirani" / "test-capacitance" are served by the mock gauges.
+
+On the client side, BrokerConnection is one connection for one port, and RemotePirani / RemoteCapacitance are
+drop-in replacements for Pirani / Capacitance that go through the broker (read_vacuum.py --broker ADDRESS).
+Retries happen in the broker only: it retries, backs off and reopens the real port as a local reader would, so
+an error it reports is final for that command. Clients retry (and reconnect) only when the broker connection fails.
+
+Usage:
+    python gauge_broker.py ADDRESS [--freshness SECONDS]
+"""
+
+import argparse, json, queue, signal, socket, sys, threading, time
+import metrics
+from publisher import listen, connect
+from pressure_gauges import PressureGauge, Pirani, Capacitance
+from sys import stderr
+
+GAUGES = {"pirani": Pirani, "capacitance": Capacitance}
+COMMANDS = {"pressure": "pressureCommand", "units": "unitsCommand", "fullscale": "fullscaleCommand"}
+
+_requests = metrics.counter("vacuum_broker_requests_total", "Gauge requests received by the broker")
+_cacheHits = metrics.counter("vacuum_broker_cache_hits_total", "Broker requests answered from a fresh cached reply")
+_coalesced = metrics.counter("vacuum_broker_coalesced_total", "Broker requests merged into a query already queued or in flight")
+_queries = metrics.counter("vacuum_broker_queries_total", "Commands the broker actually sent to a gauge")
+
+
+class broker_error(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr("Gauge broker error: %s" % self.message)
+
+
+class PortWorker(object):
+    """ The gauges on one serial port, the queue of commands for them, and the cache of their replies """
+
+    def __init__(self, port, serialInstance, debug):
+        self.port = port
+        self.serial = serialInstance
+        self.debug = debug
+        self.gauges = {} # gauge kind -> PressureGauge on this port
+        self.cache = {} # (kind, command) -> (time, value)
+        self.pending = {} # (kind, command) -> reply callbacks waiting on the queued/in-flight query
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name="PortWorker %s" % port)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def gauge(self, kind):
+        if kind not in self.gauges:
+            self.gauges[kind] = GAUGES[kind](self.serial, self.debug)
+        return self.gauges[kind]
+
+    def submit(self, kind, command, maxAge, reply):
+        """ Arranges for reply(message dict) to be called with the answer to command; never blocks on the gauge """
+        key = (kind, command)
+        with self.lock:
+            cached = self.cache.get(key)
+            if cached is not None and time.time() - cached[0] <= maxAge:
+                _cacheHits.inc()
+                reply({"value": cached[1], "time": cached[0], "cached": True})
+                return
+            if key in self.pending:
+                _coalesced.inc()
+                self.pending[key].append(reply)
+                return
+            self.pending[key] = [reply]
+        self.queue.put(key)
+
+    def _run(self):
+        while True:
+            key = self.queue.get()
+            if key is None:
+                return
+            kind, command = key
+            try:
+                gauge = self.gauge(kind)
+                value = gauge._command(getattr(gauge, COMMANDS[command]))
+                message = {"value": value, "time": time.time(), "cached": False}
+            except Exception as err:
+                message = {"error": str(err)}
+            _queries.inc()
+            with self.lock:
+                if "value" in message:
+                    self.cache[key] = (message["time"], message["value"])
+                waiters = self.pending.pop(key)
+            for reply in waiters:
+                reply(message)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.serial.close()
+
+
+class GaugeBroker(object):
+    """ Accepts clients at address and routes their requests to one PortWorker per serial port """
+
+    def __init__(self, address, freshness=0.5, debug=False):
+        """
+        Constructor
+        arguments:
+        address -- "host:port" for TCP, or a filesystem path for a Unix socket
+        freshness -- default max_age, in seconds, of a cached reply for requests that do not give one
+        debug -- True to print debug statements, False otherwise
+        """
+        self.address = address
+        self.freshness = freshness
+        self.debug = debug
+        self.workers = {}
+        self.lock = threading.Lock()
+        self.sock = listen(address)
+        self.thread = threading.Thread(target=self._accept, name="GaugeBroker")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def openSerial(self, port):
+        """ Opens a port: the mock gauges for "test-pirani"/"test-capacitance", otherwise a real serial port """
+        if port == "test-pirani":
+            from tests.fakeSerial import MockPirani
+            return MockPirani(port)
+        if port == "test-capacitance":
+            from tests.fakeSerial import MockCapacitance
+            return MockCapacitance(port)
+        import serial
+        return serial.Serial(port, 9600, 8, 'N', 1)
+
+    def worker(self, port):
+        with self.lock:
+            if port not in self.workers:
+                self.workers[port] = PortWorker(port, self.openSerial(port), self.debug)
+                stderr.write("\tBroker opened %s\n" % port)
+            return self.workers[port]
+
+    def _accept(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return # closed
+            thread = threading.Thread(target=self._serve, args=(conn,), name="BrokerClient")
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, conn):
+        """ Reads one client's requests; replies go back on the same connection as they complete, tagged by id """
+        writeLock = threading.Lock()
+        def send(message):
+            try:
+                with writeLock:
+                    conn.sendall((json.dumps(message) + "\n").encode('utf8'))
+            except OSError:
+                pass # client went away
+        try:
+            for line in conn.makefile('rb'):
+                _requests.inc()
+                request = None
+                try:
+                    request = json.loads(line.decode('utf8'))
+                    rid = request.get("id")
+                    kind, command = request["gauge"], request["command"]
+                    if kind not in GAUGES or not hasattr(GAUGES[kind], COMMANDS.get(command, "")):
+                        raise ValueError("unknown gauge/command %s/%s" % (kind, command))
+                    maxAge = float(request.get("max_age", self.freshness))
+                    worker = self.worker(request["port"])
+                except Exception as err:
+                    send({"id": request.get("id") if isinstance(request, dict) else None, "error": str(err)})
+                    continue
+                def reply(message, rid=rid):
+                    message = dict(message)
+                    message["id"] = rid
+                    send(message)
+                worker.submit(kind, command, maxAge, reply)
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR) # wakes the accept() in progress
+        except OSError:
+            pass
+        self.sock.close()
+        for worker in list(self.workers.values()):
+            worker.close()
+
+
+class BrokerConnection(object):
+    """ A client connection to a GaugeBroker for the gauges on one serial port """
+
+    def __init__(self, address, port, maxAge=None):
+        """
+        Constructor
+        arguments:
+        address -- where the broker listens
+        port -- serial port the gauges are on, as the broker should open it (e.g. /dev/ttyUSB0)
+        maxAge -- oldest cached reply acceptable, in seconds; None uses the broker's freshness window
+        """
+        self.address = address
+        self.port = port # ConcurrentSampler groups gauges by this, as it does real serial ports
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        self.nextId = 0
+        self.open()
+
+    def open(self):
+        """ (Re)connects to the broker """
+        self.sock = connect(self.address)
+        self.lines = self.sock.makefile('rb')
+
+    def request(self, kind, command):
+        """
+        Returns the gauge's reply text to command. Raises broker_error if the gauge failed (after the broker's
+        retries), and OSError if the connection to the broker did.
+        """
+        with self.lock:
+            self.nextId += 1
+            request = {"id": self.nextId, "port": self.port, "gauge": kind, "command": command}
+            if self.maxAge is not None:
+                request["max_age"] = self.maxAge
+            self.sock.sendall((json.dumps(request) + "\n").encode('utf8'))
+            line = self.lines.readline()
+        if not line:
+            raise ConnectionResetError("the gauge broker closed the connection")
+        message = json.loads(line.decode('utf8'))
+        if "error" in message:
+            raise broker_error(message["error"])
+        return message["value"]
+
+    def close(self):
+        self.lines.close()
+        self.sock.close()
+
+
+class RemoteGauge(object):
+    """ Mixin for the PressureGauge classes: commands go through a BrokerConnection (innerSerial) instead of a port """
+
+    kind = None
+    # broker_error is not recoverable: the broker has already retried the gauge and backs it off itself.
+    # A failed connection (OSError) is, and reconnect() then reopens the connection to the broker
+    recoverable = PressureGauge.recoverable
+
+    def _sendCmdGetResp(self, cmd):
+        for name, attr in COMMANDS.items():
+            if getattr(self, attr, None) == cmd:
+                return self.innerSerial.request(self.kind, name)
+        raise broker_error("no broker command for %r" % cmd)
+
+    def flush(self):
+        pass # nothing to discard: the broker frames every reply
+
+
+class RemotePirani(RemoteGauge, Pirani):
+    kind = "pirani"
+
+
+class RemoteCapacitance(RemoteGauge, Capacitance):
+    kind = "capacitance"
+
+
+def handleExit(signal, frame):
+    raise SystemExit
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Own the gauge serial ports and share them between local clients")
+    parser.add_argument("address", help="HOST:PORT (TCP) or Unix socket path to listen at")
+    parser.add_argument("--freshness", type=float, default=0.5, help="seconds a cached reply stays fresh by default (default 0.5)")
+    args = parser.parse_args()
+
+    signal.signal(signal.SIGINT, handleExit)
+    signal.signal(signal.SIGTERM, handleExit)
+    broker = GaugeBroker(args.address, args.freshness)
+    stderr.write("Gauge broker listening at %s\n" % args.address)
+    try:
+        while True:
+            time.sleep(3600)
+    except SystemExit:
+        None
+    broker.close()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""
+Alarms and interlocks evaluated on every sample, inside the acquisition loop.
+
+Rules come from a JSON file and are compiled once, when the Interlock is created, into small predicates
+with the column index and limits bound in; evaluating a sample is then a few float comparisons per rule.
+A rule is either clear or in alarm. It fires when it enters alarm and clears when it leaves it; hysteresis
+(a separate "clear" level) stops a reading that hovers around a limit from firing every sample.
+Rule types:
+    above / below         a channel's reading is over / under "threshold" (clears past "clear", default threshold)
+    rate_of_rise          a channel rises faster than "rate" (pressure units per second), fitted over the last
+                          "window" seconds (default 60; see analytics.RateOfRise); clears under "clear"
+    disagreement          two "channels" differ by more than a "factor" (ratio), while both read inside "range";
+                          clears under "clear"
+NaN readings (a failed gauge) leave a rule in its current state.
+
+Each firing or clearing becomes an event, written to the output stream as a comment line and handed to the
+rule's actions through a Dispatcher. Every action target (a file, a socket address, a command line) has its own
+bounded queue and worker thread, so a slow action never delays the acquisition loop, and a dead alarm socket
+never delays a command to close a valve (if a queue is full the event is dropped and counted instead). Actions:
+    "file:PATH"           append the event as a JSON line to PATH
+    "socket:ADDRESS"      send the event as a JSON line to HOST:PORT or a Unix socket path (5 s time limit)
+    "command:CMD ARGS"    run a command with the event in VACUUM_* environment variables (30 s time limit)
+
+Example rules file:
+    {"rules": [
+        {"name": "vent", "type": "above", "channel": "pirani", "threshold": 1.0, "clear": 0.5,
+         "actions": ["file:/var/log/vacuum-alarms.jsonl", "command:/usr/local/bin/close-gate-valve"]},
+        {"name": "leak", "type": "rate_of_rise", "channel": "capacitance 1", "rate": 1e-5, "window": 120,
+         "actions": ["socket:/run/vacuum-alarms.sock"]},
+        {"name": "gauges disagree", "type": "disagreement", "channels": ["pirani", "capacitance 0"],
+         "factor": 3.0, "clear": 2.0, "range": [0.01, 100.0], "chambers": ["1"], "actions": ["file:alarms.jsonl"]}
+    ]}
+A rule with "chambers" only applies to those chambers.
+"""
+
+import json, os, queue, shlex, subprocess, threading, time
+import metrics
+from analytics import RateOfRise
+from publisher import connect
+from sys import stderr
+
+COLUMNS = ("pirani", "capacitance 0", "capacitance 1")
+
+_events = metrics.counter("vacuum_interlock_events_total", "Interlock rules that fired or cleared")
+_dropped = metrics.counter("vacuum_interlock_dropped_total", "Interlock actions dropped because the dispatch queue was full")
+_actionFailures = metrics.counter("vacuum_interlock_action_failures_total", "Interlock actions that raised an error")
+
+
+class rule_error(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr("Bad interlock rule: %s" % self.message)
+
+
+def _level(index, threshold, clear, above):
+    """ Predicate for above/below rules: returns (in alarm, value), or (None, value) if the reading is NaN """
+    def check(active, t, values):
+        v = values[index]
+        if v != v:
+            return None, v
+        if above:
+            return (v > clear if active else v > threshold), v
+        return (v < clear if active else v < threshold), v
+    return check
+
+
+def _rateOfRise(index, rate, clear, window):
+    rise = RateOfRise(window)
+    def check(active, t, values):
+        v = values[index]
+        if v != v:
+            return None, v
+        rise.update(t, v)
+        r = rise.rate()
+        if r is None:
+            return None, r
+        return (r > clear if active else r > rate), r
+    return check
+
+
+def _disagreement(first, second, factor, clear, low, high):
+    def check(active, t, values):
+        a, b = values[first], values[second]
+        if not (low <= a <= high and low <= b <= high) or a <= 0 or b <= 0:
+            return None, None # NaN, or outside the range where both gauges are trustworthy
+        ratio = a / b if a > b else b / a
+        return (ratio > clear if active else ratio > factor), ratio
+    return check
+
+
+class Rule(object):
+    """ One compiled rule: its predicate, its state and its actions """
+
+    def __init__(self, spec, columns=COLUMNS):
+        """
+        Constructor
+        arguments:
+        spec -- the rule's dict from the rules file
+        columns -- names of the sample values, in order
+        """
+        self.name = spec.get("name") or spec.get("type")
+        self.kind = spec.get("type")
+        self.actions = [parseAction(a) for a in spec.get("actions", [])]
+        self.chambers = None if spec.get("chambers") is None else set(str(c) for c in spec["chambers"])
+        self.active = False
+        self.value = None # what the predicate last looked at (reading, rate or ratio)
+        columns = list(columns)
+
+        def column(name):
+            if name not in columns:
+                raise rule_error("%s: unknown channel %r (one of %s)" % (self.name, name, ", ".join(columns)))
+            return columns.index(name)
+        try:
+            if self.kind in ("above", "below"):
+                threshold = float(spec["threshold"])
+                self.check = _level(column(spec["channel"]), threshold, float(spec.get("clear", threshold)), self.kind == "above")
+            elif self.kind == "rate_of_rise":
+                rate = float(spec["rate"])
+                self.check = _rateOfRise(column(spec["channel"]), rate, float(spec.get("clear", rate)), float(spec.get("window", 60.)))
+            elif self.kind == "disagreement":
+                first, second = spec["channels"]
+                factor = float(spec["factor"])
+                low, high = spec.get("range", (0., float('inf')))
+                self.check = _disagreement(column(first), column(second), factor, float(spec.get("clear", factor)), float(low), float(high))
+            else:
+                raise rule_error("%s: unknown type %r" % (self.name, self.kind))
+        except (KeyError, TypeError, ValueError) as err:
+            raise rule_error("%s: %s" % (self.name, err))
+
+    def evaluate(self, t, values):
+        """ Updates the state with one sample; returns "alarm" or "clear" if the state changed, else None """
+        active, value = self.check(self.active, t, values)
+        self.value = value
+        if active is None or active == self.active:
+            return None
+        self.active = active
+        return "alarm" if active else "clear"
+
+
+def parseAction(text):
+    """
+    Returns a callable(event dict) for an action string ("file:...", "socket:...", "command:...").
+    Its `target` attribute is the action string: the Dispatcher runs each target's actions on their own worker.
+    """
+    kind, sep, target = text.partition(":")
+    if not sep or not target:
+        raise rule_error("action %r is not KIND:TARGET" % text)
+    if kind == "file":
+        def action(event):
+            with open(target, 'a') as f:
+                f.write(json.dumps(event, sort_keys=True) + "\n")
+    elif kind == "socket":
+        def action(event):
+            sock = connect(target, timeout=5.)
+            try:
+                sock.sendall((json.dumps(event, sort_keys=True) + "\n").encode('utf8'))
+            finally:
+                sock.close()
+    elif kind == "command":
+        args = shlex.split(target)
+        def action(event):
+            env = dict(os.environ)
+            for key, value in event.items():
+                env["VACUUM_%s" % key.upper()] = str(value)
+            subprocess.run(args, env=env, timeout=30., check=True)
+    else:
+        raise rule_error("unknown action kind %r" % kind)
+    action.target = text
+    return action
+
+
+class _Lane(object):
+    """ The queue and worker thread of one action target """
+
+    def __init__(self, target, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.stopped = False
+        self.busy = False # an action is running
+        self.thread = threading.Thread(target=self._run, name="Interlock %s" % target)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None or self.stopped:
+                self.queue.task_done()
+                return
+            action, event = item
+            self.busy = True
+            try:
+                action(event)
+            except Exception as err:
+                _actionFailures.inc()
+                stderr.write("Interlock action %s for %s failed: %s\n" % (getattr(action, 'target', action), event.get("rule"), err))
+            finally:
+                self.busy = False
+                self.queue.task_done()
+
+    def stop(self):
+        self.stopped = True
+        try:
+            self.queue.put_nowait(None) # wakes an idle worker; a busy one sees `stopped` after its action
+        except queue.Full:
+            pass
+
+
+class Dispatcher(object):
+    """ Runs actions on worker threads, one per action target; submit() never blocks """
+
+    def __init__(self, size=256):
+        """
+        Constructor
+        arguments:
+        size -- events each target may have waiting; more are dropped
+        """
+        self.size = size
+        self.lanes = {}
+        self.lock = threading.Lock()
+
+    def submit(self, action, event):
+        target = getattr(action, 'target', action)
+        lane = self.lanes.get(target)
+        if lane is None:
+            with self.lock:
+                lane = self.lanes.get(target)
+                if lane is None:
+                    lane = self.lanes[target] = _Lane(target, self.size)
+        try:
+            lane.queue.put_nowait((action, event))
+        except queue.Full:
+            _dropped.inc()
+
+    def close(self, wait=True, timeout=10.):
+        """
+        Stops the workers once the queued actions have run, waiting at most timeout seconds in all
+        (with wait=False, once the running actions finish); actions still queued then are abandoned
+        """
+        deadline = time.monotonic() + timeout
+        with self.lock:
+            lanes = list(self.lanes.items())
+        if wait:
+            for target, lane in lanes:
+                while lane.queue.unfinished_tasks and time.monotonic() < deadline:
+                    time.sleep(0.01)
+        for target, lane in lanes:
+            lane.stop()
+        for target, lane in lanes:
+            lane.thread.join(max(0., deadline - time.monotonic()))
+            left = len([item for item in list(lane.queue.queue) if item is not None])
+            if lane.busy:
+                left += 1
+            if left:
+                stderr.write("Interlock: %d action(s) for %s not run before shutdown\n" % (left, target))
+
+
+class Interlock(object):
+    """ The rules that apply to one chamber, evaluated together on each sample """
+
+    def __init__(self, specs, chamber, dispatcher, columns=COLUMNS):
+        """
+        Constructor
+        arguments:
+        specs -- list of rule dicts (the "rules" of a rules file)
+        chamber -- this chamber's name; rules with "chambers" that leave it out are skipped
+        dispatcher -- Dispatcher that runs the actions
+        columns -- names of the sample values, in order
+        """
+        self.chamber = str(chamber)
+        self.dispatcher = dispatcher
+        rules = [Rule(spec, columns) for spec in specs]
+        self.rules = [r for r in rules if r.chambers is None or self.chamber in r.chambers]
+
+    def evaluate(self, t, timestamp, values):
+        """
+        Checks one sample (elapsed time t, unix timestamp, values in column order) against every rule, dispatches
+        the actions of the rules that fired or cleared, and returns their events
+        """
+        events = []
+        for rule in self.rules:
+            state = rule.evaluate(t, values)
+            if state is None:
+                continue
+            _events.inc()
+            event = {"rule": rule.name, "type": rule.kind, "state": state, "chamber": self.chamber,
+                     "time": timestamp, "elapsed": t, "value": rule.value}
+            for action in rule.actions:
+                self.dispatcher.submit(action, event)
+            events.append(event)
+        return events
+
+
+def load(path):
+    """ Returns the list of rule dicts in a rules file """
+    with open(path) as f:
+        return json.load(f)["rules"]
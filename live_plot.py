@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+Live pressure plot whose refresh cost does not grow with the length of the run.
+
+LivePlot draws from a SampleStore: a bounded window of the most recent raw samples at full resolution,
+preceded by the min/max envelope of the store's downsampled tiers (1-minute, then 1-hour buckets) for older
+data. The number of points drawn is capped, so each refresh costs the same however long the pumpdown goes
+on. Each refresh updates the data of the existing Line2D artists (and optionally blits them) instead of
+clearing and replotting the figure.
+"""
+
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+class LivePlot(object):
+    """
+    Interactive plot of the columns of a SampleStore against elapsed time, on a log y axis.
+    Append samples to the store, then call refresh() to redraw.
+    """
+
+    def __init__(self, store, labels, title='Pressure in chamber', window=2000, historyBuckets=500, blit=False):
+        """
+        Constructor
+        arguments:
+        store -- the SampleStore to draw from
+        labels -- legend label for each store column
+        title -- axes title
+        window -- number of recent raw samples drawn at full resolution
+        historyBuckets -- maximum number of min/max buckets drawn from each downsampled tier
+        blit -- True to redraw only the lines when the axis limits have not changed
+        """
+        self.store = store
+        self.labels = list(labels)
+        self.window = window
+        self.historyBuckets = historyBuckets
+        self.blit = blit
+        self.background = None
+        self.limits = None
+
+        self.figure = plt.figure(1)
+        plt.ion()
+        self.axes = self.figure.add_subplot(1, 1, 1)
+        self.axes.set_yscale('log')
+        self.axes.set_xlabel('Time (seconds)')
+        self.axes.set_ylabel('Pressure')
+        self.axes.set_title(title)
+        self.lines = [self.axes.plot([], [], label=label, animated=blit)[0] for label in self.labels]
+        self.status = self.axes.text(0.01, 0.01, '', transform=self.axes.transAxes, fontsize='small', animated=blit)
+        self.axes.legend(loc='upper right')
+        plt.show()
+
+    def _series(self):
+        """ Returns (times, values) to draw: tier envelopes for old data, then the raw window; values has a column per line """
+        t, v = self.store.latest(self.window)
+        times = [t]
+        values = [v]
+        cutoff = t[0] if len(t) else np.inf
+        for tier in self.store.tiers:
+            rows = tier.rows(self.historyBuckets)
+            rows = rows[tier.times(rows) + tier.seconds <= cutoff]
+            if not len(rows):
+                continue
+            cutoff = rows[0, 0]
+            # each bucket becomes two points: its min at the bucket start, its max half a bucket later
+            bt = tier.times(rows)
+            times.insert(0, np.column_stack((bt, bt + tier.seconds / 2)).ravel())
+            envelope = [np.column_stack((tier.minimum(rows, i), tier.maximum(rows, i))).ravel() for i in range(len(self.lines))]
+            values.insert(0, np.column_stack(envelope))
+        return np.concatenate(times), np.concatenate(values)
+
+    def setStatus(self, text):
+        """ Sets the line of text in the lower left corner of the plot (e.g. the pumpdown analytics); shown at the next refresh """
+        self.status.set_text(text)
+
+    def refresh(self):
+        """ Pushes the current data into the lines, rescales, and redraws """
+        t, v = self._series()
+        for i, line in enumerate(self.lines):
+            line.set_data(t, v[:, i])
+        self.axes.relim()
+        self.axes.autoscale_view()
+        canvas = self.figure.canvas
+        limits = (self.axes.get_xlim(), self.axes.get_ylim())
+        if not self.blit or limits != self.limits or self.background is None:
+            # limits moved: the whole figure (ticks, labels) has to be redrawn
+            canvas.draw()
+            if self.blit:
+                self.background = canvas.copy_from_bbox(self.axes.bbox)
+                for artist in self.lines + [self.status]:
+                    self.axes.draw_artist(artist)
+                canvas.blit(self.axes.bbox)
+            self.limits = limits
+        else:
+            canvas.restore_region(self.background)
+            for artist in self.lines + [self.status]:
+                self.axes.draw_artist(artist)
+            canvas.blit(self.axes.bbox)
+        canvas.flush_events()
+
+    def pause(self, seconds):
+        """ Waits while letting the figure handle GUI events """
+        plt.pause(seconds)
+
+    def close(self):
+        plt.close(self.figure)
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+Time index over a directory of vacuum-*.csv logs, for time-range queries without loading whole files.
+
+LogIndex scans the format-3.x files written by read_vacuum.py / vacuum_daemon.py in fixed-size chunks and
+records, for each file, its chamber, first and last sample time, row count, and a sparse list of
+(time, byte offset) marks every `stride` rows. The index is saved as JSON in the log directory
+(.vacuum-index.json); on the next update only new files, and the new tail of files that grew, are scanned.
+
+A query seeks straight to the mark before the start of the range and streams rows until its end;
+aggregate() reduces those rows to min/max/mean per column per time bucket. Every numeric column after Elapsed
+is a value column, so in format-3.1 and later files the last one is the sample interval. Format-3.2 files name
+their chamber in a "# Chamber:" line, which overrides the chamber taken from the file name.
+
+Usage:
+    python log_index.py DIR index
+    python log_index.py DIR query START END [--chamber N]
+    python log_index.py DIR stats START END [--chamber N] [--bucket SECONDS]
+START and END are local times such as 2024-05-07T14:00 or "2024-05-07 14:00:30".
+"""
+
+import argparse, bisect, datetime, glob, json, os, re, sys, time
+
+INDEX_NAME = ".vacuum-index.json"
+INDEX_VERSION = 1
+CSV_ISOFORMAT = "%Y-%m-%d-%H-%M-%S"
+CHUNK = 1 << 20
+# vacuum-<time>.csv (read_vacuum.py) or vacuum-<chamber>-<time>.csv (vacuum_daemon.py)
+NAME_RE = re.compile(r"^vacuum-(?:(?P<chamber>.+)-)?\d{4}-\d\d-\d\d-\d\d-\d\d-\d\d\.csv$")
+
+
+class StampParser(object):
+    """ Converts DateTime column values to unix time, caching the mktime() of each date-and-hour prefix """
+
+    def __init__(self):
+        self.hours = {}
+
+    def __call__(self, stamp):
+        base = self.hours.get(stamp[:13])
+        if base is None:
+            base = time.mktime((int(stamp[0:4]), int(stamp[5:7]), int(stamp[8:10]), int(stamp[11:13]), 0, 0, 0, 0, -1))
+            self.hours[stamp[:13]] = base
+        return base + int(stamp[14:16]) * 60 + int(stamp[17:19])
+
+
+def iterLines(f, offset=0):
+    """ Yields (byte offset, line bytes) for each complete line of binary file f, from offset on, reading in chunks """
+    f.seek(offset)
+    rest = b""
+    while True:
+        chunk = f.read(CHUNK)
+        if not chunk:
+            return
+        chunk = rest + chunk
+        lines = chunk.split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield offset, line
+            offset += len(line) + 1
+
+
+def parseRow(line, stamps):
+    """ Returns (unix time, [values]) for a data line, or None for header/comment lines """
+    if not line[:1].isdigit():
+        return None
+    fields = line.split(b"\t")
+    try:
+        return stamps(fields[0].decode('ascii')), [float(x) for x in fields[2:]]
+    except (ValueError, IndexError, UnicodeDecodeError):
+        return None
+
+
+class LogIndex(object):
+    """
+    Persistent index of the vacuum logs in one directory.
+    entries maps file name -> {chamber, size, mtime, end, rows, first, last, marks}; `end` is the byte offset
+    after the last complete line scanned, `marks` the sparse [time, offset] list.
+    """
+
+    def __init__(self, directory, stride=256):
+        self.directory = directory
+        self.stride = stride
+        self.path = os.path.join(directory, INDEX_NAME)
+        self.entries = {}
+        self.stamps = StampParser()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                saved = json.load(f)
+            if saved.get("version") == INDEX_VERSION and saved.get("stride") == stride:
+                self.entries = saved["files"]
+
+    def save(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump({"version": INDEX_VERSION, "stride": self.stride, "files": self.entries}, f)
+        os.rename(tmp, self.path)
+
+    def update(self):
+        """ Indexes new files and the new tails of grown files, forgets deleted ones, and saves the index """
+        names = set(os.path.basename(p) for p in glob.glob(os.path.join(self.directory, "vacuum-*.csv")))
+        for name in list(self.entries):
+            if name not in names:
+                del self.entries[name]
+        for name in sorted(names):
+            st = os.stat(os.path.join(self.directory, name))
+            entry = self.entries.get(name)
+            if entry is not None and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+                continue
+            if entry is None or st.st_size < entry["end"]:
+                m = NAME_RE.match(name)
+                entry = {"chamber": m.group("chamber") if m else None, "end": 0, "rows": 0,
+                         "first": None, "last": None, "marks": []}
+            self._scan(name, entry)
+            entry["size"] = st.st_size
+            entry["mtime"] = st.st_mtime
+            self.entries[name] = entry
+        self.save()
+
+    def _scan(self, name, entry):
+        with open(os.path.join(self.directory, name), 'rb') as f:
+            for offset, line in iterLines(f, entry["end"]):
+                entry["end"] = offset + len(line) + 1
+                if line.startswith(b"# Chamber:"):
+                    entry["chamber"] = line[len(b"# Chamber:"):].strip().decode('utf8')
+                    continue
+                parsed = parseRow(line, self.stamps)
+                if parsed is None:
+                    continue
+                t = parsed[0]
+                if entry["rows"] % self.stride == 0:
+                    entry["marks"].append([t, offset])
+                if entry["first"] is None:
+                    entry["first"] = t
+                entry["last"] = t
+                entry["rows"] += 1
+
+    def files(self, start, end, chamber=None):
+        """ Returns the names of indexed files with samples between unix times start and end, oldest first """
+        out = []
+        for name, e in self.entries.items():
+            if e["first"] is None or e["last"] < start or e["first"] > end:
+                continue
+            if chamber is not None and e["chamber"] != str(chamber):
+                continue
+            out.append((e["first"], name))
+        return [name for first, name in sorted(out)]
+
+    def query(self, start, end, chamber=None):
+        """ Yields (file name, unix time, [values]) for every sample between start and end """
+        for name in self.files(start, end, chamber):
+            e = self.entries[name]
+            times = [m[0] for m in e["marks"]]
+            i = max(bisect.bisect_left(times, start) - 1, 0)
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                for offset, line in iterLines(f, e["marks"][i][1]):
+                    if offset >= e["end"]:
+                        break
+                    parsed = parseRow(line, self.stamps)
+                    if parsed is None:
+                        continue
+                    t, values = parsed
+                    if t > end:
+                        break
+                    if t >= start:
+                        yield name, t, values
+
+    def aggregate(self, start, end, bucket, chamber=None):
+        """
+        Reduces the samples between start and end to buckets `bucket` seconds long.
+        Returns a sorted list of (bucket start time, count, mins, maxs, means), with one entry per column in each list.
+        """
+        acc = {}
+        for name, t, values in self.query(start, end, chamber):
+            b = start + ((t - start) // bucket) * bucket
+            a = acc.get(b)
+            if a is None:
+                acc[b] = [1, list(values), list(values), list(values)]
+                continue
+            a[0] += 1
+            for i, v in enumerate(values):
+                if v < a[1][i]:
+                    a[1][i] = v
+                if v > a[2][i]:
+                    a[2][i] = v
+                a[3][i] += v
+        return [(b, a[0], a[1], a[2], [s / a[0] for s in a[3]]) for b, a in sorted(acc.items())]
+
+
+def parseTime(text):
+    """ Parses a local time like 2024-05-07T14:00, '2024-05-07 14:00:30' or the CSV DateTime format; returns unix time """
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d", CSV_ISOFORMAT):
+        try:
+            return time.mktime(datetime.datetime.strptime(text, fmt).timetuple())
+        except ValueError:
+            continue
+    raise ValueError("Unrecognized time: %s" % text)
+
+
+def formatTime(t):
+    return datetime.datetime.fromtimestamp(t).strftime(CSV_ISOFORMAT)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Index and query vacuum-*.csv logs")
+    parser.add_argument("directory", help="directory holding the vacuum-*.csv files")
+    parser.add_argument("command", choices=("index", "query", "stats"))
+    parser.add_argument("start", nargs="?", help="start of the time range (local time)")
+    parser.add_argument("end", nargs="?", help="end of the time range (local time)")
+    parser.add_argument("--chamber", help="only files from this chamber")
+    parser.add_argument("--bucket", type=float, default=3600., help="stats bucket length in seconds (default 3600)")
+    args = parser.parse_args()
+
+    index = LogIndex(args.directory)
+    index.update()
+    if args.command == "index":
+        for name in sorted(index.entries):
+            e = index.entries[name]
+            if e["first"] is None:
+                sys.stdout.write("%s\tchamber %s\tno data\n" % (name, e["chamber"]))
+            else:
+                sys.stdout.write("%s\tchamber %s\t%s .. %s\t%d rows\n" % (name, e["chamber"], formatTime(e["first"]), formatTime(e["last"]), e["rows"]))
+        sys.exit()
+    if args.start is None or args.end is None:
+        parser.error("%s needs START and END" % args.command)
+    start = parseTime(args.start)
+    end = parseTime(args.end)
+    if args.command == "query":
+        for name, t, values in index.query(start, end, args.chamber):
+            sys.stdout.write("%s\t%s\t%s\n" % (formatTime(t), "\t".join("%.02e" % v for v in values), name))
+    else:
+        for b, count, mins, maxs, means in index.aggregate(start, end, args.bucket, args.chamber):
+            cols = "\t".join("%.02e/%.02e/%.02e" % (lo, hi, m) for lo, hi, m in zip(mins, maxs, means))
+            sys.stdout.write("%s\t%d\t%s\n" % (formatTime(b), count, cols))
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+Always-on counters and histograms for the acquisition loop, served in the Prometheus text format.
+
+Instrumented code gets its metrics once (counter(), histogram(), level()) and then only calls inc() or
+observe() on the hot path: an uncontended lock, a bisect and two additions. Nothing is formatted or sent
+until someone scrapes, and levels such as the writer queue depth are computed by a callback only at
+scrape time. All metrics live in one module-level Registry, REGISTRY.
+
+serve(address) exposes the registry:
+    "127.0.0.1:9108" or ":9108"   HTTP; GET /metrics (any path works) returns the text format
+    "/run/vacuum-metrics.sock"     Unix socket; every connection gets the text format, then EOF
+
+Metric names follow Prometheus conventions: vacuum_*_total for counters, *_seconds for durations.
+Labels are fixed when a metric is created, e.g. histogram("vacuum_serial_rtt_seconds", ..., gauge="pirani").
+"""
+
+import bisect, os, socketserver, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sys import stderr
+
+# round-trip / refresh times, from half a millisecond to several seconds
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5.)
+
+
+def _labelText(labels, extra=()):
+    pairs = sorted(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+
+
+class Counter(object):
+    """ A count that only goes up """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def render(self):
+        return ["%s%s %s" % (self.name, _labelText(self.labels), self.value)]
+
+
+class Level(object):
+    """ A value that goes up and down (a Prometheus gauge): set it, or give a callback read at scrape time """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels, fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+        self.value = 0.
+
+    def set(self, value):
+        self.value = value
+
+    def render(self):
+        value = self.value
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception as err:
+                stderr.write("metrics: %s callback failed: %s\n" % (self.name, err))
+                return []
+        return ["%s%s %s" % (self.name, _labelText(self.labels), value)]
+
+
+class Histogram(object):
+    """ Distribution of observed values over fixed buckets, with their count and sum """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # the last slot is +Inf
+        self.sum = 0.
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def render(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + ("+Inf",), counts):
+            cumulative += n
+            lines.append("%s_bucket%s %d" % (self.name, _labelText(self.labels, [("le", bound)]), cumulative))
+        lines.append("%s_sum%s %r" % (self.name, _labelText(self.labels), total))
+        lines.append("%s_count%s %d" % (self.name, _labelText(self.labels), cumulative))
+        return lines
+
+
+class Registry(object):
+    """ All metrics of the process, keyed by name and labels """
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = cls(name, help, key[1], **kwargs)
+                self.metrics[key] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError("metric %s is already registered as a %s" % (name, metric.kind))
+            return metric
+
+    def render(self):
+        """ Returns all metrics in the Prometheus text exposition format """
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        out = []
+        lastName = None
+        for (name, labels), metric in metrics:
+            if name != lastName:
+                out.append("# HELP %s %s" % (name, metric.help))
+                out.append("# TYPE %s %s" % (name, metric.kind))
+                lastName = name
+            out.extend(metric.render())
+        return "\n".join(out) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, **labels):
+    """ Returns the Counter with this name and labels, creating it on first use """
+    return REGISTRY._get(Counter, name, help, labels)
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS, **labels):
+    """ Returns the Histogram with this name and labels, creating it on first use """
+    return REGISTRY._get(Histogram, name, help, labels, buckets=buckets)
+
+
+def level(name, help, fn=None, **labels):
+    """ Returns the Level with this name and labels, creating it on first use; fn, if given, is read at scrape time """
+    metric = REGISTRY._get(Level, name, help, labels)
+    if fn is not None:
+        metric.fn = fn
+    return metric
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = self.server.registry.render().encode('utf8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # no stderr line per scrape
+
+
+class _UnixHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        self.request.sendall(self.server.registry.render().encode('utf8'))
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class MetricsServer(object):
+    """ Serves a Registry over HTTP or a Unix socket from a background thread """
+
+    def __init__(self, address, registry=REGISTRY):
+        """
+        Constructor
+        arguments:
+        address -- "host:port" (or ":port", meaning localhost) for HTTP, or a filesystem path for a Unix socket
+        registry -- the metrics to serve
+        """
+        self.address = address
+        self.path = None
+        if address.startswith("/") or address.startswith("."):
+            self.path = address
+            if os.path.exists(address):
+                os.unlink(address) # left over from a previous run
+            self.server = _UnixServer(address, _UnixHandler)
+        else:
+            host, port = address.rsplit(":", 1)
+            self.server = ThreadingHTTPServer((host or "127.0.0.1", int(port)), _HTTPHandler)
+            self.server.daemon_threads = True
+        self.server.registry = registry
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(address):
+    """ Starts serving REGISTRY at address; returns the MetricsServer """
+    server = MetricsServer(address)
+    stderr.write("\tServing metrics at %s\n" % address)
+    return server
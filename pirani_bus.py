@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Polling several MKS Pirani gauges daisy-chained on one RS-485 line.
+
+Each gauge is a Pirani with its own address; PiraniBus sends them their commands and sorts the replies
+by the address field of each frame (b'@001ACK7.60E+2;FF'[1:4]), so a late or stray reply is never taken for
+another gauge's. Frames are cut at their ';FF' terminator as soon as it arrives, and the next command goes
+out at once -- no stale-input flush, no idle wait and no sleep between gauges.
+
+depth is the number of commands in flight at a time. On a 2-wire (half-duplex) line, keep depth=1: a
+gauge starts answering as soon as its command ends, and would talk over the next command. On a 4-wire line,
+where the master transmits on its own pair, depth=N sends N addressed commands back to back and the
+replies stream in behind them, hiding each gauge's turnaround time.
+
+Bus time is shared fairly: every poll starts one gauge further along the line than the previous one, retries
+of failed commands go to the back of the queue (behind the other gauges' first attempts, which also serves
+as their backoff), and a gauge that keeps failing is left out for its downtime instead of costing a timeout
+every poll. Per-gauge retries, timeouts and metrics are those of the Pirani objects. The line is never
+reopened because of one silent gauge, not even by the gauge's own commands outside a poll (each gauge's
+`bus` is set to its PiraniBus).
+
+ConcurrentSampler uses a PiraniBus on its own for the gauges of a port that are all addressed Piranis, e.g.
+vacuum_daemon.py chambers whose "pirani" ports are the same device, each with its "pirani_address".
+
+Usage:
+    bus = PiraniBus([Pirani(line, False, address) for address in (1, 2, 3)])
+    for gauge, (timestamp, result) in zip(bus.gauges, bus.poll()):
+        ...   # result is [pressure], or the exception that ended the gauge's last attempt
+"""
+
+import collections, time
+import metrics
+from sys import stderr
+from pressure_gauges import response_timeout, gauge_unavailable
+
+_polls = metrics.histogram("vacuum_bus_poll_seconds", "Time to poll every gauge on an RS-485 line once")
+_stray = metrics.counter("vacuum_bus_stray_replies_total", "Frames on an RS-485 line that answered no command in flight")
+
+
+class PiraniBus(object):
+    """ Schedules the commands to the addressed Pirani gauges sharing one serial line """
+
+    def __init__(self, gauges, depth=1, debug=False):
+        """
+        Constructor
+        arguments:
+        gauges -- Pirani instances created with distinct addresses, all on the same serial instance
+        depth -- commands in flight at once; 1 for 2-wire RS-485, up to len(gauges) for 4-wire
+        debug -- true to print debugging statements, false otherwise
+        """
+        self.gauges = list(gauges)
+        for gauge in self.gauges:
+            gauge.bus = self
+        self.innerSerial = self.gauges[0].innerSerial
+        self.depth = max(1, depth)
+        self.debug = debug
+        self.first = 0 # where the next poll starts
+        self.buf = bytearray()
+
+    def _send(self, gauge, attempt, command, pending):
+        cmd = getattr(gauge, command)
+        self.innerSerial.write(cmd.encode())
+        pending[b'%03d' % gauge.address] = (gauge, attempt, cmd, time.monotonic())
+
+    def _frames(self):
+        """ Cuts the complete frames out of the input buffer; yields (address, frame) """
+        term = self.gauges[0].responseTerminators[0]
+        while True:
+            end = self.buf.find(term)
+            if end < 0:
+                return
+            end += len(term)
+            frame = bytes(self.buf[:end])
+            del self.buf[:end]
+            start = frame.rfind(b'@')
+            if start < 0:
+                _stray.inc()
+                continue
+            frame = frame[start:]
+            yield frame[1:4], frame
+
+    def _waitReadable(self, maxWait):
+        # the gauges' own wait covers serial.Serial, the mocks and replay ports alike
+        self.gauges[0]._waitReadable(maxWait)
+
+    def poll(self, command="pressureCommand"):
+        """
+        Sends command (the name of a Pirani command attribute) to every gauge and collects the replies.
+        Returns one (timestamp, result) per gauge, in the order of self.gauges: result is the decoded value
+        (the [pressure] list for pressureCommand), or the exception that ended the gauge's last attempt.
+        """
+        start = time.monotonic()
+        decode = (lambda g, reply: g._cleanPressureFormat(reply)) if command == "pressureCommand" else (lambda g, reply: reply)
+        n = len(self.gauges)
+        order = [self.gauges[(self.first + i) % n] for i in range(n)]
+        self.first = (self.first + 1) % n
+        results = {}
+        queue = collections.deque()
+        for gauge in order:
+            try:
+                gauge._checkAvailable()
+                queue.append((gauge, 0))
+            except gauge_unavailable as err:
+                results[gauge] = (time.time(), err)
+        cnt = self.innerSerial.inWaiting()
+        if cnt > 0:
+            self.innerSerial.read(cnt) # stale input from before this poll
+        del self.buf[:]
+        pending = collections.OrderedDict() # address -> (gauge, attempt, cmd, sent at)
+
+        def failed(entry, err):
+            gauge, attempt, cmd, sent = entry
+            if self.debug:
+                stderr.write("%s: attempt %d failed: %s\n" % (gauge.describe(), attempt + 1, err))
+            if attempt < gauge.retries:
+                gauge.retryCount.inc()
+                queue.append((gauge, attempt + 1))
+            else:
+                gauge._failed(reconnect=False)
+                results[gauge] = (time.time(), err)
+
+        while queue or pending:
+            while queue and len(pending) < self.depth:
+                gauge, attempt = queue.popleft()
+                self._send(gauge, attempt, command, pending)
+            cnt = self.innerSerial.inWaiting()
+            if cnt > 0:
+                self.buf += self.innerSerial.read(cnt)
+                for address, frame in self._frames():
+                    entry = pending.pop(address, None)
+                    if entry is None:
+                        _stray.inc()
+                        continue
+                    gauge, attempt, cmd, sent = entry
+                    try:
+                        value = decode(gauge, gauge._checkResponse(cmd, frame))
+                    except gauge.recoverable as err:
+                        failed(entry, err)
+                        continue
+                    gauge.rtt.observe(time.monotonic() - sent)
+                    gauge._succeeded()
+                    results[gauge] = (time.time(), value)
+            now = time.monotonic()
+            for address, entry in list(pending.items()):
+                gauge, attempt, cmd, sent = entry
+                if now - sent >= gauge.timeout:
+                    del pending[address]
+                    gauge.timeouts.inc()
+                    failed(entry, response_timeout(cmd, b""))
+            if cnt == 0 and pending and not (queue and len(pending) < self.depth):
+                deadline = min(entry[0].timeout + entry[3] for entry in pending.values())
+                self._waitReadable(max(0., deadline - time.monotonic()))
+        _polls.observe(time.monotonic() - start)
+        return [results[gauge] for gauge in self.gauges]
+
+    def getPressure(self):
+        """ Returns the pressure of every gauge, in order; NaN for a gauge that gave no reading """
+        return [result[0] if isinstance(result, list) else float('nan') for timestamp, result in self.poll()]
+
+    def close(self):
+        self.innerSerial.close()
@@ -9,12 +9,16 @@ To extend to more gauges:
 * Create a new subclass of PressureGauge
 * In your subclass, override the class vaiables `unitsCommand` and `pressureCommand` with the commands appropriate for that gauge
 * In the subclass, override _sendCmdGetResp(self, cmd) with the correct functionality to request and receive data from the gauge
+  (usually _checkResponse(cmd, _transact(cmd, _frameSize(cmd))), after setting `responseTerminators`, `timeout` and `idleTimeout`
+  to describe how replies are framed, and overriding _checkResponse() to validate a reply and extract its value)
 * If your gauge can tell you more than just units and pressure, create new methods in your subclass that use _sendCmdGetResp(self, cmd) to get that information
  """
 
 from sys import stderr
-from serial import Serial
-import time
+from serial import Serial, SerialException
+from protocol import PIRANI, CAPACITANCE
+import metrics
+import select, time
 
 class ack_error(Exception):
     def __init__(self, ack):
@@ -23,6 +27,26 @@ class ack_error(Exception):
     def __str__(self):
         return repr("Bad ack: %s" % self.ack)
 
+class response_timeout(Exception):
+    def __init__(self, cmd, partial):
+        self.cmd = cmd
+        self.partial = partial
+
+    def __str__(self):
+        return repr("No complete response to %s before deadline (got %r)" % (self.cmd, self.partial))
+
+class gauge_unavailable(Exception):
+    def __init__(self, gauge, retryIn):
+        self.gauge = gauge
+        self.retryIn = retryIn
+
+    def __str__(self):
+        return repr("%s is not responding; next attempt in %.1f s" % (self.gauge, self.retryIn))
+
+def portName(ser):
+    """ What a serial port (or stand-in) is called in metric labels: its device name, else its type """
+    return getattr(ser, 'port', None) or getattr(ser, 'name', None) or type(ser).__name__
+
 class PressureGauge(object):
     """ 
     Base class for interacting with the pressure gauges via serial ports.
@@ -31,27 +55,241 @@ class PressureGauge(object):
 
     unitsCommand = "none"
     pressureCommand = "none"
-    waittime = 0.05
-
-    def __init__(self, serialInstance, debug):
+    # framing: a response ends at any of these byte strings, or when the line goes idle for idleTimeout
+    # after some bytes have arrived (None disables the idle rule). timeout is the deadline for a whole command.
+    responseTerminators = ()
+    timeout = 1.0
+    idleTimeout = None
+    # recovery: a failed command is retried `retries` times, waiting `backoff` seconds (doubling) in between.
+    # After `reconnectAfter` commands in a row have failed, the port is reopened and the gauge is left alone
+    # (gauge_unavailable) for downtime seconds, doubling up to maxDowntime while it keeps failing.
+    retries = 2
+    backoff = 0.05
+    reconnectAfter = 3
+    downtime = 5.0
+    maxDowntime = 300.0
+    # failures a retry may fix; anything else is a bug and propagates at once
+    recoverable = (response_timeout, ack_error, ValueError, SerialException, OSError)
+    channels = 1 # readings returned by getPressure()
+    sharedPort = None # acquisition.SharedPort that owns the serial port, when other gauges use it too
+    bus = None # pirani_bus.PiraniBus that polls this gauge with the others on its RS-485 line
+
+    def __init__(self, serialInstance, debug, chamber=None):
         """ 
         Constructor
         arguments:
         serialInstance -- either an instance of pySerial's serial.serial, or a subclass of FakeSerial (MockPirani or MockCapacitance) 
-        debug -- true to print debugging statements, false otherwise"""
+        debug -- true to print debugging statements, false otherwise
+        chamber -- name of the chamber the gauge is on, for the labels of its metrics (None leaves the label out)"""
         self.debug = debug
         self.innerSerial = serialInstance
+        # one series per gauge: its kind, its port, and its chamber when known
+        labels = {"gauge": type(self).__name__.lower(), "port": portName(serialInstance)}
+        if chamber is not None:
+            labels["chamber"] = str(chamber)
+        self.rtt = metrics.histogram("vacuum_serial_rtt_seconds", "Time from sending a command to its complete reply", **labels)
+        self.timeouts = metrics.counter("vacuum_serial_timeouts_total", "Commands with no complete reply before the deadline", **labels)
+        self.ackErrors = metrics.counter("vacuum_ack_errors_total", "Replies rejected as NAK or malformed", **labels)
+        self.retryCount = metrics.counter("vacuum_serial_retries_total", "Commands sent again after a failed attempt", **labels)
+        self.reconnects = metrics.counter("vacuum_serial_reconnects_total", "Times a failing gauge's serial port was reopened", **labels)
+        self.failures = 0 # commands in a row that failed after all their retries
+        self.retryAt = None # while the gauge is down: time.monotonic() of the next attempt
+        self.parseFailures = metrics.counter("vacuum_parse_failures_total", "Pressure replies that could not be decoded", **labels)
 
     def _sendCmdGetResp(self, cmd):
         stderr.WARN("WARN: _sendCMdGetResp is not implemented in base class PressureGauge\n")
         return "" # implement in subclasses
 
+    def _frameSize(self, cmd):
+        """ Fixed length of the reply to cmd in bytes, or None if replies are framed by terminators/idle time only """
+        return None
+
+    def _checkResponse(self, cmd, response):
+        """ Validates a framed reply (bytes) to cmd and returns its value as text; shared by the sync and async transports """
+        return response.decode('utf8', 'replace').strip()
+
+    def _waitReadable(self, maxWait):
+        """
+        Blocks until the port has input or maxWait seconds pass. Uses the port's own waitReadable(timeout)
+        if it has one (the mock and replay ports do), otherwise select() on its file descriptor.
+        """
+        waitReadable = getattr(self.innerSerial, 'waitReadable', None)
+        if waitReadable is not None:
+            waitReadable(maxWait)
+            return
+        try:
+            fd = self.innerSerial.fileno()
+        except (AttributeError, ValueError):
+            fd = None
+        if fd is None:
+            time.sleep(maxWait)
+        else:
+            select.select([fd], [], [], maxWait)
+
+    def _skipTerminators(self, buf):
+        """ Drops terminators at the start of buf (a bytearray), e.g. the late LF of the previous reply's CR/LF """
+        skipped = True
+        while skipped:
+            skipped = False
+            for term in self.responseTerminators:
+                if buf.startswith(term):
+                    del buf[:len(term)]
+                    skipped = True
+
+    def _readFrame(self, cmd, size=None):
+        """
+        Reads one response frame, blocking until it is complete or the command deadline passes.
+        A frame is complete at the first terminator in self.responseTerminators, after `size` bytes,
+        or after self.idleTimeout seconds of silence once data has started arriving. Terminators that
+        arrive before any data belong to an earlier reply and are skipped.
+        Returns the frame as bytes (terminator included); raises response_timeout otherwise.
+        """
+        deadline = time.monotonic() + self.timeout
+        buf = bytearray()
+        lastByte = None
+        while True:
+            cnt = self.innerSerial.inWaiting()
+            if cnt > 0:
+                if size is not None:
+                    cnt = min(cnt, size - len(buf))
+                buf += self.innerSerial.read(cnt)
+                self._skipTerminators(buf)
+                if not buf:
+                    continue
+                lastByte = time.monotonic()
+                ends = [buf.find(term) + len(term) for term in self.responseTerminators if term in buf]
+                if ends:
+                    return bytes(buf[:min(ends)])
+                if size is not None and len(buf) >= size:
+                    return bytes(buf)
+                continue
+            now = time.monotonic()
+            if self.idleTimeout is not None and lastByte is not None and now - lastByte >= self.idleTimeout:
+                return bytes(buf)
+            if now >= deadline:
+                raise response_timeout(cmd, bytes(buf))
+            wait = deadline - now
+            if self.idleTimeout is not None and lastByte is not None:
+                wait = min(wait, lastByte + self.idleTimeout - now)
+            self._waitReadable(wait)
+
+    def _transact(self, cmd, size=None):
+        """ Discards stale input, sends cmd, and returns the framed response as bytes """
+        cnt = self.innerSerial.inWaiting()
+        if cnt > 0:
+            self.innerSerial.read(cnt)
+        start = time.monotonic()
+        self.innerSerial.write(cmd.encode())
+        try:
+            frame = self._readFrame(cmd, size)
+        except response_timeout:
+            self.timeouts.inc()
+            raise
+        rtt = time.monotonic() - start
+        self.rtt.observe(rtt)
+        if self.debug:
+            stderr.write("%s: %d bytes in %.6f s\n" % (cmd, len(frame), rtt))
+            stderr.flush()
+        return frame
+
     def _cleanPressureFormat(self, rawData):
         stderr.WARN("WARN: _cleanPressureFormat is not implemented in base class PressureGauge\n")
         return "" # implement in subclasses
 
+    def _command(self, cmd, decode=None):
+        """
+        Sends cmd with bounded retries and returns the reply, passed through decode() if given.
+        Raises gauge_unavailable without touching the port while the gauge is down, and the last error
+        once every attempt has failed.
+        """
+        self._checkAvailable()
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                reply = self._sendCmdGetResp(cmd)
+                value = decode(reply) if decode is not None else reply
+            except self.recoverable as err:
+                if self.debug:
+                    stderr.write("%s: attempt %d failed: %s\n" % (cmd, attempt + 1, err))
+                if attempt == self.retries:
+                    self._failed(reconnect=self.bus is None)
+                    raise
+                self.retryCount.inc()
+                time.sleep(delay)
+                delay *= 2
+                continue
+            self._succeeded()
+            return value
+
+    def _probe(self, cmd):
+        """
+        One attempt at cmd, outside the retry and failure accounting: for optional queries (e.g. the slow fullscale
+        query) whose failure must not mark the gauge down or reopen its port. Returns the reply, or None if it failed
+        or the gauge is being left alone.
+        """
+        if self.retryAt is not None:
+            return None
+        try:
+            return self._sendCmdGetResp(cmd)
+        except self.recoverable as err:
+            if self.debug:
+                stderr.write("%s: probe failed: %s\n" % (cmd, err))
+            return None
+
+    def _checkAvailable(self):
+        """ Raises gauge_unavailable while a failing gauge is being left alone """
+        now = time.monotonic()
+        if self.retryAt is not None and now < self.retryAt:
+            raise gauge_unavailable(self.describe(), self.retryAt - now)
+
+    def _succeeded(self):
+        """ Clears the failure count after a command that worked """
+        if self.failures:
+            stderr.write("%s: %s recovered\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), self.describe()))
+        self.failures = 0
+        self.retryAt = None
+
+    def _failed(self, reconnect=True):
+        """
+        Counts a command that failed for good; reopens the port and backs off once failures pile up.
+        Gauges on an RS-485 line with others (self.bus, see pirani_bus.py) pass reconnect=False and only back off,
+        whether they failed in a bus poll or in a command of their own (e.g. getUnits()).
+        """
+        self.failures += 1
+        if self.failures < self.reconnectAfter:
+            return
+        down = min(self.downtime * 2 ** (self.failures - self.reconnectAfter), self.maxDowntime)
+        stderr.write("%s: %s failed %d times in a row; %snext attempt in %.1f s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), self.describe(), self.failures, "reopening the port, " if reconnect else "", down))
+        self.retryAt = time.monotonic() + down
+        if reconnect:
+            self.reconnect()
+
+    def describe(self):
+        """ Name of this gauge in log messages """
+        return type(self).__name__
+
+    def reconnect(self):
+        """
+        Closes and reopens the serial port, e.g. after the adapter was unplugged and plugged back in.
+        A port other gauges also use is reopened by its owner, self.sharedPort, between their commands.
+        """
+        if self.sharedPort is not None:
+            self.sharedPort.reconnect(self)
+        else:
+            self.reopen()
+
+    def reopen(self):
+        """ Closes and reopens this gauge's serial port, and discards whatever was waiting in it """
+        self.reconnects.inc()
+        try:
+            self.innerSerial.close()
+            self.innerSerial.open()
+            self.flush()
+        except (SerialException, OSError) as err:
+            stderr.write("Could not reopen %s: %s\n" % (getattr(self.innerSerial, 'port', type(self).__name__), err))
+
     def getUnits(self):
-        return self._sendCmdGetResp(self.unitsCommand)
+        return self._command(self.unitsCommand)
 
     def getPressure(self):
         """ 
@@ -61,9 +299,9 @@ class PressureGauge(object):
 
         If this object only communicates with one physical gauge, the list will have one element.
         Otherwise, there will be one element per gauge.
+        Failed commands are retried; see _command() for what is raised when the gauge stays silent.
         """
-        raw = self._sendCmdGetResp(self.pressureCommand)
-        return self._cleanPressureFormat(raw)
+        return self._command(self.pressureCommand, self._cleanPressureFormat)
 
     def flush(self):
         if self.debug:
@@ -80,7 +318,8 @@ class PressureGauge(object):
 class Pirani(PressureGauge):
     """
     Class for interacting with a Pirani gauge. Initialize either with serial.Serial or MockPirani.
-    Expects to be connected to a single gauge.
+    Expects to be connected to a single gauge, unless given its address on a multi-drop RS-485 line;
+    several addressed gauges on one line are best polled together with pirani_bus.PiraniBus.
     """
 
     pressureCommand = '@253PR1?;FF'
@@ -89,34 +328,61 @@ class Pirani(PressureGauge):
             unitsCommand:14,
             pressureCommand:17
         }
+    # MKS protocol replies end in ';FF'; the expected length caps a frame whose terminator was lost
+    responseTerminators = (b';FF',)
+    address = None # RS-485 address; None sends to 253 and accepts a reply from any address
+
+    def __init__(self, serialInstance, debug, address=None, chamber=None):
+        """
+        Constructor
+        arguments:
+        serialInstance -- serial.Serial, or MockPirani
+        debug -- true to print debugging statements, false otherwise
+        address -- the gauge's address (1-253) on a multi-drop line; replies from other addresses are rejected
+        chamber -- name of the chamber the gauge is on, for the labels of its metrics
+        """
+        super(Pirani, self).__init__(serialInstance, debug, chamber)
+        if address is not None:
+            self.address = int(address)
+            prefix = '@%03d' % self.address
+            self.pressureCommand = Pirani.pressureCommand.replace('@253', prefix)
+            self.unitsCommand = Pirani.unitsCommand.replace('@253', prefix)
+            self.expectedLengths = dict((cmd.replace('@253', prefix), n) for cmd, n in Pirani.expectedLengths.items())
+
+    def describe(self):
+        if self.address is None:
+            return "Pirani"
+        return "Pirani @%03d" % self.address
+
+    def _frameSize(self, cmd):
+        return self.expectedLengths[cmd]
 
     def _sendCmdGetResp(self, cmd):
+        return self._checkResponse(cmd, self._transact(cmd, self._frameSize(cmd)))
+
+    def _checkResponse(self, cmd, response):
         expected = self.expectedLengths[cmd]
-        self.innerSerial.write(cmd.encode())
-        while True:
-            time.sleep(self.waittime)
-            cnt = self.innerSerial.inWaiting()
-            if self.debug:
-                stderr.write("%d\n" % cnt)
-                stderr.flush()
-            if cnt==0:
-                continue
-            if cnt>0 and cnt%expected != 0:
-                continue
-            response = self.innerSerial.read(cnt).decode('utf8')
-            break
-        addr = response[1:4]
-        ack = response[4:7]
-        val = response[7:expected-3]
+        if len(response) != expected:
+            self.ackErrors.inc()
+            raise ack_error(response.decode('utf8', 'replace'))
+        addr, ack, val = PIRANI.split(response)
         if self.debug:
-            sys.stderr.write("%d %d %s %s %s %s\n" %(cnt, expected, response, addr, ack, val))
-            sys.stderr.flush()
-        if ack != 'ACK':
-            raise ack_error(ack)
-        return val.lstrip().rstrip()
+            stderr.write("%d %d %s %s %s %s\n" %(len(response), expected, response, addr, ack, val))
+            stderr.flush()
+        if self.address is not None and addr != b'%03d' % self.address:
+            self.ackErrors.inc()
+            raise ack_error("reply from address %s" % addr.decode('utf8', 'replace'))
+        if ack != b'ACK':
+            self.ackErrors.inc()
+            raise ack_error(ack.decode('utf8', 'replace'))
+        return val.decode('utf8', 'replace').strip()
 
     def _cleanPressureFormat(self, rawData):
-        return [float(rawData)]
+        try:
+            return [float(rawData)]
+        except ValueError:
+            self.parseFailures.inc()
+            raise
 
 
 class Capacitance(PressureGauge):
@@ -128,66 +394,46 @@ class Capacitance(PressureGauge):
     pressureCommand = 'p'
     unitsCommand = 'u'
     fullscaleCommand = 'f'
-
-    def __init__(self, serialInstance, debug):
-    	super(Capacitance, self).__init__(serialInstance, debug)
+    # replies are CR/LF terminated; reply lengths vary (a negative reading adds characters), so a
+    # reply that never gets its terminator is closed by a quiet period on the line instead. USB serial
+    # adapters hold received bytes for up to their latency timer (16 ms on FTDI) before passing them on,
+    # so the quiet period has to be well above that or a reply split across two USB packets is cut short
+    responseTerminators = (b'\r', b'\n')
+    idleTimeout = 0.05
+    channels = 2
+
+    def __init__(self, serialInstance, debug, chamber=None):
+        super(Capacitance, self).__init__(serialInstance, debug, chamber)
         # default values
         self.fullscale = [1000.,1.]
         self.minscale = [1e-1, 1.e-4]
 
     def _sendCmdGetResp(self, cmd):
-        self.innerSerial.write(cmd.encode())
-        while True:
-            time.sleep(self.waittime)
-            cnt = self.innerSerial.inWaiting()
-            if self.debug:
-                stderr.write("%d\n" % cnt)
-                stderr.flush()
-            if cnt==0:
-                continue
-            response = self.innerSerial.read(cnt).decode('utf8')
-            break
-        if self.debug:
-            stderr.write("%d %s\n" % (cnt, response))
-            stderr.flush()
-        return response.lstrip().rstrip()
+        return self._checkResponse(cmd, self._transact(cmd))
 
-    def _glue_minus(self, response):
+    def _checkResponse(self, cmd, response):
+        response = response.decode('utf8', 'replace')
         if self.debug:
-            stderr.write("glue_minus\n")
+            stderr.write("%d %s\n" % (len(response), response))
             stderr.flush()
-        resp = response.split()
-        out = ''
-        for r in resp:
-            out += r 
-            if r=='-':
-                continue
-            else:
-                out += ' '
-        if self.debug:
-            stderr.write("out = %s\n" % out)
-            stderr.flush()
-        return out
+        return response.lstrip().rstrip()
 
     def _cleanPressureFormat(self, rawData):
-        # fart ... if the values are all _positive_, the list has length
-        # 2, as expected.  A _negative_ value, however, is set off with a
-        # _space_, believe it or not.  Need to deal with that ... fart
-        response = self._glue_minus(rawData)
-        ch1,ch2 = response.split()
-        if ch1=='Off':
-            ch1 = self.fullscale[0]
-        if float(ch1)<self.minscale[0]:
-            ch1 = self.minscale[0]
-        if ch2=='Off':
-            ch2 = self.fullscale[1]
-        if float(ch2)<self.minscale[1]:
-            ch2 = self.minscale[1]
-        return [float(ch1),float(ch2)]
+        # if the values are all _positive_, the reply has two fields, as expected.  A _negative_ value,
+        # however, is set off with a _space_, believe it or not -- the decoder glues the minus back on
+        try:
+            return CAPACITANCE.pressures(rawData, self.fullscale, self.minscale)
+        except ValueError:
+            self.parseFailures.inc()
+            raise
 
 
     def getFullscale(self):
-        return self._sendCmdGetResp(self.fullscaleCommand)
+        return self._command(self.fullscaleCommand)
+
+    def probeFullscale(self):
+        """ Asks once for the reported fullscale; returns None instead of retrying or counting a failure """
+        return self._probe(self.fullscaleCommand)
 
     def setFullscaleManual(self, fullscale):
         # no input validation... don't put anything weird here!
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Decoders for the replies of the supported gauges, with their patterns and layouts compiled once.
+
+Each decoder handles single replies (as used by the PressureGauge classes on every sample) and has a batch
+API that decodes a buffer holding many replies at once -- e.g. a captured serial log -- into NumPy arrays,
+applying the Off/minscale clamping to whole arrays at a time.
+
+NumPy is only imported by the batch methods.
+"""
+
+import re, struct
+
+PIRANI_TERMINATOR = b';FF'
+
+
+class PiraniDecoder(object):
+    """
+    MKS protocol replies: one start character, a 3-character address, a 3-character ACK/NAK field, the value,
+    and the 3-character terminator, e.g. b'@253ACK7.60E+2;FF'.
+    """
+
+    # batch fallback for streams that are not a whole number of fixed-width frames
+    frameRe = re.compile(br'.(.{3})(ACK|NAK)(.*?)' + re.escape(PIRANI_TERMINATOR), re.S)
+
+    def __init__(self):
+        self.layouts = {}
+
+    def _layout(self, length):
+        layout = self.layouts.get(length)
+        if layout is None:
+            layout = struct.Struct("x3s3s%ds3x" % (length - 10))
+            self.layouts[length] = layout
+        return layout
+
+    def split(self, response):
+        """ Returns the (address, ack, value) fields of one reply, as bytes; response must be at least 10 bytes """
+        return self._layout(len(response)).unpack(response)
+
+    def batch(self, buffer, frameLength=None):
+        """
+        Decodes many replies at once.
+        With frameLength, buffer must hold back-to-back frames of exactly that length (e.g. 17 for pressure
+        replies) and is decoded in place with no per-frame Python work; otherwise frames are found by their
+        ';FF' terminator.
+        returns: (addresses, values) NumPy arrays; the value of any reply without ACK, or that does not parse, is NaN
+        """
+        import numpy as np
+        if frameLength is not None and len(buffer) % frameLength == 0:
+            frames = np.frombuffer(buffer, dtype=[('start', 'S1'), ('addr', 'S3'), ('ack', 'S3'), ('val', 'S%d' % (frameLength - 10)), ('term', 'S3')])
+            addrs, acks, vals = frames['addr'], frames['ack'], frames['val']
+        else:
+            found = self.frameRe.findall(buffer)
+            addrs = np.array([f[0] for f in found], dtype='S3')
+            acks = np.array([f[1] for f in found], dtype='S3')
+            vals = np.array([f[2] for f in found], dtype='S32')
+        good = acks == b'ACK'
+        out = np.full(len(vals), np.nan)
+        try:
+            out[good] = np.char.strip(vals[good]).astype(float)
+        except ValueError:
+            # a corrupted value: fall back to converting one at a time
+            for i in np.flatnonzero(good):
+                try:
+                    out[i] = float(vals[i])
+                except ValueError:
+                    pass
+        return addrs, out
+
+
+class CapacitanceDecoder(object):
+    """
+    Capacitance controller replies: whitespace-separated readings, one per channel, each a number or 'Off'.
+    A negative reading has its minus sign set off by a space ('- 1.0E-3'), which is glued back on.
+    """
+
+    minusRe = re.compile(br'-\s+')
+    tokenRe = re.compile(br'Off|-?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+    strMinusRe = re.compile(r'-\s+')
+
+    def __init__(self, channels=2):
+        self.channels = channels
+
+    def pressures(self, response, fullscale, minscale):
+        """
+        Decodes one reply into a list of floats, one per channel: 'Off' reads as that channel's fullscale,
+        and anything below minscale is raised to minscale. Raises ValueError if the channel count is wrong.
+        """
+        if isinstance(response, bytes):
+            response = response.decode('ascii', 'replace')
+        toks = response.split()
+        if len(toks) != self.channels:
+            # only a reply with a split-off minus sign (or a garbled one) pays for the regex
+            toks = self.strMinusRe.sub('-', response).split()
+            if len(toks) != self.channels:
+                raise ValueError("expected %d readings, got %r" % (self.channels, response))
+        out = []
+        for tok, full, lo in zip(toks, fullscale, minscale):
+            v = full if tok == 'Off' else float(tok)
+            out.append(lo if v < lo else v)
+        return out
+
+    def batch(self, buffer, fullscale, minscale, frameLength=None):
+        """
+        Decodes many replies at once into an (n, channels) NumPy array, with the Off/minscale clamping applied.
+        Replies are separated by CR/LF; for unterminated fixed-width replies (as from the mock gauges) give frameLength.
+        Replies with the wrong number of readings are dropped.
+        """
+        import numpy as np
+        if frameLength is not None:
+            buffer = b'\n'.join(buffer[i:i + frameLength] for i in range(0, len(buffer), frameLength))
+        buffer = self.minusRe.sub(b'-', buffer)
+        rows = [self.tokenRe.findall(line) for line in re.split(br'[\r\n]+', buffer)]
+        toks = np.array([t for row in rows if len(row) == self.channels for t in row], dtype='S32')
+        if not len(toks):
+            return np.empty((0, self.channels))
+        off = toks == b'Off'
+        toks[off] = b'nan'
+        vals = toks.astype(float).reshape(-1, self.channels)
+        vals = np.where(off.reshape(vals.shape), np.asarray(fullscale, dtype=float), vals)
+        return np.maximum(vals, np.asarray(minscale, dtype=float))
+
+
+PIRANI = PiraniDecoder()
+CAPACITANCE = CapacitanceDecoder()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+Live stream of recorded samples to any number of local subscribers.
+
+A Publisher listens on a TCP port ("host:port", ":port" meaning localhost) or a Unix socket path. Every sample
+published to it is encoded once, as a line of JSON, kept in a ring of recent samples, and queued for every
+connected subscriber. Each subscriber has its own sender thread and a bounded backlog: when a client reads
+too slowly its oldest queued samples are dropped, so one stuck dashboard never holds up the acquisition loop
+or the other subscribers. Samples carry a sequence number, so a client can tell when it has missed some.
+
+Protocol: after connecting, a client may send one JSON request line, e.g.
+    {"catchup": 100}            first replay the last 100 samples from the recent-sample ring
+    {"since": 1715090000.0}     first replay every sample in the ring with "time" after this unix time
+    {"chambers": ["1", "2"]}    only samples from these chambers
+then it receives one JSON object per line, e.g.
+    {"seq": 42, "chamber": "1", "time": 1715090001.2, "elapsed": 378.004, "pirani": 0.0123, "capacitance": [0.0119, 0.01187]}
+Samples from a reader that keeps pumpdown analytics also carry them, as "analytics": {column: {...}} (see analytics.py).
+A value that is not a finite number (a failed gauge's NaN, an infinite estimate) is sent as null, so every line is
+strict JSON that browsers and other JSON parsers accept.
+A client that sends nothing gets live samples only, starting HELLO_TIMEOUT seconds after it connects
+(so `nc localhost 9109` works as a viewer).
+
+subscribe(address) is a minimal client: a generator of the received samples as dicts.
+"""
+
+import collections, json, math, os, socket, sys, threading
+import metrics
+from sys import stderr
+
+HELLO_TIMEOUT = 1.0
+
+_published = metrics.counter("vacuum_publisher_samples_total", "Samples published to the live stream")
+_dropped = metrics.counter("vacuum_publisher_dropped_total", "Queued samples dropped because a subscriber fell behind")
+
+
+def listen(address):
+    """ Returns a listening socket for "host:port" (TCP) or a filesystem path (Unix socket) """
+    if address.startswith("/") or address.startswith("."):
+        if os.path.exists(address):
+            os.unlink(address) # left over from a previous run
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(address)
+    else:
+        host, port = address.rsplit(":", 1)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host or "127.0.0.1", int(port)))
+    sock.listen(16)
+    return sock
+
+
+def finite(value):
+    """ Returns value with every NaN or infinite float in it (in lists and dicts too) replaced by None """
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, (list, tuple)):
+        return [finite(v) for v in value]
+    if isinstance(value, dict):
+        return dict((k, finite(v)) for k, v in value.items())
+    return value
+
+
+def connect(address, timeout=None):
+    """
+    Returns a socket connected to a Publisher (or anything else) at "host:port" or a Unix socket path.
+    With a timeout, connecting (and then every operation on the socket) gives up after that many seconds.
+    """
+    if address.startswith("/") or address.startswith("."):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(address)
+    else:
+        host, port = address.rsplit(":", 1)
+        sock = socket.create_connection((host or "127.0.0.1", int(port)), timeout)
+    return sock
+
+
+class Subscriber(object):
+    """ One connected client: its bounded queue of encoded samples and the thread that sends them """
+
+    def __init__(self, publisher, conn, backlog):
+        self.publisher = publisher
+        self.conn = conn
+        self.queue = collections.deque(maxlen=backlog)
+        self.ready = threading.Condition()
+        self.chambers = None # None: every chamber
+        self.dropped = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="Subscriber")
+        self.thread.daemon = True
+
+    def offer(self, chamber, line):
+        """ Queues an encoded sample, dropping the oldest queued one if the backlog is full; never blocks on the client """
+        if self.chambers is not None and chamber not in self.chambers:
+            return
+        with self.ready:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+                _dropped.inc()
+            self.queue.append(line)
+            self.ready.notify()
+
+    def _hello(self):
+        """ Reads the optional request line; returns it as a dict ({} if the client sent nothing) """
+        self.conn.settimeout(HELLO_TIMEOUT)
+        data = b""
+        try:
+            while b"\n" not in data:
+                chunk = self.conn.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        except socket.timeout:
+            pass
+        finally:
+            self.conn.settimeout(None)
+        try:
+            request = json.loads(data.split(b"\n", 1)[0] or b"{}")
+        except ValueError:
+            return {}
+        return request if isinstance(request, dict) else {}
+
+    def _run(self):
+        try:
+            request = self._hello()
+            if request.get("chambers") is not None:
+                self.chambers = set(str(c) for c in request["chambers"])
+            # register before reading the history, so no sample falls between the two
+            backlog = self.publisher._attach(self, request.get("catchup"), request.get("since"))
+            if backlog:
+                self.conn.sendall(b"".join(backlog))
+            while True:
+                with self.ready:
+                    while not self.queue and not self.closed:
+                        self.ready.wait()
+                    if self.closed:
+                        return
+                    lines = list(self.queue)
+                    self.queue.clear()
+                self.conn.sendall(b"".join(lines))
+        except OSError:
+            pass # client went away
+        except (TypeError, ValueError) as err:
+            stderr.write("Publisher: dropped a subscriber with a bad request: %s\n" % err)
+        finally:
+            self.publisher._detach(self)
+            self.conn.close()
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class Publisher(object):
+    """ Fans published samples out to the subscribers connected at address """
+
+    def __init__(self, address, history=1000, backlog=256):
+        """
+        Constructor
+        arguments:
+        address -- "host:port" for TCP, or a filesystem path for a Unix socket
+        history -- number of recent samples kept for subscribers to catch up from
+        backlog -- samples queued per subscriber before its oldest are dropped
+        """
+        self.address = address
+        self.backlog = backlog
+        self.history = collections.deque(maxlen=history) # (chamber, time, encoded line)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.sock = listen(address)
+        self.running = True
+        metrics.level("vacuum_publisher_subscribers", "Connected live stream subscribers", fn=lambda: len(self.subscribers))
+        self.thread = threading.Thread(target=self._accept, name="Publisher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                return # closed
+            Subscriber(self, conn, self.backlog).thread.start()
+
+    def _attach(self, subscriber, catchup, since):
+        """ Registers a subscriber and returns the encoded samples from the history it asked to replay """
+        with self.lock:
+            self.subscribers.add(subscriber)
+            wanted = [(c, t, line) for c, t, line in self.history if subscriber.chambers is None or c in subscriber.chambers]
+        if since is not None:
+            return [line for c, t, line in wanted if t > since]
+        if catchup:
+            return [line for c, t, line in wanted[-int(catchup):]]
+        return []
+
+    def _detach(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, chamber, timestamp, elapsed, pirani, capacitance, analytics=None):
+        """ Sends one sample (and the analytics summary, if given) to every subscriber; returns without waiting for any of them """
+        chamber = str(chamber)
+        sample = {"chamber": chamber, "time": timestamp, "elapsed": elapsed, "pirani": pirani, "capacitance": list(capacitance)}
+        if analytics is not None:
+            sample["analytics"] = analytics
+        with self.lock:
+            self.seq += 1
+            sample["seq"] = self.seq
+            line = (json.dumps(finite(sample), allow_nan=False) + "\n").encode('utf8')
+            self.history.append((chamber, timestamp, line))
+            subscribers = list(self.subscribers)
+        _published.inc()
+        for subscriber in subscribers:
+            subscriber.offer(chamber, line)
+
+    def close(self):
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR) # wakes the accept() in progress
+        except OSError:
+            pass
+        self.sock.close()
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.close()
+        if (self.address.startswith("/") or self.address.startswith(".")) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+def subscribe(address, catchup=0, since=None, chambers=None):
+    """ Connects to a Publisher and yields each received sample as a dict, until the connection closes """
+    sock = connect(address)
+    request = {"catchup": catchup}
+    if since is not None:
+        request["since"] = since
+    if chambers is not None:
+        request["chambers"] = [str(c) for c in chambers]
+    sock.sendall((json.dumps(request) + "\n").encode('utf8'))
+    try:
+        for line in sock.makefile('rb'):
+            yield json.loads(line.decode('utf8'))
+    finally:
+        sock.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stdout.write("Usage: `python publisher.py ADDRESS [CATCHUP]` prints the samples streamed at ADDRESS\n")
+        sys.exit()
+    def pressure(value):
+        return "%.02e" % (value if value is not None else float('nan')) # null: the gauge failed
+    for sample in subscribe(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 0):
+        sys.stdout.write("%s\t%.3f\t" % (sample["chamber"], sample["time"]) + "\t".join(pressure(p) for p in [sample["pirani"]] + sample["capacitance"]) + "\n")
+        sys.stdout.flush()
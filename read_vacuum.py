@@ -1,17 +1,24 @@
 #!/usr/bin/env python
 
-import os, serial, sys, signal, time, datetime
+import argparse, collections, os, serial, sys, signal, threading, time, datetime
 from tests.fakeSerial import MockPirani, MockCapacitance
 from pressure_gauges import Pirani, Capacitance
-import matplotlib.pyplot as plt
+from acquisition import ConcurrentSampler, FixedRateScheduler, AdaptiveScheduler, Deadband
+from writers import BufferedWriter, FlushPolicy, flushAll
+from binary_log import BinaryRecorder
+import metrics
+# sample_store (NumPy) and live_plot (matplotlib) are imported on first use, so headless readers never load them
 
 
+_plotTime = metrics.histogram("vacuum_plot_refresh_seconds", "Time to redraw the live plot after a sample")
+
 
 class VacuumReader(object):
     """ 
     Stores information about the connections to the pressure gauges and the file to write pressure data to.
     Utility methods for setting up connections, cleaning them up, keeping time, and writing to the data file. 
-    To interact with the gauges themselves, use the variables 'pirani' and 'capacitance'
+    To interact with the gauges themselves, use the variables 'pirani' and 'capacitance'; to read them all at once, use 'sampler'
+    Recorded rows are kept in 'store' once setUpStore() has been called, and drawn by 'plot' while one is attached.
     """
 
     pirani_port_templ = "/dev/ttyUSB%1d"
@@ -27,106 +34,378 @@ class VacuumReader(object):
         """
         self.pirani = None
         self.capacitance = None
+        self.sampler = None
         self.outfile = None
+        self.writer = None # BufferedWriter for the output file (and stdout)
+        self.flushPolicy = FlushPolicy()
+        self.captureDir = None # if set, real serial traffic is recorded to <captureDir>/<gauge>.jsonl
+        self.replayDir = None # if set, gauges are replayed from <replayDir>/<gauge>.jsonl captures
+        self.replaySpeed = 1.0 # replay speed-up factor; None replays as fast as possible
+        self.broker = None # if set, the address of a gauge_broker.py that owns the serial ports
+        self.recordBinary = False # also write a .vbin binary log next to the CSV
+        self.binary = None # BinaryRecorder, when recording binary
+        self.binaryWriter = None
         self.chamber = chamber
         self.testMode = (chamber == -1)
         self.debug = debug
         self.capacitance_fullscale = [1000.,1.]
         self.capacitance_minscale = [1e-1, 1.e-4]
+        self.pirani_address = None # RS-485 address of the Pirani, when it shares a multi-drop line (see pirani_bus.py)
         self.pirani_units = "torr"
         self.capacitance_units = "torr"
         self.starttime = None
+        self.startclock = None # self.clock() at starttime
+        self.clock = time.monotonic # monotonic time source for elapsed times; simulations substitute their own
+        self.echo = True # teeWrite also copies to stdout
+        self.store = None # SampleStore of recorded rows, for plotting/analysis; see setUpStore()
+        self.plot = None # LivePlot, while attached
+        self.publisher = None # Publisher streaming each recorded row to live subscribers
+        self.ring = None # sample_ring.SampleRing in shared memory that each recorded row is also written to
+        self.interlock = None # interlock.Interlock whose rules every row is checked against, before it is written
+        self.deadband = None # Deadband; if set, only rows that pass it are written to the output files
+        self.lastRecorded = None # elapsed time of the last row written
+        self.sampleTimeout = None # longest wait for the gauges in each sample (see ConcurrentSampler)
+        self.failing = set() # gauges whose last reading failed
+        self.analytics = None # analytics.Analytics; if set, updated with every row, see setUpAnalytics()
+        self.analyticsEvery = 60. # seconds between '# Analytics:' comment lines in the output
+        self.lastAnalytics = None # elapsed time of the last '# Analytics:' line
+        self.session = None # session_cache.SessionCache; if set, setUpOutput() takes the gauge units from it when valid
+        self.comments = collections.deque() # comment lines from background work, written by the next recordRow()
+        self.lastValidation = None # self.clock() when validateSession() last started a validation
+        self.validating = False # a validation is running
 
     def setUpOutfile(self, filename):
-        """ Opens the specified file; saves a filehandle in self.outfile """
+        """
+        Opens the specified file; saves a filehandle in self.outfile, and a BufferedWriter
+        feeding it (and stdout, if self.echo) according to self.flushPolicy in self.writer
+        """
         self.outfile = open(filename, 'w')
+        sinks = [self.outfile]
+        if self.echo:
+            sinks.append(sys.stdout)
+        self.writer = BufferedWriter(sinks, self.flushPolicy, owned=[self.outfile])
+
+    def setUpBinary(self, filename):
+        """
+        Opens a binary log (see binary_log.py) at filename, with the gauge units and capacitance scales in its header;
+        saves the BinaryRecorder in self.binary. Call once the units are known.
+        """
+        binfile = open(filename, 'wb')
+        self.binaryWriter = BufferedWriter([binfile], self.flushPolicy, owned=[binfile])
+        self.binary = BinaryRecorder(self.binaryWriter, chamber=self.chamber, testMode=self.testMode,
+                pirani_units=self.pirani_units, capacitance_units=self.capacitance_units,
+                capacitance_fullscale=list(self.capacitance_fullscale), capacitance_minscale=list(self.capacitance_minscale),
+                starttime=self.starttime)
+
+    def openSerial(self, port, gauge):
+        """ Opens the serial port for a gauge ('pirani' or 'capacitance'), recording its traffic if self.captureDir is set """
+        ser = serial.Serial(port, 9600, 8, 'N', 1)
+        if self.captureDir is not None:
+            from tests.serialCapture import CapturingSerial
+            ser = CapturingSerial(ser, os.path.join(self.captureDir, gauge + ".jsonl"))
+        return ser
+
+    def replaySerial(self, gauge):
+        """ Returns a ReplaySerial serving the capture of a gauge ('pirani' or 'capacitance') from self.replayDir """
+        from tests.serialCapture import ReplaySerial
+        return ReplaySerial(os.path.join(self.replayDir, gauge + ".jsonl"), self.replaySpeed)
+
+    def gaugePort(self, gauge):
+        """ Returns the serial port of a gauge ('pirani' or 'capacitance') as a gauge broker names it """
+        if self.testMode:
+            return "test-" + gauge
+        templ = self.pirani_port_templ if gauge == "pirani" else self.capacitance_port_templ
+        if self.chamber == 1:
+            return templ % (0)
+        elif self.chamber == 2:
+            return templ % (2)
+        raise no_system(self.chamber)
+
+    def brokerGauge(self, gauge):
+        """ Returns a RemotePirani or RemoteCapacitance reading a gauge ('pirani' or 'capacitance') through self.broker """
+        from gauge_broker import BrokerConnection, RemotePirani, RemoteCapacitance
+        gaugeClass = RemotePirani if gauge == "pirani" else RemoteCapacitance
+        return gaugeClass(BrokerConnection(self.broker, self.gaugePort(gauge)), self.debug, chamber=self.chamber)
 
-    def setUpPirani(self):  
+    def setUpPirani(self, pirani_serial=None):  
         """ 
         Creates a connection to the Pirani gauge via pySerial, unless in test mode.
         In test mode, creates a connection to a mockup pirani gauge using MockPirani.
+        If pirani_serial is given, that already-open port is used instead; otherwise, if self.broker is set,
+        the gauge is read through the gauge broker.
         The Pirani instance can be accessed via self.pirani 
         """
-        pirani_serial = None 
-        if self.testMode:
+        if pirani_serial is None and self.broker is not None:
+            self.pirani = self.brokerGauge("pirani")
+            return
+        if pirani_serial is not None:
+            pass
+        elif self.replayDir is not None:
+            pirani_serial = self.replaySerial("pirani")
+        elif self.testMode:
             pirani_serial = MockPirani("TEST_PIRANI", 9600, 8, 'N', 1)
         elif self.chamber == 1:
             pirani_port = self.pirani_port_templ % (0)
-            pirani_serial = serial.Serial(pirani_port, 9600, 8, 'N', 1)
+            pirani_serial = self.openSerial(pirani_port, "pirani")
         elif self.chamber == 2:
             pirani_port = self.pirani_port_templ % (2)
-            pirani_serial = serial.Serial(pirani_port, 9600, 8, 'N', 1)
+            pirani_serial = self.openSerial(pirani_port, "pirani")
         else: 
             raise no_system(self.chamber)
-        self.pirani = Pirani(pirani_serial, self.debug)
+        self.pirani = Pirani(pirani_serial, self.debug, self.pirani_address, chamber=self.chamber)
         self.pirani.flush()
 
-    def setUpCapacitance(self):
+    def setUpCapacitance(self, cap_serial=None):
         """ 
         Creates a connection to the capacitance gause via pySerial, unless in test mode.
         In test mode, creates a connection to a mockup capacitance gauge using MockCapacitance.
+        If cap_serial is given, that already-open port is used instead; otherwise, if self.broker is set,
+        the gauge is read through the gauge broker.
         The Capacitance instance can be accessed via self.capacitance 
         """
-        cap_serial = None 
-        if self.testMode:
+        if cap_serial is None and self.broker is not None:
+            self.capacitance = self.brokerGauge("capacitance")
+            self.capacitance.setFullscaleManual(self.capacitance_fullscale)
+            self.capacitance.setMinscaleManual(self.capacitance_minscale)
+            return
+        if cap_serial is not None:
+            pass
+        elif self.replayDir is not None:
+            cap_serial = self.replaySerial("capacitance")
+        elif self.testMode:
             cap_serial = MockCapacitance("TEST_CAP", 9600, 8, 'N', 1)
         elif self.chamber == 1:
             cap_port = self.capacitance_port_templ % (0)
-            cap_serial = serial.Serial(cap_port, 9600, 8, 'N', 1)
+            cap_serial = self.openSerial(cap_port, "capacitance")
         elif self.chamber == 2:
             cap_port = self.capacitance_port_templ % (2)
-            cap_serial = serial.Serial(cap_port, 9600, 8, 'N', 1)
+            cap_serial = self.openSerial(cap_port, "capacitance")
         else: 
             raise no_system(self.chamber)
-        self.capacitance = Capacitance(cap_serial, self.debug)
+        self.capacitance = Capacitance(cap_serial, self.debug, chamber=self.chamber)
         self.capacitance.setFullscaleManual(self.capacitance_fullscale)
         self.capacitance.setMinscaleManual(self.capacitance_minscale)
         self.capacitance.flush()
 
+    def setUpStore(self):
+        """ Creates self.store, a SampleStore that recordRow() fills from then on """
+        if self.store is None:
+            from sample_store import SampleStore
+            self.store = SampleStore(("pirani", "capacitance 0", "capacitance 1"))
+
+    def setUpAnalytics(self, threshold=None, every=60.):
+        """
+        Creates self.analytics, which recordRow() updates with every row from then on
+        arguments:
+        threshold -- pressure to estimate the time to (None for no estimate)
+        every -- seconds between '# Analytics:' comment lines in the output
+        """
+        from analytics import Analytics
+        self.analytics = Analytics(("pirani", "capacitance 0", "capacitance 1"), threshold)
+        self.analyticsEvery = every
+
+    def attachPlot(self):
+        """ Opens a live plot of self.store (creating the store if needed); matplotlib is only imported here """
+        if self.plot != None:
+            return
+        from live_plot import LivePlot
+        self.setUpStore()
+        self.plot = LivePlot(self.store, ('Pirani ({0})'.format(self.pirani_units), 'capacitance 0 ({0})'.format(self.capacitance_units), 'capacitance 1 ({0})'.format(self.capacitance_units)), 'Pressure in chamber %s' % self.chamber)
+
+    def detachPlot(self):
+        """ Closes the live plot, if any; recording carries on """
+        if self.plot != None:
+            self.plot.close()
+            self.plot = None
+
+    def refreshPlot(self):
+        if self.plot != None:
+            start = time.monotonic()
+            if self.analytics != None:
+                self.plot.setStatus(self.analytics.status())
+            self.plot.refresh()
+            _plotTime.observe(time.monotonic() - start)
+
+    def pause(self, seconds):
+        """ Sleeps for the given time; while a plot is attached, its window keeps handling events meanwhile """
+        if self.plot != None:
+            self.plot.pause(seconds)
+        else:
+            time.sleep(seconds)
+
+    def gauges(self):
+        """ Returns the (name, PressureGauge) pairs that have been set up, in output column order """
+        out = []
+        if self.pirani != None:
+            out.append(("pirani", self.pirani))
+        if self.capacitance != None:
+            out.append(("capacitance", self.capacitance))
+        return out
+
+    def setUpSampler(self):
+        """ Creates a ConcurrentSampler over all gauges set up so far; saved in self.sampler """
+        self.sampler = ConcurrentSampler(self.gauges(), self.debug, self.sampleTimeout)
+
+    def sessionKey(self):
+        """ What the cached settings depend on: the gauges' ports and the configured capacitance scales """
+        def port(gauge):
+            ser = getattr(gauge, 'innerSerial', None)
+            return getattr(ser, 'port', None) or getattr(ser, 'name', None) or type(ser).__name__
+        return {"pirani": port(self.pirani), "capacitance": port(self.capacitance), "pirani_address": self.pirani_address,
+                "capacitance_fullscale": list(self.capacitance_fullscale), "capacitance_minscale": list(self.capacitance_minscale)}
+
+    def validateSession(self):
+        """
+        Re-reads the gauge units and the reported capacitance fullscale in the background, on the sampler's port
+        workers, and stores them in self.session. Units that differ from the ones in use are adopted and noted in
+        the output. The fullscale query is slow and unreliable, so it is sent once, without retries, and its
+        failure neither counts against the gauge nor fails the validation.
+        Call once the sampler is set up; does nothing without a session cache or while a validation is running.
+        recordRow() calls it again once the session's ttl has passed.
+        """
+        if self.session == None or self.sampler == None or self.validating:
+            return
+        self.validating = True
+        self.lastValidation = self.clock()
+        key = self.sessionKey()
+        futures = [self.sampler.submit(self.pirani, self.pirani.getUnits),
+                   self.sampler.submit(self.capacitance, self.capacitance.getUnits),
+                   self.sampler.submit(self.capacitance, self.capacitance.probeFullscale)]
+        thread = threading.Thread(target=self._finishValidation, args=(key, futures), name="SessionValidation")
+        thread.daemon = True
+        thread.start()
+
+    def _finishValidation(self, key, futures):
+        try:
+            self._storeValidation(key, futures)
+        finally:
+            self.validating = False
+
+    def _storeValidation(self, key, futures):
+        try:
+            pirani_units, capacitance_units, fullscale = [f.result() for f in futures]
+        except Exception as err:
+            self.session.invalidate()
+            self.comments.append("# %s gauge settings not validated: %s\n" % (self.isonow(), err))
+            return
+        if (pirani_units, capacitance_units) != (self.pirani_units, self.capacitance_units):
+            self.pirani_units = pirani_units
+            self.capacitance_units = capacitance_units
+            self.comments.append("# %s Gauge Units changed: %s %s\n" % (self.isonow(), pirani_units, capacitance_units))
+        self.session.store(key, {"pirani_units": pirani_units, "capacitance_units": capacitance_units,
+                                 "capacitance_fullscale_reported": fullscale})
+
     def isonow(self):
         n = datetime.datetime.now()
         return n.strftime(self.isoformat)
 
     def timeElapsed(self):
-        later = self.isonow()
-        earlier = self.starttime
+        """ Seconds since the measurement start time, on the monotonic clock, with sub-second precision """
+        diff = self.clock() - self.startclock
         if self.debug:
             sys.stderr.write("elapsed\n")
-            sys.stderr.flush()
-        l = datetime.datetime.now()
-        l = l.strptime(later, self.isoformat)
-        e = l.strptime(earlier, self.isoformat)
-        diff = (l-e).total_seconds()
-        if self.debug:
-            sys.stderr.write("\tlater: %s\n" % l)
-            sys.stderr.write("\tearlier: %s\n" % e)
-            sys.stderr.write("\tdiff: %d\n" % diff)
+            sys.stderr.write("\tearlier: %s\n" % self.starttime)
+            sys.stderr.write("\tdiff: %.3f\n" % diff)
             sys.stderr.flush()
         return diff
 
     
     def teeWrite(self, ostr):
-        """ Write string ostr to both the output file and stdout """
-        self.outfile.write(ostr)
-        self.outfile.flush()
-        sys.stdout.write(ostr)
-        sys.stdout.flush()
+        """ Write string ostr to both the output file and stdout (stdout only if self.echo), through self.writer """
+        self.writer.write(ostr)
+
+    def recordRow(self, row):
+        """
+        Writes one data line for a Row from the sampler, which must hold 'pirani' and 'capacitance' readings,
+        appends it to self.store if there is one, and publishes it if there is a publisher (and to self.ring).
+        With a deadband, rows it rejects are kept in the store and published but not written to the files.
+        A gauge that gave no reading is written as nan; a comment line marks when it fails and when it recovers.
+        A failure invalidates the session cache (so the next start queries the gauges); while every gauge reads,
+        the cache is revalidated once its ttl has passed since the last validation.
+        With an interlock, the row is checked against its rules first; rules that fire or clear get a comment line.
+        Each written line ends with its interval: the seconds since the previous written line (0 for the first).
+        With analytics, every row updates them; their summary is published with the row, and written as an
+        '# Analytics:' comment line every self.analyticsEvery seconds.
+        returns: (elapsed time, pirani value, list of capacitance values)
+        """
+        pirani_val = row["pirani"].values[0]
+        capacitance_val = row["capacitance"].values
+        timeT = self.timeElapsed()
+        if self.interlock != None:
+            for event in self.interlock.evaluate(timeT, row.timestamp, [pirani_val] + capacitance_val):
+                value = "%.3g" % event["value"] if event["value"] is not None else "-"
+                self.teeWrite("# %s interlock %s: %s (%s)\n" % (self.isonow(), event["rule"], event["state"].upper(), value))
+        while self.comments:
+            self.teeWrite(self.comments.popleft())
+        for r in row.readings:
+            if r.error is not None and r.name not in self.failing:
+                self.failing.add(r.name)
+                self.teeWrite("# %s %s failed: %s\n" % (self.isonow(), r.name, r.error))
+                if self.session != None:
+                    self.session.invalidate()
+            elif r.error is None and r.name in self.failing:
+                self.failing.discard(r.name)
+                self.teeWrite("# %s %s recovered\n" % (self.isonow(), r.name))
+        if self.session != None and not self.failing and self.lastValidation != None and self.clock() - self.lastValidation >= self.session.ttl:
+            self.validateSession()
+        if self.deadband == None or self.deadband.accept(timeT, [pirani_val] + capacitance_val):
+            interval = timeT - self.lastRecorded if self.lastRecorded != None else 0.
+            self.lastRecorded = timeT
+            ostr = "%s\t%.3f\t%.02e\t%.02e\t%.02e\t%.3f\n" % (self.isonow(), timeT, pirani_val, capacitance_val[0], capacitance_val[1], interval)
+            self.teeWrite(ostr)
+            if self.binary != None:
+                if self.binary.units() != (self.pirani_units, self.capacitance_units):
+                    self.binary.changeUnits(timeT, self.pirani_units, self.capacitance_units) # found by validateSession()
+                self.binary.write((row.timestamp, timeT, pirani_val, capacitance_val[0], capacitance_val[1], interval))
+        if self.store != None:
+            self.store.append(timeT, [pirani_val] + capacitance_val)
+        if self.ring != None:
+            self.ring.append(row.timestamp, timeT, pirani_val, capacitance_val)
+        summary = None
+        if self.analytics != None:
+            self.analytics.update(timeT, [pirani_val] + capacitance_val)
+            summary = self.analytics.summary()
+            if self.lastAnalytics == None or timeT - self.lastAnalytics >= self.analyticsEvery:
+                self.lastAnalytics = timeT
+                self.teeWrite(self.analytics.comment(summary))
+        if self.publisher != None:
+            self.publisher.publish(self.chamber, row.timestamp, timeT, pirani_val, capacitance_val, summary)
+        return timeT, pirani_val, capacitance_val
 
     def closeAll(self):
-        """ Closes output file, and connections to both gauges """
-        if self.outfile != None:
-            sys.stderr.write("\tClosing output file ....\n")
-            sys.stderr.flush()
-            self.outfile.close()
+        """ Closes the plot, output file, and connections to both gauges """
+        self.detachPlot()
+        if self.ring != None:
+            self.ring.close()
+        if self.sampler != None:
+            self.sampler.close()
+        for writer, what in ((self.writer, "output file"), (self.binaryWriter, "binary log")):
+            if writer != None:
+                sys.stderr.write("\tClosing %s ....\n" % what)
+                sys.stderr.flush()
+                try:
+                    writer.close()
+                except Exception as err:
+                    # the gauges still need closing; the data lost is already reported by the writer
+                    sys.stderr.write("\tCould not close the %s cleanly: %s\n" % (what, err))
         # code duplication ... ick
         if self.pirani != None:
             sys.stderr.write("\tClosing Pirani serial port ....\n")
             sys.stderr.flush()
             self.pirani.close()
+            finishCapture(self.pirani)
         if self.capacitance != None:
             sys.stderr.write("\tClosing Capacitance Manometer serial port ....\n")
             sys.stderr.flush()
             self.capacitance.close()
+            finishCapture(self.capacitance)
+
+
+def finishCapture(gauge):
+    """ Closes the capture file of a gauge whose traffic was recorded (see VacuumReader.openSerial) """
+    finish = getattr(gauge.innerSerial, 'finish', None)
+    if finish is not None:
+        finish()
 
 
 def setUp(reader):
@@ -137,16 +416,33 @@ def setUp(reader):
     reader -- an instance of VacuumReader
 
     Creates an instance of VacuumReader, establishes connections to pressure gauges (real or mock), creates an output file.
-    Writes header data (column names, etc) for the output file, gets the units of measurement from the gauges, and sets the 
-    measurement start time.
+    Writes header data (column names, etc) for the output file, gets the units of measurement from the gauges (or from
+    reader.session, then validated in the background), and sets the measurement start time.
 
     returns: the vacuumReader object, now fully set up
     """
     
     reader.setUpPirani()
     reader.setUpCapacitance()
+    reader.setUpSampler()
+    setUpOutput(reader)
+    reader.validateSession()
+    return reader
+
+
+def setUpOutput(reader, oname=None):
+    """
+    Utility method -- opens the output file for a reader whose gauges are already set up, writes its header,
+    and sets the measurement start time.
 
-    oname = "vacuum-%s.csv" % reader.isonow()
+    arguments:
+    reader -- an instance of VacuumReader, with pirani and capacitance set up
+    oname -- output file name; defaults to vacuum-<now>.csv
+
+    returns: the vacuumReader object
+    """
+    if oname is None:
+        oname = "vacuum-%s.csv" % reader.isonow()
     reader.setUpOutfile(oname)
 
     if reader.testMode:
@@ -156,26 +452,42 @@ def setUp(reader):
     ostr = "# Opened %s for output\n" % oname
     reader.teeWrite(ostr)
 
-    ostr = "# Format Version: 3.0\n"
+    ostr = "# Format Version: 3.2\n" # 3.1 added the Interval column, 3.2 the Chamber line
+    reader.teeWrite(ostr)
+
+    ostr = "# Chamber: %s\n" % reader.chamber
     reader.teeWrite(ostr)
 
-    ostr = "# Columns: DateTime [localtime];Elapsed [s];Pirani; High Range Capacitance Manometer; Low Range Capacitance Manometer\n"
+    ostr = "# Columns: DateTime [localtime];Elapsed [s];Pirani; High Range Capacitance Manometer; Low Range Capacitance Manometer; Interval [s]\n"
     reader.teeWrite(ostr)
 
-    pirani_units = reader.pirani.getUnits()
-    capacitance_units = reader.capacitance.getUnits()
+    cached = reader.session.lookup(reader.sessionKey()) if reader.session != None else None
+    if cached != None:
+        # warm start: no serial queries before the first sample; validateSession() checks these later
+        pirani_units = cached["pirani_units"]
+        capacitance_units = cached["capacitance_units"]
+    else:
+        pirani_units = reader.pirani.getUnits()
+        capacitance_units = reader.capacitance.getUnits()
+        if reader.session != None:
+            reader.session.store(reader.sessionKey(), {"pirani_units": pirani_units, "capacitance_units": capacitance_units})
     reader.pirani_units = pirani_units
     reader.capacitance_units = capacitance_units
-    #capacitance_fullscale = read_capacitance_fullscale()
-    #print(reader.capacitance.getFullscale())
     ostr = "# Gauge Units: %s %s\n" % (pirani_units,capacitance_units)
     reader.teeWrite(ostr)
+    if cached != None:
+        validated = datetime.datetime.fromtimestamp(reader.session.validated()).strftime(reader.isoformat)
+        reader.teeWrite("# Gauge Units from the session cache, validated %s\n" % validated)
 
     reader.starttime = reader.isonow()
+    reader.startclock = reader.clock()
+    if reader.recordBinary:
+        reader.setUpBinary(os.path.splitext(oname)[0] + ".vbin")
     return reader
 
 
 def handleExit(signal, frame):
+    flushAll()
     raise SystemExit
 
 
@@ -193,48 +505,82 @@ class no_system(Exception):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        sys.stdout.write("Usage: `python vacuum_reader.py chamberNum` # chamberNum may be 1, 2, or -1 (-1 indicates test mode)\n")
-        sys.exit()
+    parser = argparse.ArgumentParser(description="Record (and live-plot) the pressure in one vacuum chamber")
+    parser.add_argument("chamber", type=int, help="chamber number: 1, 2, or -1 for test mode")
+    parser.add_argument("period", type=float, nargs="?", default=9.0, help="seconds between samples (default 9); the longest period with --adaptive")
+    parser.add_argument("--adaptive", metavar="MIN_PERIOD", type=float, help="sample faster, down to MIN_PERIOD seconds, while the pressure is changing")
+    parser.add_argument("--deadband", metavar="FRACTION", type=float, help="only write rows in which some reading moved by more than FRACTION (e.g. 0.02)")
+    parser.add_argument("--heartbeat", type=float, default=300., help="with --deadband, write a row at least this often in seconds (default 300)")
+    parser.add_argument("--analytics", metavar="SECONDS", type=float, help="keep running pumpdown statistics and write them to the output every SECONDS")
+    parser.add_argument("--threshold", metavar="PRESSURE", type=float, help="with --analytics, estimate the time until the pressure reaches PRESSURE")
+    parser.add_argument("--session-ttl", metavar="SECONDS", type=float, default=86400., help="reuse cached gauge settings validated within SECONDS at startup; 0 always queries the gauges (default 86400)")
+    parser.add_argument("--headless", action="store_true", help="only record data; do not load matplotlib or open a plot")
+    parser.add_argument("--binary", action="store_true", help="also record a .vbin binary log next to the CSV")
+    parser.add_argument("--capture", metavar="DIR", help="record all serial traffic to DIR/pirani.jsonl and DIR/capacitance.jsonl")
+    parser.add_argument("--replay", metavar="DIR", help="replay gauges from captures in DIR instead of opening serial ports")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed-up factor; 0 replays as fast as possible (default 1)")
+    parser.add_argument("--broker", metavar="ADDRESS", help="read the gauges through the gauge_broker.py listening at ADDRESS instead of opening the serial ports")
+    parser.add_argument("--publish", metavar="ADDRESS", help="stream every sample to subscribers at HOST:PORT (TCP) or at a Unix socket path")
+    parser.add_argument("--interlock", metavar="RULES", help="check every sample against the alarm/interlock rules in the JSON file RULES (see interlock.py)")
+    parser.add_argument("--ring", action="store_true", help="also write every sample to a shared-memory ring, /dev/shm/vacuum-<chamber>.ring (see sample_ring.py)")
+    parser.add_argument("--metrics", metavar="ADDRESS", help="serve Prometheus metrics at HOST:PORT (HTTP) or at a Unix socket path")
+    args = parser.parse_args()
 
     signal.signal(signal.SIGHUP, handleExit)
     signal.signal(signal.SIGINT, handleExit)
     signal.signal(signal.SIGQUIT, handleExit)
     signal.signal(signal.SIGTERM, handleExit)
 
-    sys.stdout.write("VACUUM READER\n***********\nPressure data will be live-plotted. Please save the plot manually before exiting vacuum_reader\n**********\n")
-    reader = VacuumReader(int(sys.argv[1]), False)
-    delaytime = 9.0 # inter-measurement delay time
+    if args.headless:
+        sys.stdout.write("VACUUM READER\n***********\nHeadless mode: recording only, no plot\n**********\n")
+    else:
+        sys.stdout.write("VACUUM READER\n***********\nPressure data will be live-plotted. Please save the plot manually before exiting vacuum_reader\n**********\n")
+    if args.metrics:
+        metrics.serve(args.metrics)
+    reader = VacuumReader(args.chamber, False)
+    reader.recordBinary = args.binary
+    reader.captureDir = args.capture
+    reader.replayDir = args.replay
+    reader.replaySpeed = args.speed or None
+    reader.broker = args.broker
+    reader.sampleTimeout = args.period
+    if args.session_ttl > 0:
+        from session_cache import forChamber
+        reader.session = forChamber(args.chamber, ttl=args.session_ttl)
+    if args.deadband is not None:
+        reader.deadband = Deadband(args.deadband, args.heartbeat)
+    if args.analytics is not None:
+        reader.setUpAnalytics(args.threshold, args.analytics)
+    if args.publish:
+        from publisher import Publisher
+        reader.publisher = Publisher(args.publish)
+    if args.ring:
+        from sample_ring import SampleRing, ringPath
+        reader.ring = SampleRing(ringPath(args.chamber), args.chamber)
+    dispatcher = None
+    if args.interlock:
+        import interlock
+        dispatcher = interlock.Dispatcher()
+        reader.interlock = interlock.Interlock(interlock.load(args.interlock), args.chamber, dispatcher)
+    delaytime = args.period # inter-measurement period
+    scheduler = None
     try:
         reader = setUp(reader)
         # start data collection
-        timeAxis = []
-        piraniVals = []
-        capVals_1 = []
-        capVals_2 = []
-        figure = plt.figure(1)
-        plt.ion()
-        plt.show()
+        if not args.headless:
+            reader.attachPlot()
 
+        if args.adaptive:
+            scheduler = AdaptiveScheduler(args.adaptive, delaytime, sleep=reader.pause)
+        else:
+            scheduler = FixedRateScheduler(delaytime, sleep=reader.pause)
         while True:
-            pirani_val = reader.pirani.getPressure()[0]
-            capacitance_val = reader.capacitance.getPressure()
-            timeT = reader.timeElapsed()
-            ostr = "%s\t%d\t%.02e\t%.02e\t%.02e\n" % (reader.isonow(), timeT, pirani_val, capacitance_val[0], capacitance_val[1])
-            reader.teeWrite(ostr)
-
-            timeAxis.append(timeT)
-            piraniVals.append(pirani_val)
-            capVals_1.append(capacitance_val[0])
-            capVals_2.append(capacitance_val[1])
-            figure.clear()
-            lines = plt.plot(timeAxis, piraniVals, timeAxis, capVals_1, timeAxis, capVals_2)
-            plt.xlabel('Time (seconds)')
-            plt.ylabel('Pressure')
-            plt.title('Pressure in chamber')
-            plt.legend(lines, ('Pirani ({0})'.format(reader.pirani_units), 'capacitance 0 ({0})'.format(reader.capacitance_units), 'capacitance 1 ({0})'.format(reader.capacitance_units)))
-            plt.draw()
-            plt.pause(delaytime)
+            scheduler.wait()
+            reader.sampler.timeout = scheduler.period # the current period, which --adaptive shortens
+            row = reader.sampler.sample()
+            timeT, pirani_val, capacitance_val = reader.recordRow(row)
+            scheduler.observe(timeT, [pirani_val] + capacitance_val)
+            reader.refreshPlot()
 
     except NameError:
         None
@@ -248,4 +594,12 @@ if __name__ == '__main__':
         sys.stderr.write("%s\n" % sys.exc_info()[1])
         sys.stderr.flush()
 
+    if scheduler != None:
+        sys.stderr.write("\tSamples: %(fired)d, missed deadlines: %(missed)d, jitter mean/max: %(jitter_mean).4f/%(jitter_max).4f s\n" % scheduler.stats())
+    if reader.deadband != None:
+        sys.stderr.write("\tRows not written (deadband): %d\n" % reader.deadband.skipped)
     reader.closeAll()
+    if reader.publisher != None:
+        reader.publisher.close()
+    if dispatcher != None:
+        dispatcher.close()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Live samples in shared memory: a fixed-layout ring buffer in /dev/shm, one per chamber.
+
+The acquisition process writes every sample into /dev/shm/vacuum-<chamber>.ring (SampleRing); local tools map
+the same file read-only (RingReader) and read the newest samples straight out of memory -- no socket, no text
+to parse, no system call per read, and no lock the writer could wait on.
+
+Layout (little-endian; a C or NumPy reader needs nothing else):
+    header, 64 bytes:  magic b"VACRING1", u32 version, u32 header size, u32 record size, u32 capacity,
+                       u64 written (number of records ever written), 16s chamber, f64 start (unix time), padding
+    record k (k = 0, 1, ...) at header size + (k % capacity) * record size, 48 bytes:
+                       u64 seq, f64 time (unix), f64 elapsed (s), f64 pirani, f64 capacitance 0, f64 capacitance 1
+
+Each record is guarded by its own sequence number (a seqlock): the writer sets seq to 2k+1 before changing
+record k, and to 2k+2 once it is complete, then advances `written`. A reader copies the record and accepts it
+only if seq read 2k+2 both before and after the copy; otherwise the slot was being rewritten (or already holds
+a newer record) and the reader retries or skips it. Aligned 8-byte stores are single writes on the platforms
+we run on, and x86 keeps stores in order, so no fence is needed from Python.
+
+A new run replaces the file (readers holding the old one see stale() become true); the last run's file is
+left in place when the writer closes, so a tool started later still finds the latest samples.
+
+Usage:
+    python sample_ring.py CHAMBER [N]      prints the newest N samples of a chamber
+"""
+
+import collections, mmap, os, struct, sys, tempfile, time
+
+MAGIC = b"VACRING1"
+RING_VERSION = 1
+HEADER = struct.Struct("<8sIIIIQ16sd")
+HEADER_SIZE = 64
+WRITTEN_OFFSET = 24 # offset of `written` in the header
+SEQ = struct.Struct("<Q")
+VALUES = struct.Struct("<5d")
+RECORD_SIZE = SEQ.size + VALUES.size
+
+Sample = collections.namedtuple('Sample', ['index', 'time', 'elapsed', 'pirani', 'capacitance0', 'capacitance1'])
+
+
+def ringPath(chamber, directory=None):
+    """ Where the ring of a chamber lives: /dev/shm if the system has it, else the temporary directory """
+    if directory is None:
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, "vacuum-%s.ring" % chamber)
+
+
+class SampleRing(object):
+    """ Writer side: creates the ring file and appends samples to it """
+
+    def __init__(self, path, chamber, capacity=4096):
+        """
+        Constructor
+        arguments:
+        path -- file to create (replacing any earlier one), normally ringPath(chamber)
+        chamber -- chamber name, stored in the header
+        capacity -- number of most recent samples kept
+        """
+        self.path = path
+        self.capacity = capacity
+        self.written = 0
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self.map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self.map, 0, MAGIC, RING_VERSION, HEADER_SIZE, RECORD_SIZE, capacity, 0,
+                         str(chamber).encode('utf8')[:16], time.time())
+        os.rename(tmp, path) # readers never see a half-initialized ring
+
+    def append(self, timestamp, elapsed, pirani, capacitance):
+        """ Writes one sample over the oldest one """
+        k = self.written
+        offset = HEADER_SIZE + (k % self.capacity) * RECORD_SIZE
+        SEQ.pack_into(self.map, offset, 2 * k + 1)
+        VALUES.pack_into(self.map, offset + SEQ.size, timestamp, elapsed, pirani, capacitance[0], capacitance[1])
+        SEQ.pack_into(self.map, offset, 2 * k + 2)
+        self.written = k + 1
+        SEQ.pack_into(self.map, WRITTEN_OFFSET, self.written)
+
+    def close(self):
+        self.map.close()
+
+
+class RingReader(object):
+    """ Reader side: maps a ring read-only and returns consistent copies of its newest samples """
+
+    def __init__(self, path, retries=100):
+        """
+        Constructor
+        arguments:
+        path -- ring file, e.g. ringPath(chamber)
+        retries -- attempts at a record the writer keeps changing before it is skipped
+        """
+        self.path = path
+        self.retries = retries
+        with open(path, 'rb') as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, headerSize, recordSize, capacity, written, chamber, start = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != RING_VERSION or recordSize != RECORD_SIZE:
+            raise ValueError("%s is not a version %d sample ring" % (path, RING_VERSION))
+        self.headerSize = headerSize
+        self.capacity = capacity
+        self.chamber = chamber.rstrip(b"\0").decode('utf8')
+        self.start = start
+        self.next = 0 # first record poll() has not returned yet
+
+    def written(self):
+        """ Number of samples written so far """
+        return SEQ.unpack_from(self.map, WRITTEN_OFFSET)[0]
+
+    def read(self, k):
+        """ Returns record k as a Sample, or None if it has been overwritten or could not be read consistently """
+        offset = self.headerSize + (k % self.capacity) * RECORD_SIZE
+        done = 2 * k + 2
+        for attempt in range(self.retries):
+            before = SEQ.unpack_from(self.map, offset)[0]
+            if before > done:
+                return None # overwritten by a newer record
+            values = VALUES.unpack_from(self.map, offset + SEQ.size)
+            if before == done and SEQ.unpack_from(self.map, offset)[0] == done:
+                return Sample(k, *values)
+        return None
+
+    def latest(self, n=1):
+        """ Returns up to n of the newest samples, oldest first """
+        end = self.written()
+        out = []
+        for k in range(max(0, end - min(n, self.capacity)), end):
+            sample = self.read(k)
+            if sample is not None:
+                out.append(sample)
+        return out
+
+    def poll(self):
+        """ Returns the samples written since the previous poll() (at most a ring's worth), oldest first """
+        end = self.written()
+        first = max(self.next, end - self.capacity)
+        self.next = end
+        return [s for s in (self.read(k) for k in range(first, end)) if s is not None]
+
+    def stale(self):
+        """ True once the writer has replaced the ring file (a new run): reopen it to follow the new one """
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except OSError:
+            return True
+
+    def close(self):
+        self.map.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stdout.write("Usage: `python sample_ring.py CHAMBER [N]` prints the newest N samples of a chamber's ring\n")
+        sys.exit()
+    reader = RingReader(ringPath(sys.argv[1]))
+    for s in reader.latest(int(sys.argv[2]) if len(sys.argv) > 2 else 10):
+        sys.stdout.write("%d\t%.3f\t%.3f\t%.02e\t%.02e\t%.02e\n" % s)
+    reader.close()
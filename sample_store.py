@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+"""
+Fixed-size in-memory store for pressure samples.
+
+SampleStore keeps the raw samples in a preallocated NumPy ring buffer, and maintains downsampled tiers
+(1-minute and 1-hour buckets by default) incrementally as samples arrive: each bucket keeps the min, max and
+mean of every column. Memory is allocated once up front, so a week-long run uses the same memory as a
+ten-minute one; the oldest data in each tier is overwritten when it wraps.
+
+Readers (the live plot, analysis code) get NumPy arrays back and can work on them vectorially.
+"""
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """ Preallocated 2D float64 ring buffer: `capacity` rows of `width` columns """
+
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.data = np.empty((capacity, width))
+        self.next = 0 # index the next row goes to
+        self.count = 0
+
+    def append(self, row):
+        self.data[self.next] = row
+        self.next = (self.next + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def latest(self, n=None):
+        """ Returns the newest n rows (all stored rows if n is None), oldest first, as one array """
+        if n is None or n > self.count:
+            n = self.count
+        start = self.next - n
+        if start >= 0:
+            return self.data[start:self.next]
+        return np.concatenate((self.data[start:], self.data[:self.next]))
+
+    def __len__(self):
+        return self.count
+
+
+class Tier(object):
+    """
+    Downsampled view of the samples: one row per `seconds`-long bucket.
+    Row layout: bucket start time, then min, max and mean of each column.
+    NaN values (a failed gauge) are left out of a bucket's statistics; a column with no reading in a bucket is NaN.
+    """
+
+    def __init__(self, seconds, capacity, nColumns):
+        self.seconds = float(seconds)
+        self.nColumns = nColumns
+        self.ring = RingBuffer(capacity, 1 + 3 * nColumns)
+        self.bucket = None # index of the bucket being filled
+        self.lo = np.empty(nColumns)
+        self.hi = np.empty(nColumns)
+        self.total = np.zeros(nColumns)
+        self.finite = np.zeros(nColumns) # values of each column in self.total
+        self.n = 0
+
+    def append(self, t, values):
+        bucket = int(t // self.seconds)
+        if bucket != self.bucket:
+            self._close()
+            self.bucket = bucket
+            self.lo[:] = values
+            self.hi[:] = values
+            self.total[:] = 0.
+            self.finite[:] = 0.
+            self.n = 0
+        # fmin/fmax ignore NaN, so one failed reading does not blank the bucket
+        np.fmin(self.lo, values, out=self.lo)
+        np.fmax(self.hi, values, out=self.hi)
+        ok = np.isfinite(values)
+        np.add(self.total, values, out=self.total, where=ok)
+        self.finite += ok
+        self.n += 1
+
+    def _mean(self):
+        with np.errstate(invalid='ignore'):
+            return self.total / self.finite # 0/0: NaN for a column with no reading
+
+    def _close(self):
+        if self.n:
+            self.ring.append(np.concatenate(((self.bucket * self.seconds,), self.lo, self.hi, self._mean())))
+        self.n = 0
+
+    def rows(self, n=None, includeOpen=True):
+        """ Returns the newest n stored bucket rows (all if None), oldest first, plus the bucket still being filled if includeOpen """
+        rows = self.ring.latest(n)
+        if includeOpen and self.n:
+            current = np.concatenate(((self.bucket * self.seconds,), self.lo, self.hi, self._mean()))
+            rows = np.vstack((rows, current))
+        return rows
+
+    def times(self, rows):
+        return rows[:, 0]
+
+    def minimum(self, rows, column):
+        return rows[:, 1 + column]
+
+    def maximum(self, rows, column):
+        return rows[:, 1 + self.nColumns + column]
+
+    def mean(self, rows, column):
+        return rows[:, 1 + 2 * self.nColumns + column]
+
+
+class SampleStore(object):
+    """
+    Raw ring buffer of (time, values...) rows plus downsampled tiers, all updated on append().
+    """
+
+    def __init__(self, columns, capacity=100000, tiers=((60, 20160), (3600, 8760))):
+        """
+        Constructor
+        arguments:
+        columns -- name of each value column
+        capacity -- number of raw samples kept (100000 is over a week at the default 9 s period)
+        tiers -- (bucket seconds, number of buckets kept) for each downsampled tier; the defaults keep
+                 two weeks of 1-minute buckets and a year of 1-hour buckets
+        """
+        self.columns = list(columns)
+        self.raw = RingBuffer(capacity, 1 + len(self.columns))
+        self.tiers = [Tier(seconds, n, len(self.columns)) for seconds, n in tiers]
+        self.row = np.empty(1 + len(self.columns))
+
+    def append(self, t, values):
+        """ Stores one sample: time t (e.g. elapsed seconds) and one value per column """
+        self.row[0] = t
+        self.row[1:] = values
+        self.raw.append(self.row)
+        for tier in self.tiers:
+            tier.append(t, self.row[1:])
+
+    def latest(self, n=None):
+        """ Returns (times, values) for the newest n raw samples; values has one column per store column """
+        rows = self.raw.latest(n)
+        return rows[:, 0], rows[:, 1:]
+
+    def tier(self, seconds):
+        """ Returns the Tier with the given bucket length """
+        for tier in self.tiers:
+            if tier.seconds == seconds:
+                return tier
+        raise KeyError(seconds)
+
+    def __len__(self):
+        return len(self.raw)
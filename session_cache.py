@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""
+Last-known-good gauge settings of a chamber, kept between runs so a restart needs no serial queries.
+
+Without a cache, every start asks each gauge for its units before the first sample can be written. With one,
+VacuumReader.setUpOutput() takes the units from .vacuum-session-<chamber>.json when the cached entry is still
+valid, and starts sampling at once; validateSession() then re-reads the units (and the capacitance controller's
+reported fullscale, which is too slow to wait for at startup, and is asked once without retries) on the
+sampler's port workers, between samples, and stores what it found.
+
+An entry is used only if it was validated less than `ttl` seconds ago and was recorded for the same key: the
+serial ports of the gauges and the configured capacitance fullscale/minscale. A new port mapping or new scales
+therefore start cold. A gauge failure invalidates the entry, so the next start queries the gauges again; a
+running reader validates once at startup, then again each time `ttl` has passed while every gauge reads.
+
+The file is written atomically (write to .<pid>.tmp, then rename), like the log index, and under a lock, since
+the validation thread and the sampling loop both write it.
+"""
+
+import json, os, threading, time
+
+SESSION_NAME = ".vacuum-session-%s.json"
+SESSION_VERSION = 1
+
+
+class SessionCache(object):
+    """ The cached settings of one chamber, in a JSON file """
+
+    def __init__(self, path, ttl=86400.):
+        """
+        Constructor
+        arguments:
+        path -- JSON file holding the cache; missing or unreadable files are an empty cache
+        ttl -- seconds after its last validation that an entry may still be used
+        """
+        self.path = path
+        self.ttl = ttl
+        self.data = {}
+        self.lock = threading.Lock() # the validation thread and the sampling loop both write the file
+        try:
+            with open(path) as f:
+                saved = json.load(f)
+            if saved.get("version") == SESSION_VERSION:
+                self.data = saved
+        except (OSError, ValueError):
+            pass
+
+    def lookup(self, key):
+        """ Returns the cached settings dict if they were validated under key less than ttl seconds ago, else None """
+        if not self.data or self.data.get("key") != key:
+            return None
+        if time.time() - self.data.get("validated", 0.) > self.ttl:
+            return None
+        return self.data["settings"]
+
+    def validated(self):
+        """ Unix time of the last validation, or None """
+        return self.data.get("validated") or None
+
+    def store(self, key, settings):
+        """ Records settings as valid for key, now """
+        with self.lock:
+            self.data = {"version": SESSION_VERSION, "key": key, "settings": settings, "validated": time.time()}
+            self._save()
+
+    def invalidate(self):
+        """ Keeps the entry for reference, but stops lookup() from returning it """
+        with self.lock:
+            if self.data and self.data.get("validated"):
+                self.data["validated"] = 0.
+                self._save()
+
+    def save(self):
+        with self.lock:
+            self._save()
+
+    def _save(self):
+        tmp = "%s.%d.tmp" % (self.path, os.getpid()) # another process of the same chamber uses its own
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.data, f, sort_keys=True)
+            os.rename(tmp, self.path)
+        except OSError:
+            pass # a read-only directory only costs the warm start
+
+
+def forChamber(chamber, directory=".", ttl=86400.):
+    """ Returns the SessionCache of a chamber, stored in directory """
+    return SessionCache(os.path.join(directory, SESSION_NAME % chamber), ttl)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+"""
+Acquisition benchmarks, reported as JSON.
+
+Times the acquisition pipeline piece by piece:
+* round-trip latency of Pirani / Capacitance commands (min, percentiles, max) and samples/s per gauge, against
+  the canned mock transports and against a pty-backed loopback port -- a real serial.Serial on the slave side of
+  a pseudo-terminal, answered by a simulated gauge on the master side, so the select()/read path is exercised
+* samples/s per chamber (a Pirani and a capacitance controller read by one ConcurrentSampler)
+* parser throughput of the protocol decoders, single replies and batches
+* writer throughput of a BufferedWriter to a file
+* plot refresh cost of a LivePlot over a filled SampleStore (skipped if matplotlib is missing)
+
+Every result is a metric {"value", "unit", "better": "lower" or "higher"} under a flat name such as
+"latency.pty.pirani.p50". With --compare, the run is checked against an earlier JSON report, and the exit status
+is 1 if any metric got worse by more than --tolerance; latency changes under NOISE_MS, and the tail latencies
+(p99, max), are ignored. A sleep that quantizes every read to 50 ms, say, shows up as a jump in latency.*.min
+and latency.*.p50.
+
+Usage:
+    python tests/benchmark.py [--quick] [--out FILE.json] [--compare BASELINE.json] [--tolerance 0.25]
+"""
+
+import argparse, json, os, platform, select, sys, tempfile, threading, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+try:
+	from .fakeSerial import MockPirani, MockCapacitance
+	from .gaugeSimulator import SimClock, ChamberModel, SimulatedPirani, SimulatedCapacitance
+except ImportError: # run from inside tests/
+	from fakeSerial import MockPirani, MockCapacitance
+	from gaugeSimulator import SimClock, ChamberModel, SimulatedPirani, SimulatedCapacitance
+from pressure_gauges import Pirani, Capacitance
+from protocol import PIRANI, CAPACITANCE
+from acquisition import ConcurrentSampler
+from writers import BufferedWriter, FlushPolicy
+from sys import stderr
+
+# the canned mock files hold 500 replies each
+MOCK_REPLIES = 500
+# latency changes smaller than this are timer noise, not regressions
+NOISE_MS = 1.0
+# tail latencies vary too much from run to run to gate on; they are reported only
+UNGATED = (".p99", ".max")
+
+
+def percentiles(samples):
+	""" Returns {min, p50, p90, p99, max, mean} of a list of numbers """
+	s = sorted(samples)
+	n = len(s)
+	def at(q):
+		return s[min(n - 1, int(round(q * (n - 1))))]
+	return {"min": s[0], "p50": at(.5), "p90": at(.9), "p99": at(.99), "max": s[-1], "mean": sum(s) / n}
+
+
+class PtyLoopback(object):
+
+	""" A pseudo-terminal whose master side is answered by a simulated gauge; open `port` with serial.Serial """
+
+	def __init__(self, simulated, commands):
+		"""
+		Constructor
+		arguments:
+		simulated -- SimulatedGauge whose reply(cmd) answers each command
+		commands -- the commands to recognize on the line (a command ends when the input ends with one of them)
+		"""
+		self.simulated = simulated
+		self.commands = [c.encode() for c in commands]
+		self.master, self.slave = os.openpty()
+		self.port = os.ttyname(self.slave)
+		self.running = True
+		self.thread = threading.Thread(target=self._run, name="PtyLoopback")
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _run(self):
+		buf = b""
+		while self.running:
+			ready = select.select([self.master], [], [], 0.1)[0]
+			if not ready:
+				continue
+			try:
+				buf += os.read(self.master, 1024)
+			except OSError:
+				return
+			for cmd in self.commands:
+				if buf.endswith(cmd):
+					os.write(self.master, self.simulated.reply(cmd.decode()))
+					buf = b""
+					break
+
+	def close(self):
+		self.running = False
+		self.thread.join()
+		os.close(self.master)
+		os.close(self.slave)
+
+
+class Benchmark(object):
+
+	""" Runs the benchmarks and collects their metrics """
+
+	def __init__(self, samples=400, quick=False):
+		self.samples = samples
+		self.quick = quick
+		self.metrics = {}
+		self.closers = []
+
+	def add(self, name, value, unit, better):
+		self.metrics[name] = {"value": value, "unit": unit, "better": better}
+
+	def addLatency(self, name, seconds):
+		for key, value in percentiles(seconds).items():
+			self.add("latency.%s.%s" % (name, key), value * 1e3, "ms", "lower")
+		self.add("throughput.gauge.%s" % name, len(seconds) / sum(seconds), "samples/s", "higher")
+
+	def timeCalls(self, call, n):
+		out = []
+		for i in range(n):
+			start = time.perf_counter()
+			call()
+			out.append(time.perf_counter() - start)
+		return out
+
+	def transports(self):
+		""" Yields (transport name, Pirani, Capacitance, number of reads) for each transport under test """
+		n = min(self.samples, MOCK_REPLIES)
+		yield "mock", Pirani(MockPirani(), False), Capacitance(MockCapacitance(), False), n
+		import serial
+		clock = SimClock()
+		model = ChamberModel()
+		pty = []
+		for simulated, gaugeClass in ((SimulatedPirani(model, clock), Pirani), (SimulatedCapacitance(model, clock), Capacitance)):
+			loop = PtyLoopback(simulated, (gaugeClass.pressureCommand, gaugeClass.unitsCommand))
+			port = serial.Serial(loop.port, 9600, timeout=0)
+			self.closers += [port.close, loop.close]
+			pty.append(gaugeClass(port, False))
+		yield "pty", pty[0], pty[1], self.samples
+
+	def runGauges(self):
+		for transport, pirani, cap, n in self.transports():
+			self.addLatency("%s.pirani" % transport, self.timeCalls(pirani.getPressure, n // 2))
+			self.addLatency("%s.capacitance" % transport, self.timeCalls(cap.getPressure, n // 2))
+			sampler = ConcurrentSampler([("pirani", pirani), ("capacitance", cap)], False)
+			rows = n // 2
+			start = time.perf_counter()
+			for i in range(rows):
+				sampler.sample()
+			self.add("throughput.chamber.%s" % transport, rows / (time.perf_counter() - start), "rows/s", "higher")
+			sampler.close()
+
+	def runParsers(self):
+		n = 20000 if self.quick else 200000
+		pirani = b"@253ACK7.60E+2;FF"
+		cap = "- 0.0003 000.52"
+		start = time.perf_counter()
+		for i in range(n):
+			PIRANI.split(pirani)
+		self.add("parser.pirani.single", n / (time.perf_counter() - start), "replies/s", "higher")
+		start = time.perf_counter()
+		for i in range(n):
+			CAPACITANCE.pressures(cap, (1000., 1.), (1e-1, 1e-4))
+		self.add("parser.capacitance.single", n / (time.perf_counter() - start), "replies/s", "higher")
+		try:
+			import numpy
+		except ImportError:
+			stderr.write("numpy not available: skipping batch parser benchmarks\n")
+			return
+		start = time.perf_counter()
+		PIRANI.batch(pirani * n, len(pirani))
+		self.add("parser.pirani.batch", n / (time.perf_counter() - start), "replies/s", "higher")
+		start = time.perf_counter()
+		CAPACITANCE.batch((cap + "\r\n").encode() * n, (1000., 1.), (1e-1, 1e-4))
+		self.add("parser.capacitance.batch", n / (time.perf_counter() - start), "replies/s", "higher")
+
+	def runWriter(self):
+		n = 20000 if self.quick else 200000
+		line = "2024-05-07-14-00-00\t12345.678\t7.60e+02\t7.60e+02\t1.00e+00\n"
+		with tempfile.TemporaryDirectory() as d:
+			f = open(os.path.join(d, "bench.csv"), 'w')
+			writer = BufferedWriter([f], FlushPolicy(), owned=[f])
+			start = time.perf_counter()
+			for i in range(n):
+				writer.write(line)
+			queued = time.perf_counter() - start
+			writer.close()
+			elapsed = time.perf_counter() - start
+		self.add("writer.write_call", queued / n * 1e6, "us", "lower")
+		self.add("writer.rows", n / elapsed, "rows/s", "higher")
+		self.add("writer.bytes", n * len(line) / elapsed / 1e6, "MB/s", "higher")
+
+	def runPlot(self):
+		try:
+			import matplotlib
+			matplotlib.use("Agg")
+			from sample_store import SampleStore
+			from live_plot import LivePlot
+		except ImportError:
+			stderr.write("matplotlib not available: skipping plot benchmarks\n")
+			return
+		store = SampleStore(["pirani", "capacitance 0", "capacitance 1"])
+		# a week of samples at the default 9 s period
+		for i in range(67200):
+			store.append(i * 9., (760., 760., 1.))
+		plot = LivePlot(store, store.columns)
+		self.addPlot("plot.refresh", plot, store, 67200)
+		plot.close()
+
+	def addPlot(self, name, plot, store, i):
+		costs = []
+		for j in range(20 if self.quick else 100):
+			store.append((i + j) * 9., (1e-3, 1e-3, 1e-3))
+			start = time.perf_counter()
+			plot.refresh()
+			costs.append(time.perf_counter() - start)
+		for key, value in percentiles(costs).items():
+			self.add("%s.%s" % (name, key), value * 1e3, "ms", "lower")
+
+	def run(self):
+		try:
+			self.runGauges()
+			self.runParsers()
+			self.runWriter()
+			self.runPlot()
+		finally:
+			for close in self.closers:
+				close()
+		return {
+			"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+			         "platform": platform.platform(), "samples": self.samples, "quick": self.quick},
+			"metrics": self.metrics,
+		}
+
+
+def msPer(metric):
+	""" Milliseconds per call or sample for a latency or sample-rate metric; NaN for any other metric """
+	if metric["unit"] == "ms":
+		return metric["value"]
+	if metric["unit"] in ("samples/s", "rows/s"):
+		return 1e3 / metric["value"]
+	return float("nan")
+
+
+def compare(report, baseline, tolerance):
+	""" Returns a list of (name, baseline value, new value) for the metrics that got worse by more than tolerance """
+	worse = []
+	for name, new in report["metrics"].items():
+		old = baseline["metrics"].get(name)
+		if old is None or not old["value"] or name.endswith(UNGATED):
+			continue
+		if abs(msPer(new) - msPer(old)) < NOISE_MS:
+			continue
+		change = (new["value"] - old["value"]) / old["value"]
+		if (new["better"] == "lower" and change > tolerance) or (new["better"] == "higher" and change < -tolerance):
+			worse.append((name, old["value"], new["value"]))
+	return worse
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Benchmark the acquisition pipeline")
+	parser.add_argument("--samples", type=int, default=400, help="gauge reads per transport (default 400)")
+	parser.add_argument("--quick", action="store_true", help="fewer iterations of the parser, writer and plot benchmarks")
+	parser.add_argument("--out", help="write the JSON report here instead of stdout")
+	parser.add_argument("--compare", help="JSON report of an earlier run to check for regressions")
+	parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative change before a metric counts as a regression")
+	args = parser.parse_args()
+
+	report = Benchmark(args.samples, args.quick).run()
+	text = json.dumps(report, indent=2, sort_keys=True) + "\n"
+	if args.out:
+		with open(args.out, 'w') as f:
+			f.write(text)
+	else:
+		sys.stdout.write(text)
+	if args.compare:
+		with open(args.compare) as f:
+			worse = compare(report, json.load(f), args.tolerance)
+		for name, old, new in worse:
+			stderr.write("REGRESSION %s: %.4g -> %.4g %s\n" % (name, old, new, report["metrics"][name]["unit"]))
+		sys.exit(1 if worse else 0)
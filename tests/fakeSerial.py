@@ -5,6 +5,7 @@ Initialize with the same arguments you would use for serial.Serial.
 Does not fully implement all serial methods yet, but currently does enough for read_vacuum.
 
 Currently, can imitate a serial connection to a single Pirani gauge or two capacitance gauges.
+AsyncMockPirani and AsyncMockCapacitance deliver the same replies through a pipe, for the asyncio gauges (async_gauges.py).
 
 To add a new gauge:
 * Create a new subclass of FakeSerial
@@ -15,7 +16,7 @@ To add a new gauge:
     * in __init__(), place the command that gets you that information as a key in self.cmdToDataLength, and the length of the respone as the value
 """
 
-import time, serial, os, sys
+import bisect, fcntl, select, struct, termios, time, serial, os, sys
 from sys import stderr
 
 
@@ -30,6 +31,7 @@ class FakeSerial:
 		if self.timeout is None:
 			self.timeout = 30 # sanity
 		self.lastCmd = None
+		self.inBuffer = b""
 		self.break_condition = False;
 		self.cmdToFile = {}
 		self.cmdToDataLength = {}
@@ -37,10 +39,11 @@ class FakeSerial:
 		stderr.write("\tFake serial port initialized\n")
 
 	def open(self):
-		# if test file is not open, open it
-		for fileHandle in self.cmdToFile.values():
+		# if test file is not open, open it again (from the start), as a reopened port would be
+		for cmd, fileHandle in list(self.cmdToFile.items()):
 			if fileHandle.closed:
-				fileHandle = open(fileHandle.name)
+				self.cmdToFile[cmd] = open(fileHandle.name)
+		self.inBuffer = b""
 
 	def close(self):
 		for fileHandle in self.cmdToFile.values():
@@ -53,19 +56,27 @@ class FakeSerial:
 				fileHandle.close()
 
 	def read(self, size=1):
-		# read *size* bytes from the file
-		# clear last command when done
-		out = ""
-		if self.lastCmd is None or self.lastCmd not in self.cmdToFile:
-			time.sleep(self.timeout)
-		else:
-			f = self.cmdToFile[self.lastCmd]
-			out = f.read(size)
-		self.lastCmd = None
+		# read up to *size* bytes of the reply to the last command
+		# unread bytes stay buffered, like a real port's input buffer
+		# canned replies arrive all at once, so there is never anything worth waiting for here
+		out = self.inBuffer[:size]
+		self.inBuffer = self.inBuffer[size:]
 		return out
 
+	def waitReadable(self, timeout):
+		# used by PressureGauge instead of select(): nothing more will arrive if the buffer is empty,
+		# so this only waits out the caller's deadline
+		if not self.inBuffer:
+			time.sleep(timeout)
+
 	def write(self, data):
+		# queue the canned reply to this command, as the gauge would send it
+		if isinstance(data, bytes):
+			data = data.decode()
 		self.lastCmd = data;
+		if data in self.cmdToFile and data in self.cmdToDataLength:
+			f = self.cmdToFile[data]
+			self.inBuffer += f.read(self.cmdToDataLength[data]).encode()
 		return len(data)
 
 	def flush(self):
@@ -73,11 +84,8 @@ class FakeSerial:
 		pass
 
 	def inWaiting(self):
-		# reads how many bytes are waiting in the input buffer -- depends on current command sent
-		if self.lastCmd is None or self.lastCmd not in self.cmdToDataLength:
-			return 0
-		else:
-			return self.cmdToDataLength[self.lastCmd]
+		# reads how many bytes are waiting in the input buffer -- depends on commands sent so far
+		return len(self.inBuffer)
 
 
 	def outWaiting(self):
@@ -103,6 +111,39 @@ class FakeSerial:
 	# TODO: handle the rest of the methods, so we don't have any weird unexpected behavior here!
 
 
+class TimedFakeSerial(FakeSerial):
+
+	""" FakeSerial whose reply bytes become readable at scheduled times, instead of all at once.
+	Subclasses set self.scheduled = [] in __init__ and call _schedule(delay, data) from write(). """
+
+	def _schedule(self, delay, data):
+		# data becomes readable `delay` seconds from now
+		bisect.insort(self.scheduled, (time.monotonic() + delay, data))
+
+	def _release(self):
+		# move reply bytes whose time has come into the input buffer
+		now = time.monotonic()
+		while self.scheduled and self.scheduled[0][0] <= now:
+			self.inBuffer += self.scheduled.pop(0)[1]
+
+	def read(self, size=1):
+		self._release()
+		return FakeSerial.read(self, size)
+
+	def inWaiting(self):
+		self._release()
+		return len(self.inBuffer)
+
+	def waitReadable(self, timeout):
+		self._release()
+		if self.inBuffer:
+			return
+		if self.scheduled:
+			time.sleep(max(0., min(timeout, self.scheduled[0][0] - time.monotonic())))
+		else:
+			time.sleep(timeout)
+
+
 class MockPirani(FakeSerial):
 
 	def __init__(self, port=None, baudrate=9600, bytesize=serial.EIGHTBITS, parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE, timeout=None, xonxoff=False, rtscts=False, write_timeout=None, dsrdtr=False, inter_byte_timeout=None):
@@ -110,6 +151,7 @@ class MockPirani(FakeSerial):
 		if self.timeout is None:
 			self.timeout = 30 # sanity
 		self.lastCmd = None
+		self.inBuffer = b""
 		self.name = "mockpirani"
 		self.cmdToDataLength = {
 			"@253U?;FF":14, # get units
@@ -131,6 +173,7 @@ class MockCapacitance(FakeSerial):
 		if self.timeout is None:
 			self.timeout = 30 # sanity
 		self.lastCmd = None
+		self.inBuffer = b""
 		self.name = "mockcapacitance"
 		self.cmdToDataLength = {
 			"u":4, # get units TODO GET CORRECT VALUES HERE!
@@ -149,3 +192,62 @@ class MockCapacitance(FakeSerial):
 			"f":ff,
 		}
 		sys.stderr.write("\tMock serial port to capacitance gauge initialized\n")
+
+
+class PipeFakeSerial(object):
+
+	""" Mixin for the mocks: replies are written into a pipe, so the port has a real file descriptor
+	(fileno()) that select() and event loops can watch, as they would a tty. Used by the async gauges. """
+
+	def _openPipe(self):
+		self.readEnd, self.writeEnd = os.pipe()
+		os.set_blocking(self.readEnd, False)
+
+	def fileno(self):
+		return self.readEnd
+
+	def write(self, data):
+		# the canned reply goes into the pipe instead of the input buffer
+		n = FakeSerial.write(self, data)
+		if self.inBuffer:
+			os.write(self.writeEnd, self.inBuffer)
+			self.inBuffer = b""
+		return n
+
+	def read(self, size=1):
+		try:
+			return os.read(self.readEnd, size)
+		except BlockingIOError:
+			return b""
+
+	def inWaiting(self):
+		return struct.unpack('i', fcntl.ioctl(self.readEnd, termios.FIONREAD, b'\0\0\0\0'))[0]
+
+	def waitReadable(self, timeout):
+		select.select([self.readEnd], [], [], timeout)
+
+	def open(self):
+		if self.readEnd is None:
+			self._openPipe()
+		FakeSerial.open(self)
+
+	def close(self):
+		if self.readEnd is not None:
+			os.close(self.readEnd)
+			os.close(self.writeEnd)
+			self.readEnd = self.writeEnd = None
+		FakeSerial.close(self)
+
+
+class AsyncMockPirani(PipeFakeSerial, MockPirani):
+
+	def __init__(self, *args, **kwargs):
+		MockPirani.__init__(self, *args, **kwargs)
+		self._openPipe()
+
+
+class AsyncMockCapacitance(PipeFakeSerial, MockCapacitance):
+
+	def __init__(self, *args, **kwargs):
+		MockCapacitance.__init__(self, *args, **kwargs)
+		self._openPipe()
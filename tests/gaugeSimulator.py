@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+Physically-modelled gauge simulator, behind the FakeSerial interface.
+
+A ChamberModel gives the pressure in a chamber over (simulated) time: an exponential pumpdown from
+atmosphere, a slower outgassing tail, a base pressure, an optional leak, periodic vents, and multiplicative
+noise. SimulatedPirani and SimulatedCapacitance answer the real gauge protocols from that model:
+MKS '@253ACK7.60E+2;FF' frames for the Pirani, and CR/LF-terminated two-channel lines for the capacitance
+controller -- 'Off' when a head is over range, and negative readings near zero with the minus sign split off
+('- 0.0003'). Replies arrive after a configurable latency and can be corrupted at a configurable rate.
+
+Simulation ties any number of chambers to one SimClock, whose sleep() jumps simulated time forward instead of
+waiting, so an acquisition loop paced by FixedRateScheduler(period, sleep=clock.sleep, clock=clock.now) runs
+hours of simulated time in seconds.
+
+Run as a script for a soak test of the acquisition loop:
+    python tests/gaugeSimulator.py --chambers 24 --hours 12 --period 9
+"""
+
+import argparse, math, os, random, resource, sys, tempfile, time
+try:
+	from .fakeSerial import TimedFakeSerial
+except ImportError: # run from inside tests/
+	from fakeSerial import TimedFakeSerial
+from sys import stderr
+
+
+class SimClock(object):
+
+	""" Simulated monotonic clock: real elapsed time plus every interval skipped with sleep() """
+
+	def __init__(self):
+		self.real0 = time.monotonic()
+		self.skipped = 0.
+
+	def now(self):
+		return time.monotonic() - self.real0 + self.skipped
+
+	def sleep(self, seconds):
+		self.skipped += max(0., seconds)
+
+
+class ChamberModel(object):
+
+	""" Pressure (torr) in a chamber as a function of simulated time """
+
+	def __init__(self, p0=760., base=2e-6, tau=40., outgas=2e-3, outgasTau=600., leak=0., ventEvery=None, noise=0.02, rng=None):
+		"""
+		p0 -- pressure at the start of each pumpdown
+		base -- ultimate pressure
+		tau -- time constant of the roughing pumpdown, seconds
+		outgas, outgasTau -- outgassing tail outgas*outgasTau/(t+outgasTau)
+		leak -- pressure rise per second from a leak
+		ventEvery -- if set, the chamber is vented and pumped down again every ventEvery seconds
+		noise -- standard deviation of the multiplicative (log-normal) noise
+		"""
+		self.p0 = p0
+		self.base = base
+		self.tau = tau
+		self.outgas = outgas
+		self.outgasTau = outgasTau
+		self.leak = leak
+		self.ventEvery = ventEvery
+		self.noise = noise
+		self.rng = rng if rng is not None else random.Random()
+
+	def pressure(self, t):
+		if self.ventEvery:
+			t = t % self.ventEvery
+		p = (self.p0 - self.base) * math.exp(-t / self.tau) + self.outgas * self.outgasTau / (t + self.outgasTau) + self.base + self.leak * t
+		return p * math.exp(self.rng.gauss(0., self.noise))
+
+
+class SimulatedGauge(TimedFakeSerial):
+
+	""" Common part of the simulated gauges: command dispatch, reply latency and corruption """
+
+	def __init__(self, model, clock, latency=0.0, corruption=0.0, rng=None, name="simulated"):
+		"""
+		model -- ChamberModel read by this gauge
+		clock -- SimClock giving the simulated time
+		latency -- real seconds between a command and its reply
+		corruption -- probability that a reply is corrupted (a byte flipped, truncated, or a NAK)
+		"""
+		self.timeout = 30 # sanity
+		self.lastCmd = None
+		self.inBuffer = b""
+		self.cmdToFile = {}
+		self.cmdToDataLength = {}
+		self.scheduled = []
+		self.model = model
+		self.clock = clock
+		self.latency = latency
+		self.corruption = corruption
+		self.rng = rng if rng is not None else random.Random()
+		self.name = name
+		self.port = name
+		self.commands = 0
+
+	def reply(self, cmd):
+		""" Returns the correct reply bytes for cmd; implemented by subclasses """
+		return b""
+
+	def corrupt(self, reply):
+		kind = self.rng.randrange(3)
+		if kind == 0 and reply:
+			i = self.rng.randrange(len(reply))
+			return reply[:i] + bytes([reply[i] ^ 0x5a]) + reply[i + 1:]
+		if kind == 1:
+			return reply[:len(reply) // 2]
+		return self.nak()
+
+	def nak(self):
+		return b""
+
+	def write(self, data):
+		if isinstance(data, bytes):
+			data = data.decode()
+		self.lastCmd = data
+		self.commands += 1
+		reply = self.reply(data)
+		if self.corruption and self.rng.random() < self.corruption:
+			reply = self.corrupt(reply)
+		if reply:
+			self._schedule(self.latency, reply)
+		self._release()
+		return len(data)
+
+	def close(self):
+		pass
+
+
+class SimulatedPirani(SimulatedGauge):
+
+	""" MKS Pirani, on address 253 unless `address` is set; reads between 5e-4 and 1000 torr """
+
+	address = 253
+
+	def reply(self, cmd):
+		prefix = '@%03d' % self.address
+		if cmd == prefix + 'PR1?;FF':
+			p = min(max(self.model.pressure(self.clock.now()), 5e-4), 1000.)
+			exponent = int(math.floor(math.log10(p)))
+			mantissa = p / 10 ** exponent
+			if round(mantissa, 2) >= 10.:
+				mantissa /= 10.
+				exponent += 1
+			return (prefix + 'ACK%.2fE%+d;FF' % (mantissa, exponent)).encode()
+		if cmd == prefix + 'U?;FF':
+			return (prefix + 'ACKTORR;FF').encode()
+		return self.nak()
+
+	def nak(self):
+		return ('@%03dNAK160;FF' % self.address).encode()
+
+
+class SimulatedBus(TimedFakeSerial):
+
+	""" Several SimulatedPirani gauges daisy-chained on one RS-485 line, behind one port.
+	A command reaches the gauge whose address it starts with; that gauge answers `turnaround` seconds after the
+	command, or once the line is free, and its reply occupies the line for `byteTime` seconds per byte.
+	Commands to addresses that are not on the line go unanswered. """
+
+	def __init__(self, gauges, turnaround=0.005, byteTime=1.04e-3, name="simulated-bus"):
+		"""
+		gauges -- SimulatedPirani instances, each with its own address
+		turnaround -- seconds between the end of a command and the start of the addressed gauge's reply
+		byteTime -- seconds to send one byte (10 bits at 9600 baud)
+		"""
+		self.timeout = 30 # sanity
+		self.lastCmd = None
+		self.inBuffer = b""
+		self.cmdToFile = {}
+		self.cmdToDataLength = {}
+		self.scheduled = []
+		self.gauges = dict(('%03d' % g.address, g) for g in gauges)
+		self.turnaround = turnaround
+		self.byteTime = byteTime
+		self.lineFree = 0.
+		self.name = name
+		self.port = name
+		self.commands = 0
+
+	def write(self, data):
+		if isinstance(data, bytes):
+			data = data.decode()
+		self.lastCmd = data
+		self.commands += 1
+		gauge = self.gauges.get(data[1:4])
+		if gauge is None:
+			return len(data)
+		gauge.commands += 1
+		reply = gauge.reply(data)
+		if gauge.corruption and gauge.rng.random() < gauge.corruption:
+			reply = gauge.corrupt(reply)
+		now = time.monotonic()
+		start = max(now + len(data) * self.byteTime + self.turnaround, self.lineFree)
+		self.lineFree = start + len(reply) * self.byteTime
+		if reply:
+			self._schedule(self.lineFree - now, reply)
+		self._release()
+		return len(data)
+
+	def close(self):
+		pass
+
+
+class SimulatedCapacitance(SimulatedGauge):
+
+	""" Two capacitance manometer heads (1000 and 1 torr full scale) on one controller """
+
+	fullscale = (1000., 1.)
+	formats = ('%06.2f', '%.4f')
+
+	def _reading(self, p, full, fmt):
+		if p > 1.1 * full:
+			return 'Off'
+		# zero offset noise of 1e-4 of full scale: readings near vacuum can go negative
+		p += self.rng.gauss(0., 1e-4 * full)
+		if p < 0:
+			return '- ' + fmt % -p
+		return fmt % p
+
+	def reply(self, cmd):
+		if cmd == 'p':
+			p = self.model.pressure(self.clock.now())
+			return (' '.join(self._reading(p, full, fmt) for full, fmt in zip(self.fullscale, self.formats)) + '\r\n').encode()
+		if cmd == 'u':
+			return b'Torr\r\n'
+		if cmd == 'f':
+			return (' '.join(fmt % full for full, fmt in zip(self.fullscale, self.formats)) + '\r\n').encode()
+		return self.nak()
+
+	def nak(self):
+		return b'?\r\n'
+
+
+class Simulation(object):
+
+	""" Any number of simulated chambers sharing one SimClock """
+
+	def __init__(self, seed=None, latency=0.0, corruption=0.0):
+		self.clock = SimClock()
+		self.rng = random.Random(seed)
+		self.latency = latency
+		self.corruption = corruption
+		self.chambers = {}
+
+	def addChamber(self, name, **modelArgs):
+		"""
+		Adds a chamber with a ChamberModel built from modelArgs.
+		returns: (SimulatedPirani, SimulatedCapacitance) serial stand-ins for its gauges
+		"""
+		model = ChamberModel(rng=random.Random(self.rng.random()), **modelArgs)
+		pirani = SimulatedPirani(model, self.clock, self.latency, self.corruption, random.Random(self.rng.random()), "sim-%s-pirani" % name)
+		cap = SimulatedCapacitance(model, self.clock, self.latency, self.corruption, random.Random(self.rng.random()), "sim-%s-capacitance" % name)
+		self.chambers[name] = (model, pirani, cap)
+		return pirani, cap
+
+
+def soak(chambers, hours, period, latency, corruption, outdir, seed=None):
+	"""
+	Runs the acquisition loop (one VacuumReader per chamber, a shared ConcurrentSampler and FixedRateScheduler)
+	against simulated chambers for `hours` of simulated time. Returns a dict of throughput, failure and memory figures.
+	"""
+	sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+	from read_vacuum import VacuumReader, setUpOutput
+	from acquisition import ConcurrentSampler, FixedRateScheduler
+
+	sim = Simulation(seed, latency, corruption)
+	readers = {}
+	gauges = []
+	for i in range(chambers):
+		name = "sim%d" % i
+		pirani, cap = sim.addChamber(name, ventEvery=6 * 3600. if i % 2 else None)
+		reader = VacuumReader(name, False)
+		reader.echo = False
+		reader.clock = sim.clock.now
+		reader.setUpPirani(pirani)
+		reader.setUpCapacitance(cap)
+		setUpOutput(reader, os.path.join(outdir, "vacuum-%s-%s.csv" % (name, reader.isonow())))
+		readers[name] = reader
+		for gaugeName, gauge in reader.gauges():
+			gauges.append(((name, gaugeName), gauge))
+	sampler = ConcurrentSampler(gauges, False)
+	scheduler = FixedRateScheduler(period, sleep=sim.clock.sleep, clock=sim.clock.now)
+
+	rows = 0
+	errors = 0
+	start = time.monotonic()
+	end = sim.clock.now() + hours * 3600.
+	while sim.clock.now() < end:
+		scheduler.wait()
+		row = sampler.sample()
+		errors += sum(1 for r in row.readings if r.error is not None)
+		for name, chamberRow in row.split().items():
+			readers[name].recordRow(chamberRow)
+		rows += 1
+	wall = time.monotonic() - start
+	sampler.close()
+	for reader in readers.values():
+		reader.closeAll()
+	return {
+		"chambers": chambers,
+		"simulated_hours": hours,
+		"wall_seconds": wall,
+		"rows": rows,
+		"failed_readings": errors,
+		"chamber_samples_per_second": rows * chambers / wall if wall else 0.,
+		"speedup": hours * 3600. / wall if wall else 0.,
+		"max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+	}
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Soak-test the acquisition loop against simulated chambers")
+	parser.add_argument("--chambers", type=int, default=12)
+	parser.add_argument("--hours", type=float, default=12.)
+	parser.add_argument("--period", type=float, default=9.)
+	parser.add_argument("--latency", type=float, default=0., help="real seconds per reply")
+	parser.add_argument("--corruption", type=float, default=0., help="fraction of corrupted replies")
+	parser.add_argument("--outdir", help="where to write the CSV streams (default: a temporary directory)")
+	parser.add_argument("--seed", type=int)
+	args = parser.parse_args()
+	outdir = args.outdir or tempfile.mkdtemp(prefix="vacuum-soak-")
+	stderr.write("Writing streams to %s\n" % outdir)
+	results = soak(args.chambers, args.hours, args.period, args.latency, args.corruption, outdir, args.seed)
+	for key in sorted(results):
+		print("%s: %s" % (key, results[key]))
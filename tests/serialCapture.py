@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""
+Recording and replaying serial traffic.
+
+CapturingSerial wraps a real serial.Serial and logs every command written and every chunk of reply read,
+with its time, to a capture file. ReplaySerial is a FakeSerial that answers commands from such a capture,
+releasing each reply chunk at its recorded delay after the command -- in real time, sped up by any factor,
+or (speed=None) as fast as possible. Together they let the whole acquisition pipeline be run and timed
+against real gauge traffic without the hardware.
+
+A capture file is JSON lines: a header {"capture": 1, "port": ..., "baudrate": ...}, then one
+{"t": seconds since capture start, "w": hex} per write and {"t": ..., "r": hex} per read.
+"""
+
+import binascii, json, threading, time
+try:
+	from .fakeSerial import TimedFakeSerial
+except ImportError: # run from inside tests/
+	from fakeSerial import TimedFakeSerial
+from sys import stderr
+
+
+class CapturingSerial(object):
+
+	""" Pass-through wrapper around a serial.Serial that logs all traffic to a capture file.
+	close() and open() act on the port only, so a capture runs on through a reconnect; finish() closes the file. """
+
+	def __init__(self, inner, capturePath):
+		self.inner = inner
+		self.port = getattr(inner, 'port', None)
+		self.capture = open(capturePath, 'w')
+		self.start = time.monotonic()
+		self.lock = threading.Lock()
+		self._log({"capture": 1, "port": self.port, "baudrate": getattr(inner, 'baudrate', None)})
+
+	def _log(self, record):
+		with self.lock:
+			self.capture.write(json.dumps(record) + "\n")
+
+	def _event(self, key, data):
+		if data:
+			self._log({"t": round(time.monotonic() - self.start, 6), key: binascii.hexlify(data).decode('ascii')})
+
+	def write(self, data):
+		self._event("w", data)
+		return self.inner.write(data)
+
+	def read(self, size=1):
+		data = self.inner.read(size)
+		self._event("r", data)
+		return data
+
+	def inWaiting(self):
+		return self.inner.inWaiting()
+
+	def fileno(self):
+		return self.inner.fileno()
+
+	def open(self):
+		self.inner.open()
+
+	def close(self):
+		self.inner.close()
+
+	def finish(self):
+		""" Closes the port and the capture file, at the end of the run """
+		self.inner.close()
+		with self.lock:
+			if not self.capture.closed:
+				self.capture.close()
+
+	def __getattr__(self, name):
+		# everything else (timeout, flushInput, ...) goes straight to the real port
+		return getattr(self.inner, name)
+
+
+def loadCapture(capturePath):
+	"""
+	Reads a capture file into a list of exchanges: (command, [(delay after the command, reply bytes), ...])
+	"""
+	exchanges = []
+	with open(capturePath) as f:
+		for line in f:
+			record = json.loads(line)
+			if "w" in record:
+				exchanges.append((binascii.unhexlify(record["w"]).decode('utf8', 'replace'), record["t"], []))
+			elif "r" in record and exchanges:
+				cmd, sent, chunks = exchanges[-1]
+				chunks.append((record["t"] - sent, binascii.unhexlify(record["r"])))
+	return [(cmd, chunks) for cmd, sent, chunks in exchanges]
+
+
+class ReplaySerial(TimedFakeSerial):
+
+	""" Answers commands with the replies recorded in a capture file, with their recorded timing scaled by 1/speed """
+
+	def __init__(self, capturePath, speed=1.0, port=None, baudrate=9600, bytesize=8, parity='N', stopbits=1, timeout=None, **kwargs):
+		self.timeout = timeout
+		if self.timeout is None:
+			self.timeout = 30 # sanity
+		self.lastCmd = None
+		self.inBuffer = b""
+		self.cmdToFile = {}
+		self.cmdToDataLength = {}
+		self.name = "replay:%s" % capturePath
+		self.speed = speed
+		self.exchanges = loadCapture(capturePath)
+		self.position = 0 # next exchange to replay; wraps around at the end of the capture
+		self.scheduled = [] # (release time, bytes) of the reply in flight
+		stderr.write("\tReplay serial port initialized from %s (%d exchanges)\n" % (capturePath, len(self.exchanges)))
+
+	def write(self, data):
+		if isinstance(data, bytes):
+			data = data.decode()
+		self.lastCmd = data
+		# replay the next recorded exchange for this command, searching forward (and around) from the last one
+		n = len(self.exchanges)
+		for i in range(n):
+			cmd, chunks = self.exchanges[(self.position + i) % n]
+			if cmd == data:
+				self.position = (self.position + i + 1) % n
+				for delay, chunk in chunks:
+					self._schedule(delay / self.speed if self.speed else 0., chunk)
+				break
+		self._release()
+		return len(data)
+
+	def close(self):
+		pass
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import math, os, random, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from analytics import RunningStats, ExponentialFit, RateOfRise, Analytics
+
+# checks the incremental estimates against the closed forms on synthetic pumpdown and leak-up curves
+
+fails = []
+
+def close(a, b, rel=1e-6):
+	return a is not None and abs(a - b) <= rel * abs(b)
+
+print("Test: running stats match the two-pass mean and variance")
+random.seed(3)
+xs = [random.uniform(1e-3, 1.) for i in range(1000)]
+stats = RunningStats()
+for x in xs:
+	stats.update(x)
+mean = sum(xs) / len(xs)
+var = sum((x - mean) ** 2 for x in xs) / (len(xs) - 1)
+if not (close(stats.mean, mean) and close(stats.variance(), var) and stats.min == min(xs) and stats.max == max(xs)):
+	print("FAILURE! Expected mean %g var %g, got %g %g" % (mean, var, stats.mean, stats.variance()))
+	fails.append("running stats")
+else:
+	print("PASS: running stats")
+
+print("Test: the exponential fit recovers the pumpdown time constant")
+fit = ExponentialFit(halfLife=600.)
+for i in range(200):
+	t = 1000. + i * 9.
+	fit.update(t, 760. * math.exp(-(t - 1000.) / 120.))
+if not close(fit.tau(), 120., 1e-6):
+	print("FAILURE! Expected tau 120 s, got ", fit.tau())
+	fails.append("exponential fit")
+else:
+	print("PASS: tau %.3f s" % fit.tau())
+
+print("Test: the fit follows the current phase and reports no tau once the pressure rises")
+for i in range(1, 1000):
+	fit.update(2800. + i * 9., 1e-4 * (1. + i * 0.01))
+if fit.tau() is not None:
+	print("FAILURE! Expected no tau while rising, got ", fit.tau())
+	fails.append("fit forgets old phase")
+else:
+	print("PASS: no tau while rising")
+
+print("Test: the rate of rise covers only the window")
+rise = RateOfRise(window=100.)
+for i in range(100):
+	rise.update(i * 1., 5. - 0.1 * i) # falling for 100 s ...
+for i in range(100, 300):
+	rise.update(i * 1., 1e-3 + 2e-5 * (i - 100)) # ... then rising at 2e-5 per second
+if not close(rise.rate(), 2e-5, 1e-6) or len(rise.samples) != 101:
+	print("FAILURE! Expected rate 2e-5 over 101 samples, got ", rise.rate(), len(rise.samples))
+	fails.append("rate of rise window")
+else:
+	print("PASS: rate of rise %.3g" % rise.rate())
+
+print("Test: time to threshold, falling and rising")
+analytics = Analytics(["pirani", "capacitance 0"], threshold=1e-2)
+for i in range(50):
+	t = i * 9.
+	analytics.update(t, [760. * math.exp(-t / 100.), float('nan')])
+summary = analytics.summary()
+eta = summary["pirani"]["time_to_threshold"]
+p = 760. * math.exp(-49 * 9. / 100.)
+if not close(eta, 100. * math.log(p / 1e-2), 1e-6) or summary["capacitance 0"]["n"] != 0:
+	print("FAILURE! Expected eta %g and no capacitance values, got " % (100. * math.log(p / 1e-2)), eta, summary["capacitance 0"])
+	fails.append("time to threshold falling")
+else:
+	print("PASS: eta %.1f s while pumping down" % eta)
+rising = Analytics(["pirani"], threshold=1e-3, window=60.)
+for i in range(20):
+	rising.update(i * 5., [1e-4 + 1e-6 * i * 5.])
+eta = rising.summary()["pirani"]["time_to_threshold"]
+if not close(eta, (1e-3 - (1e-4 + 1e-6 * 95.)) / 1e-6, 1e-6):
+	print("FAILURE! Expected eta %g, got " % ((1e-3 - (1e-4 + 1e-6 * 95.)) / 1e-6), eta)
+	fails.append("time to threshold rising")
+else:
+	print("PASS: eta %.1f s while rising" % eta)
+
+print("Test: the comment line is one JSON line")
+line = analytics.comment()
+if not line.startswith("# Analytics: {") or line.count("\n") != 1:
+	print("FAILURE! Bad comment line ", line)
+	fails.append("comment line")
+else:
+	print("PASS: comment line")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
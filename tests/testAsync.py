@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+import asyncio, os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from fakeSerial import MockPirani, MockCapacitance, AsyncMockPirani, AsyncMockCapacitance
+from pressure_gauges import Pirani, Capacitance, response_timeout
+from async_gauges import AsyncPirani, AsyncCapacitance
+
+# checks that the asyncio gauges read the same values as the blocking ones, overlap their waits, and time out
+# without blocking the event loop
+
+fails = []
+
+async def sameReadings():
+	pirani = AsyncPirani(AsyncMockPirani(), False)
+	cap = AsyncCapacitance(AsyncMockCapacitance(), False)
+	syncPirani = Pirani(MockPirani(), False)
+	syncCap = Capacitance(MockCapacitance(), False)
+	got = [await pirani.get_units(), await cap.get_units()]
+	expected = [syncPirani.getUnits(), syncCap.getUnits()]
+	for i in range(20):
+		got += await asyncio.gather(pirani.get_pressure(), cap.get_pressure())
+		expected += [syncPirani.getPressure(), syncCap.getPressure()]
+	for g in (pirani, cap, syncPirani, syncCap):
+		g.close()
+	return got, expected
+
+print("Test: async gauges read the same replies as the blocking gauges")
+got, expected = asyncio.run(sameReadings())
+if got != expected:
+	print("FAILURE! Readings differ: ", got[:4], expected[:4])
+	fails.append("same readings")
+else:
+	print("PASS: %d readings match" % len(got))
+
+async def manyGauges(n):
+	gauges = [AsyncCapacitance(AsyncMockCapacitance(), False) for i in range(n)]
+	start = time.monotonic()
+	res = await asyncio.gather(*(g.get_pressure() for g in gauges))
+	elapsed = time.monotonic() - start
+	for g in gauges:
+		g.close()
+	return res, elapsed
+
+print("Test: one event loop reads many gauges at once")
+# each capacitance reply is closed by 50 ms of silence; read one by one, 50 gauges would take 2.5 seconds
+res, elapsed = asyncio.run(manyGauges(50))
+if len(res) != 50 or any(r != [0.5, 0.501] for r in res) or elapsed > 0.5:
+	print("FAILURE! Expected 50 readings in well under 1 s, got %d in %.3f s" % (len(res), elapsed))
+	fails.append("concurrent gauges")
+else:
+	print("PASS: 50 gauges in %.3f s" % elapsed)
+
+async def timeoutWhileOthersRun():
+	silent = AsyncPirani(AsyncMockPirani(), False)
+	silent.timeout = 0.2
+	silent.retries = 0
+	silent.expectedLengths = dict(silent.expectedLengths)
+	silent.expectedLengths["@253NOPE?;FF"] = 17
+	other = AsyncCapacitance(AsyncMockCapacitance(), False)
+	async def readOther():
+		n = 0
+		while not stuck.done():
+			await other.get_pressure()
+			n += 1
+		return n
+	stuck = asyncio.ensure_future(silent._acommand("@253NOPE?;FF"))
+	n = await readOther()
+	silent.close()
+	other.close()
+	return stuck.exception(), n
+
+print("Test: an unanswered command times out while other gauges keep being read")
+err, n = asyncio.run(timeoutWhileOthersRun())
+if not isinstance(err, response_timeout) or n < 3:
+	print("FAILURE! Expected response_timeout and several other readings, got ", err, n)
+	fails.append("non-blocking timeout")
+else:
+	print("PASS: timed out; %d readings of the other gauge meanwhile" % n)
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+import io, os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from binary_log import BinaryRecorder, BinaryLog, toCSV, readHeader, bad_binary_log, COLUMNS
+from read_vacuum import VacuumReader, setUpOutput
+from session_cache import SessionCache
+
+# checks the binary log round trip, its memory-mapped reader, a crash-truncated tail, and the CSV conversion
+
+fails = []
+tmp = tempfile.mkdtemp()
+
+def record(k):
+	return (1.7e9 + k, 0.5 * k, 1e-3 * (k + 1), 2e-2 * (k + 1), 3e-4 * (k + 1), 0.5 if k else 0.)
+
+print("Test: write -> read round trip")
+path = os.path.join(tmp, "round.vbin")
+with open(path, 'wb') as f:
+	recorder = BinaryRecorder(f, chamber="1", pirani_units="TORR", capacitance_units="Torr")
+	for k in range(5):
+		recorder.write(record(k))
+with open(path, 'rb') as f:
+	header, offset = readHeader(f, path)
+log = BinaryLog(path)
+if offset % 8 or header["columns"] != list(COLUMNS) or header["chamber"] != "1" or header["pirani_units"] != "TORR":
+	print("FAILURE! Header should be aligned and hold the columns and metadata, got ", offset, header)
+	fails.append("header")
+elif len(log) != 5 or [tuple(r) for r in log.records] != [record(k) for k in range(5)]:
+	print("FAILURE! Expected the 5 records back, got ", log.records)
+	fails.append("round trip")
+else:
+	print("PASS: round trip")
+
+print("Test: columns are memory-mapped, not copied")
+pirani = log["pirani"]
+import numpy as np
+if not isinstance(log.records, np.memmap) or log.records.flags.writeable or list(pirani) != [record(k)[2] for k in range(5)]:
+	print("FAILURE! records should be a read-only memmap, and columns views of it")
+	fails.append("memmap")
+elif not np.shares_memory(pirani, log.records):
+	print("FAILURE! A column should be a view of the mapped records")
+	fails.append("zero copy")
+else:
+	print("PASS: memmap")
+
+print("Test: a record cut short by a crash is ignored")
+with open(path, 'ab') as f:
+	f.write(b"\x00" * 20)
+if len(BinaryLog(path)) != 5:
+	print("FAILURE! The partial record should be ignored, got %d records" % len(BinaryLog(path)))
+	fails.append("truncated record")
+else:
+	print("PASS: truncated record ignored")
+
+print("Test: bad files are rejected")
+bad = 0
+for name, content in (("magic.vbin", b"NOTVAC!!\x00\x00\x00\x00"), ("short.vbin", b"VACBIN1\n\xff\x00\x00\x00{")):
+	with open(os.path.join(tmp, name), 'wb') as f:
+		f.write(content)
+	try:
+		BinaryLog(os.path.join(tmp, name))
+	except bad_binary_log:
+		bad += 1
+if bad != 2:
+	print("FAILURE! Expected 2 bad_binary_log errors, got %d" % bad)
+	fails.append("bad files")
+else:
+	print("PASS: bad files rejected")
+
+print("Test: toCSV matches the text log a reader wrote alongside the binary one")
+reader = VacuumReader(-1, False)
+reader.echo = False
+reader.recordBinary = True
+reader.setUpPirani()
+reader.setUpCapacitance()
+reader.setUpSampler()
+csvPath = os.path.join(tmp, "vacuum-test.csv")
+setUpOutput(reader, csvPath)
+for k in range(4):
+	reader.recordRow(reader.sampler.sample())
+reader.closeAll()
+converted = io.StringIO()
+toCSV(os.path.splitext(csvPath)[0] + ".vbin", converted)
+with open(csvPath) as f:
+	text = f.read().splitlines()
+binary = converted.getvalue().splitlines()
+def comments(lines, prefix):
+	return [l for l in lines if l.startswith(prefix)]
+def data(lines):
+	# the DateTime column comes from a different clock reading in each file, so compare the rest
+	return [l.split("\t")[1:] for l in lines if not l.startswith("#") and "\t" in l]
+same = all(comments(text, p) == comments(binary, p) for p in ("# Format Version", "# Chamber", "# Columns", "# Gauge Units"))
+if not same:
+	print("FAILURE! Header lines differ: ", [l for l in text if l.startswith("#")], [l for l in binary if l.startswith("#")])
+	fails.append("csv header")
+elif len(data(text)) != 4 or data(text) != data(binary):
+	print("FAILURE! Data columns differ: ", data(text), data(binary))
+	fails.append("csv data")
+else:
+	print("PASS: toCSV matches the text log")
+
+print("Test: units found to differ by session validation are recorded in the binary log")
+from concurrent.futures import Future
+def done(value):
+	future = Future()
+	future.set_result(value)
+	return future
+reader = VacuumReader(-1, False)
+reader.echo = False
+reader.recordBinary = True
+reader.setUpPirani()
+reader.setUpCapacitance()
+reader.setUpSampler()
+reader.session = SessionCache(os.path.join(tmp, "session.json"))
+csvPath = os.path.join(tmp, "vacuum-units.csv")
+setUpOutput(reader, csvPath)
+before = reader.pirani_units, reader.capacitance_units
+for k in range(2):
+	reader.recordRow(reader.sampler.sample())
+reader._storeValidation("key", [done("MBAR"), done("mbar"), done(1000.)])
+for k in range(2):
+	reader.recordRow(reader.sampler.sample())
+reader.closeAll()
+log = BinaryLog(os.path.splitext(csvPath)[0] + ".vbin")
+converted = io.StringIO()
+toCSV(os.path.splitext(csvPath)[0] + ".vbin", converted)
+binary = converted.getvalue().splitlines()
+changed = [l for l in binary if "Gauge Units changed: MBAR mbar" in l]
+if len(log) != 4 or len(log.header.get("units_changes", [])) != 1:
+	print("FAILURE! Expected 4 records and one units change, got ", len(log), log.header.get("units_changes"))
+	fails.append("units header")
+elif log.unitsAt(log["elapsed"][1]) != before or log.unitsAt(log["elapsed"][2]) != ("MBAR", "mbar"):
+	print("FAILURE! Records should carry the units in effect when they were written, got ", [log.unitsAt(t) for t in log["elapsed"]])
+	fails.append("units at")
+elif len(changed) != 1 or binary.index(changed[0]) != len(binary) - 3:
+	print("FAILURE! toCSV should note the change before the third row, got ", binary)
+	fails.append("units csv")
+else:
+	print("PASS: units change recorded at %.3f s" % log.header["units_changes"][0]["elapsed"])
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+import os, sys, tempfile, threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from gaugeSimulator import Simulation
+from gauge_broker import PortWorker, GaugeBroker, BrokerConnection, RemotePirani, broker_error
+
+# checks that the broker coalesces duplicate requests, answers fresh ones from its cache, and serves remote gauges
+
+fails = []
+
+print("Test: requests arriving while a query is in flight share it")
+sim = Simulation(seed=1, latency=0.05)
+pirani, cap = sim.addChamber("a")
+worker = PortWorker("sim", pirani, False)
+replies = []
+done = threading.Semaphore(0)
+def reply(message):
+	replies.append(message)
+	done.release()
+for i in range(5):
+	worker.submit("pirani", "pressure", 0., reply)
+for i in range(5):
+	done.acquire()
+if pirani.commands != 1 or len(set(r["value"] for r in replies)) != 1:
+	print("FAILURE! Five simultaneous requests should cost one gauge query, instead cost ", pirani.commands)
+	fails.append("coalesce in flight")
+else:
+	print("PASS: coalesce in flight")
+
+print("Test: a request within the freshness window is answered from the cache")
+worker.submit("pirani", "pressure", 10., reply)
+done.acquire()
+if pirani.commands != 1 or not replies[-1]["cached"]:
+	print("FAILURE! A fresh cached reply should be used, instead the gauge saw %d commands" % pirani.commands)
+	fails.append("cache hit")
+else:
+	print("PASS: cache hit")
+worker.close()
+
+print("Test: a RemotePirani reads through the broker")
+path = os.path.join(tempfile.mkdtemp(), "broker.sock")
+broker = GaugeBroker(path)
+remote = RemotePirani(BrokerConnection(path, "test-pirani"), False)
+pressure = remote.getPressure()
+units = remote.getUnits()
+if len(pressure) != 1 or not isinstance(pressure[0], float) or units.strip().upper() != "TORR":
+	print("FAILURE! Expected a one-element pressure list and TORR, instead got ", pressure, units)
+	fails.append("remote gauge")
+else:
+	print("PASS: remote gauge")
+
+print("Test: a bad max_age is answered with an error and the connection keeps serving")
+connection = BrokerConnection(path, "test-pirani", maxAge="soon")
+try:
+	connection.request("pirani", "pressure")
+	got = "no error"
+except broker_error as err:
+	got = str(err)
+connection.maxAge = None
+try:
+	value = connection.request("pirani", "pressure")
+except broker_error as err:
+	value = None
+if "soon" not in got or not value:
+	print("FAILURE! Expected an error reply, then a reading on the same connection, got ", got, value)
+	fails.append("bad max_age")
+else:
+	print("PASS: bad max_age answered with an error")
+connection.close()
+remote.close()
+broker.close()
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
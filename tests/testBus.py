@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from gaugeSimulator import SimClock, ChamberModel, SimulatedPirani, SimulatedBus
+from pressure_gauges import Pirani, ack_error, response_timeout, gauge_unavailable
+from pirani_bus import PiraniBus
+from acquisition import ConcurrentSampler
+
+# checks addressed Pirani commands and the polling of several gauges on one simulated RS-485 line
+
+fails = []
+clock = SimClock()
+
+def line(addresses, **busArgs):
+	# a gauge at address a reads a steady 10*a torr
+	gauges = []
+	for a in addresses:
+		g = SimulatedPirani(ChamberModel(p0=10. * a, base=0., tau=1e12, outgas=0., noise=0.), clock)
+		g.address = a
+		gauges.append(g)
+	return SimulatedBus(gauges, **busArgs)
+
+print("Test: addressed commands and replies")
+bus = line([1, 2])
+p1 = Pirani(bus, False, 1)
+if p1.pressureCommand != '@001PR1?;FF' or p1.unitsCommand != '@001U?;FF' or Pirani.pressureCommand != '@253PR1?;FF':
+	print("FAILURE! Unexpected commands ", p1.pressureCommand, p1.unitsCommand, Pirani.pressureCommand)
+	fails.append("addressed commands")
+elif p1.getPressure() != [10.] or p1.getUnits() != 'TORR':
+	print("FAILURE! Addressed gauge should read [10.0] TORR")
+	fails.append("addressed reads")
+else:
+	print("PASS: addressed commands")
+try:
+	p1._checkResponse(p1.pressureCommand, b'@002ACK2.00E+1;FF')
+	print("FAILURE! A reply from another address should be rejected")
+	fails.append("reject other address")
+except ack_error:
+	print("PASS: reply from another address rejected")
+
+print("Test: the bus polls every gauge and matches replies by address")
+addresses = [1, 2, 3, 4, 5, 6]
+bus = PiraniBus([Pirani(line(addresses), False, a) for a in addresses])
+for i in range(3):
+	res = bus.poll()
+expected = [[10. * a] for a in addresses]
+if [r for t, r in res] != expected or bus.first != 3:
+	print("FAILURE! Expected ", expected, " got ", res)
+	fails.append("poll all gauges")
+else:
+	print("PASS: %d gauges read" % len(addresses))
+
+print("Test: pipelining hides the gauges' turnaround on a 4-wire line")
+def pollTime(depth):
+	shared = line(addresses, turnaround=0.02)
+	bus = PiraniBus([Pirani(shared, False, a) for a in addresses], depth=depth)
+	start = time.monotonic()
+	res = bus.poll()
+	return time.monotonic() - start, [r for t, r in res]
+serial, res1 = pollTime(1)
+piped, res6 = pollTime(6)
+if res1 != expected or res6 != expected or piped > serial * 0.6:
+	print("FAILURE! Expected the same readings, faster with depth 6: %.3f s vs %.3f s" % (piped, serial))
+	fails.append("pipelined poll")
+else:
+	print("PASS: %.3f s per poll with depth 1, %.3f s with depth 6" % (serial, piped))
+
+print("Test: a silent gauge times out without holding up the others, then is left out")
+shared = line([1, 2, 3])
+gauges = [Pirani(shared, False, a) for a in (1, 2, 9, 3)] # nothing answers at address 9
+silent = gauges[2]
+silent.timeout = 0.1
+silent.retries = 1
+silent.reconnectAfter = 1
+bus = PiraniBus(gauges, depth=2)
+res = bus.poll()
+start = time.monotonic()
+res2 = bus.poll()
+elapsed = time.monotonic() - start
+if [r for t, r in res if not isinstance(r, Exception)] != [[10.], [20.], [30.]] or not isinstance(res[2][1], response_timeout):
+	print("FAILURE! Expected three readings and a timeout, got ", res)
+	fails.append("silent gauge times out")
+elif not isinstance(res2[2][1], gauge_unavailable) or elapsed >= silent.timeout:
+	print("FAILURE! The silent gauge should be skipped on the next poll, got %s in %.3f s" % (res2[2][1], elapsed))
+	fails.append("silent gauge left out")
+else:
+	print("PASS: silent gauge timed out, then skipped (next poll %.3f s)" % elapsed)
+
+print("Test: a bus gauge failing a command of its own backs off without reopening the line")
+shared = line([1, 2])
+shared.reopened = 0
+shared.open = lambda: setattr(shared, 'reopened', shared.reopened + 1)
+silent = Pirani(shared, False, 3) # nothing answers at address 3
+silent.timeout = 0.02
+silent.backoff = 0.001
+PiraniBus([Pirani(shared, False, 1), silent])
+for k in range(silent.reconnectAfter):
+	try:
+		silent.getUnits()
+	except response_timeout:
+		pass
+if shared.reopened or silent.retryAt is None:
+	print("FAILURE! The gauge should be backed off and the line left open, got %d reopens" % shared.reopened)
+	fails.append("bus gauge reconnect")
+else:
+	print("PASS: line not reopened")
+
+print("Test: the sampler polls addressed gauges on one port as a bus")
+shared = line([1, 2])
+sampler = ConcurrentSampler([("a", Pirani(shared, False, 1)), ("b", Pirani(shared, False, 2))], False)
+row = sampler.sample()
+sampler.close()
+if sampler.buses[0] is None or row.values() != [10., 20.]:
+	print("FAILURE! Expected a bus and [10.0, 20.0], got ", sampler.buses, row.values())
+	fails.append("sampler bus")
+else:
+	print("PASS: sampler row from the bus")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import glob, json, os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from gaugeSimulator import Simulation, SimulatedBus
+from vacuum_daemon import VacuumDaemon, config_error
+from sample_ring import RingReader, ringPath
+
+# builds a daemon from a JSON config, with simulated serial devices and a test chamber, and checks that the
+# chambers share their devices and one sampler but get their own output streams and per-chamber features
+
+fails = []
+tmp = tempfile.mkdtemp()
+os.chdir(tmp) # the daemon writes its streams and session caches to the working directory
+tag = str(os.getpid()) # ring files live in /dev/shm, shared with other runs
+a, b, t = "a" + tag, "b" + tag, "t" + tag
+
+sim = Simulation(seed=5)
+piraniA, capA = sim.addChamber(a)
+piraniB, capB = sim.addChamber(b)
+piraniA.address, piraniB.address = 1, 2
+devices = {"/dev/sim-bus": SimulatedBus([piraniA, piraniB], turnaround=0.001, byteTime=1e-5), "/dev/sim-cap-a": capA, "/dev/sim-cap-b": capB}
+
+class SimulatedDaemon(VacuumDaemon):
+	""" Opens simulated devices instead of serial ports, counting how often each is opened """
+	opened = []
+	def newSerial(self, port):
+		self.opened.append(port)
+		return devices[port]
+
+with open("rules.json", 'w') as f:
+	json.dump({"rules": [{"name": "any", "type": "above", "channel": "pirani", "threshold": 0.,
+	                      "chambers": [a, t], "actions": ["file:" + os.path.join(tmp, "alarms.jsonl")]}]}, f)
+config = {
+	"delaytime": 0.2,
+	"deadband": 0.0, "heartbeat": 60,
+	"analytics": 0.01, "threshold": "1e-4", # numbers may be given as strings
+	"ring": True,
+	"interlock": "rules.json",
+	"session_ttl": 3600,
+	"bus_depth": {"/dev/sim-bus": 2}, # the simulated line is full duplex
+	"chambers": [
+		{"name": a, "pirani": "/dev/sim-bus", "pirani_address": 1, "capacitance": "/dev/sim-cap-a"},
+		{"name": b, "pirani": "/dev/sim-bus", "pirani_address": 2, "capacitance": "/dev/sim-cap-b"},
+		{"name": t, "test": True},
+	]}
+with open("config.json", 'w') as f:
+	json.dump(config, f)
+with open("config.json") as f:
+	config = json.load(f)
+
+daemon = SimulatedDaemon(config, False)
+daemon.setUp()
+daemon.run(samples=5)
+daemon.closeAll()
+
+print("Test: each device is opened once, and the shared RS-485 line is one port group with a bus")
+groups = dict((daemon.sampler._portKey(group[0][1]), group) for group in daemon.sampler.portGroups)
+busGroup = groups.get("simulated-bus")
+if sorted(SimulatedDaemon.opened) != sorted(devices):
+	print("FAILURE! Every device should be opened exactly once, got ", SimulatedDaemon.opened)
+	fails.append("open once")
+elif busGroup is None or [name for name, gauge in busGroup] != [(a, "pirani"), (b, "pirani")] or not any(daemon.sampler.buses):
+	print("FAILURE! Both Piranis should be polled together on the bus, got ", daemon.sampler.portGroups)
+	fails.append("shared device")
+elif [bus.depth for bus in daemon.sampler.buses if bus is not None] != [2]:
+	print("FAILURE! The bus should keep the configured 2 commands in flight, got ", [bus and bus.depth for bus in daemon.sampler.buses])
+	fails.append("bus depth")
+elif len(daemon.sampler.portGroups) != 5:
+	print("FAILURE! Expected 5 port groups (bus, 2 capacitance, 2 mock), got %d" % len(daemon.sampler.portGroups))
+	fails.append("port groups")
+else:
+	print("PASS: shared devices grouped")
+
+print("Test: one sampler for every chamber")
+if len(daemon.readers) != 3 or any(r.sampler is not daemon.sampler for r in daemon.readers):
+	print("FAILURE! Every reader should use the daemon's sampler")
+	fails.append("one sampler")
+else:
+	print("PASS: one sampler")
+
+print("Test: one output stream per chamber")
+streams = {}
+for name in (a, b, t):
+	paths = glob.glob("vacuum-%s-*.csv" % name)
+	if len(paths) == 1:
+		with open(paths[0]) as f:
+			streams[name] = f.read().splitlines()
+rows = dict((name, [l for l in lines if not l.startswith("#") and "\t" in l]) for name, lines in streams.items())
+if sorted(streams) != sorted([a, b, t]):
+	print("FAILURE! Expected one stream per chamber, got ", os.listdir(tmp))
+	fails.append("streams")
+elif any("# Chamber: %s" % name not in streams[name] for name in streams) or any(not 1 <= len(rows[name]) <= 5 for name in rows):
+	print("FAILURE! Each stream should name its chamber and hold its rows, got ", dict((n, len(r)) for n, r in rows.items()))
+	fails.append("stream content")
+elif any("nan" in l for name in (a, b) for l in rows[name]):
+	print("FAILURE! The simulated gauges should all read, got ", rows[a], rows[b])
+	fails.append("stream values")
+else:
+	print("PASS: %s rows" % "/".join(str(len(rows[n])) for n in (a, b, t)))
+
+print("Test: the per-chamber features of the config")
+problems = []
+for reader in daemon.readers:
+	name = reader.chamber
+	if reader.deadband is None or reader.deadband.skipped + len(rows.get(name, [])) != 5:
+		problems.append("%s deadband" % name)
+	if reader.analytics is None or not any(l.startswith("# Analytics:") for l in streams.get(name, [])):
+		problems.append("%s analytics" % name)
+	if reader.session is None or not os.path.exists(".vacuum-session-%s.json" % name):
+		problems.append("%s session cache" % name)
+	ring = RingReader(ringPath(name))
+	if ring.written() != 5: # every sample, written to the stream or not
+		problems.append("%s ring" % name)
+	ring.close()
+	os.remove(ringPath(name))
+with open("alarms.jsonl") as f:
+	alarms = sorted(json.loads(line)["chamber"] for line in f)
+if alarms != sorted([a, t]):
+	problems.append("interlock fired for %s" % alarms)
+if problems:
+	print("FAILURE! ", problems)
+	fails.append("config features")
+else:
+	print("PASS: deadband, analytics, session cache, ring and interlock")
+
+print("Test: numbers given as strings are converted when the daemon is built, and bad ones are config errors")
+quoted = SimulatedDaemon({"delaytime": "1", "min_period": "0.5", "adaptive_target": "0.05", "flush_rows": "10",
+                          "flush_seconds": "2.5", "checkpoint_seconds": None, "chambers": [{"name": t, "test": True}]}, False)
+policy, scheduler = quoted.flushPolicy, quoted.scheduler
+bad = 0
+for broken in ({"flush_rows": "ten"}, {"adaptive_target": [1]}, {"heartbeat": True}, {"delaytime": None}, {"bus_depth": {"/dev/sim-bus": "deep"}},
+               {"chambers": [{"name": "x", "pirani_address": "one"}]}, {"chambers": [{"name": "x", "capacitance_fullscale": ["a", 1.]}]}):
+	config = {"chambers": []}
+	config.update(broken)
+	try:
+		SimulatedDaemon(config, False)
+	except config_error:
+		bad += 1
+if (policy.rows, policy.seconds, policy.checkpointSeconds) != (10, 2.5, None) or (scheduler.minPeriod, scheduler.maxPeriod, scheduler.target) != (0.5, 1., 0.05):
+	print("FAILURE! Expected converted numbers, got ", vars(policy), scheduler.minPeriod, scheduler.maxPeriod, scheduler.target)
+	fails.append("quoted numbers")
+elif bad != 7:
+	print("FAILURE! Expected 7 config_errors, got %d" % bad)
+	fails.append("config_error")
+else:
+	print("PASS: numbers converted, bad ones rejected")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
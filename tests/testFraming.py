@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from fakeSerial import MockPirani, MockCapacitance, TimedFakeSerial
+from pressure_gauges import Pirani, Capacitance, response_timeout
+
+# checks that the gauges frame replies on terminators / lengths, and give up at the command deadline
+
+fails = []
+
+pirani = Pirani(MockPirani("any_pirani_port", 9600, 8, 'N', 1), False)
+cap = Capacitance(MockCapacitance("any_cap_port", 9600, 8, 'N', 1), False)
+
+print("Test: framed replies from mock gauges")
+res = pirani.getPressure()
+if res != [1e-05]:
+	print("FAILURE! Pirani pressure should be [1e-05], instead got ", res)
+	fails.append("frame fixed-length pirani reply")
+else:
+	print("PASS: pirani pressure frame")
+
+res = cap.getPressure()
+if res != [0.5, 0.501]:
+	print("FAILURE! Capacitance pressure should be [0.5, 0.501], instead got ", res)
+	fails.append("frame unterminated capacitance reply on idle line")
+else:
+	print("PASS: capacitance pressure frame")
+
+# a reply with a terminator ends at the terminator, even if more bytes follow
+cap.innerSerial.inBuffer = b"Torr\r\nTorr"
+res = cap._readFrame("u")
+if res != b"Torr\r":
+	print("FAILURE! Frame should stop at the first terminator, instead got ", res)
+	fails.append("stop frame at terminator")
+else:
+	print("PASS: frame stops at terminator")
+
+class ChunkedCapacitance(TimedFakeSerial):
+	""" Answers every command with the same (delay, bytes) chunks """
+	def __init__(self, chunks):
+		self.timeout = 30 # sanity
+		self.inBuffer = b""
+		self.scheduled = []
+		self.cmdToFile = {}
+		self.name = self.port = "chunked"
+		self.chunks = chunks
+	def write(self, data):
+		for delay, chunk in self.chunks:
+			self._schedule(delay, chunk)
+		return len(data)
+
+print("Test: a reply that pauses for the USB latency timer is not cut short")
+# two USB packets 30 ms apart: a 16 ms latency timer, plus USB and scheduling delays
+paused = Capacitance(ChunkedCapacitance([(0., b"0.50 0."), (0.03, b"501\r\n")]), False)
+try:
+	res = paused.getPressure()
+except Exception as err:
+	res = err
+if res != [0.5, 0.501]:
+	print("FAILURE! The pause should not end the frame, instead got ", res)
+	fails.append("frame across a USB latency pause")
+else:
+	print("PASS: frame spans the pause")
+
+print("Test: the late LF of the previous CR/LF reply does not end the next frame")
+late = Capacitance(ChunkedCapacitance([(0., b"\n"), (0.005, b"0.50 0.501\r\n")]), False)
+try:
+	res = late.getPressure()
+except Exception as err:
+	res = err
+if res != [0.5, 0.501] or late.failures:
+	print("FAILURE! The stray LF should be skipped, instead got ", res)
+	fails.append("skip leading terminator")
+else:
+	print("PASS: leading terminator skipped")
+
+print("Test: unanswered command hits its deadline instead of hanging")
+pirani.timeout = 0.1
+pirani.expectedLengths = dict(pirani.expectedLengths)
+pirani.expectedLengths["@253NOPE?;FF"] = 17
+start = time.monotonic()
+try:
+	pirani._sendCmdGetResp("@253NOPE?;FF")
+	print("FAILURE! Unanswered command should raise response_timeout")
+	fails.append("raise response_timeout")
+except response_timeout:
+	if time.monotonic() - start > 1.0:
+		print("FAILURE! Deadline overran")
+		fails.append("respect command deadline")
+	else:
+		print("PASS: response_timeout at deadline")
+
+pirani.close()
+cap.close()
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+import json, os, sys, tempfile, threading, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from interlock import Rule, Interlock, Dispatcher, rule_error, parseAction
+
+# checks the rule types, their hysteresis, and that actions run off the sampling thread without blocking it
+
+fails = []
+tmp = tempfile.mkdtemp()
+nan = float('nan')
+
+def states(rule, samples):
+	return [rule.evaluate(t, values) for t, values in samples]
+
+print("Test: above fires once and clears past the clear level")
+rule = Rule({"name": "vent", "type": "above", "channel": "pirani", "threshold": 1.0, "clear": 0.5})
+got = states(rule, [(k, [p, 0., 0.]) for k, p in enumerate([0.1, 1.2, 0.9, 1.1, 0.6, 0.4, 0.8])])
+if got != [None, "alarm", None, None, None, "clear", None]:
+	print("FAILURE! Expected one alarm and one clear, got ", got)
+	fails.append("above hysteresis")
+else:
+	print("PASS: above with hysteresis")
+
+print("Test: a NaN reading leaves the state alone")
+got = states(rule, [(10, [2., 0., 0.]), (11, [nan, 0., 0.]), (12, [2., 0., 0.])])
+if got != ["alarm", None, None] or not rule.active:
+	print("FAILURE! NaN should neither fire nor clear, got ", got)
+	fails.append("nan")
+else:
+	print("PASS: NaN ignored")
+
+print("Test: rate of rise over the window")
+rule = Rule({"type": "rate_of_rise", "channel": "capacitance 1", "rate": 1e-3, "window": 10})
+flat = states(rule, [(t, [0., 0., 1e-2]) for t in range(20)])
+rising = states(rule, [(t, [0., 0., 1e-2 + 2e-3 * (t - 20)]) for t in range(20, 40)])
+if any(flat) or "alarm" not in rising or abs(rule.value - 2e-3) > 1e-9:
+	print("FAILURE! A flat trace should not fire and a 2e-3/s rise should, got ", flat, rising, rule.value)
+	fails.append("rate of rise")
+else:
+	print("PASS: rate of rise")
+
+print("Test: disagreement only inside the range")
+rule = Rule({"type": "disagreement", "channels": ["pirani", "capacitance 0"], "factor": 3., "clear": 2., "range": [0.01, 100.]})
+got = states(rule, [(0, [1e-3, 1e-2, 0.]), (1, [1.0, 0.2, 0.]), (2, [1.0, 0.4, 0.]), (3, [1.0, 0.6, 0.])])
+if got != [None, "alarm", None, "clear"]:
+	print("FAILURE! Expected the out-of-range pair ignored, then alarm and clear, got ", got)
+	fails.append("disagreement")
+else:
+	print("PASS: disagreement")
+
+print("Test: bad rules are rejected")
+bad = 0
+for spec in ({"type": "above", "channel": "ion gauge", "threshold": 1.},
+			 {"type": "above", "channel": "pirani"},
+			 {"type": "sideways", "channel": "pirani"},
+			 {"type": "above", "channel": "pirani", "threshold": 1., "actions": ["email:ops"]}):
+	try:
+		Rule(spec)
+	except rule_error:
+		bad += 1
+if bad != 4:
+	print("FAILURE! Expected 4 rule_errors, got %d" % bad)
+	fails.append("rule_error")
+else:
+	print("PASS: bad rules rejected")
+
+print("Test: events reach a file action through the dispatcher, only for the rule's chambers")
+path = os.path.join(tmp, "alarms.jsonl")
+dispatcher = Dispatcher()
+specs = [{"name": "vent", "type": "above", "channel": "pirani", "threshold": 1.0, "actions": ["file:" + path]},
+		 {"name": "other", "type": "above", "channel": "pirani", "threshold": 1.0, "chambers": ["2"]}]
+lock = Interlock(specs, 1, dispatcher)
+events = lock.evaluate(5., 1e9, [2., 0., 0.]) + lock.evaluate(6., 1e9 + 1, [0.5, 0., 0.])
+dispatcher.close()
+with open(path) as f:
+	written = [json.loads(line) for line in f]
+if [r.name for r in lock.rules] != ["vent"] or [e["state"] for e in events] != ["alarm", "clear"]:
+	print("FAILURE! Expected only rule vent, firing and clearing, got ", [r.name for r in lock.rules], events)
+	fails.append("interlock events")
+elif written != events or written[0]["chamber"] != "1" or written[0]["value"] != 2.:
+	print("FAILURE! The file should hold the two events, got ", written)
+	fails.append("file action")
+else:
+	print("PASS: file action")
+
+print("Test: a full queue drops events instead of blocking")
+release = threading.Event()
+ran = []
+def slow(event):
+	release.wait()
+	ran.append(event)
+dispatcher = Dispatcher(size=2)
+start = time.monotonic()
+for k in range(10):
+	dispatcher.submit(slow, {"rule": "slow", "k": k})
+elapsed = time.monotonic() - start
+release.set()
+dispatcher.close()
+if elapsed > 0.1 or not 2 <= len(ran) <= 3:
+	print("FAILURE! submit() took %.3f s and %d of 10 actions ran (expected 2 or 3)" % (elapsed, len(ran)))
+	fails.append("bounded dispatch")
+else:
+	print("PASS: %d of 10 actions ran, the rest were dropped" % len(ran))
+
+print("Test: a stuck action target does not hold up the others, and close() gives up on it")
+stuck = threading.Event()
+def hang(event):
+	stuck.wait()
+hang.target = "socket:unreachable:9"
+valve = []
+def closeValve(event):
+	valve.append(time.monotonic())
+closeValve.target = "command:close-gate-valve"
+dispatcher = Dispatcher()
+start = time.monotonic()
+dispatcher.submit(hang, {"rule": "vent"})
+dispatcher.submit(hang, {"rule": "vent"})
+dispatcher.submit(closeValve, {"rule": "vent"})
+deadline = time.monotonic() + 2.
+while not valve and time.monotonic() < deadline:
+	time.sleep(0.005)
+dispatcher.close(timeout=0.3)
+closed = time.monotonic() - start
+stuck.set()
+if not valve or valve[0] - start > 0.1 or closed > 1.:
+	print("FAILURE! The valve action should run at once and close() should return within its timeout, got ", [v - start for v in valve], closed)
+	fails.append("lanes")
+else:
+	print("PASS: valve action ran after %.3f s, close() returned after %.3f s" % (valve[0] - start, closed))
+
+print("Test: a command action gets the event in its environment")
+out = os.path.join(tmp, "command.txt")
+action = parseAction("command:%s -c 'import os, sys; open(sys.argv[1], \"w\").write(os.environ[\"VACUUM_RULE\"] + os.environ[\"VACUUM_STATE\"])' %s" % (sys.executable, out))
+action({"rule": "vent", "state": "alarm"})
+with open(out) as f:
+	got = f.read()
+if got != "ventalarm":
+	print("FAILURE! Expected ventalarm, got ", got)
+	fails.append("command action")
+else:
+	print("PASS: command action")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import os, sys, tempfile, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from log_index import LogIndex, formatTime
+
+# checks indexing, incremental rescans of grown files, time-range queries and aggregates over vacuum-*.csv logs
+
+fails = []
+tmp = tempfile.mkdtemp()
+base = time.mktime((2024, 5, 7, 14, 0, 0, 0, 0, -1))
+
+def row(k):
+	t = base + 10 * k
+	return "%s\t%.3f\t%.02e\t%.02e\t%.02e\t%.3f\n" % (formatTime(t), 10. * k, k, 2 * k, -k, 10.)
+
+def header(chamber=None):
+	out = "# Opened for output\n# Format Version: 3.2\n"
+	if chamber is not None:
+		out += "# Chamber: %s\n" % chamber
+	return out + "# Columns: DateTime [localtime];Elapsed [s];Pirani; High Range Capacitance Manometer; Low Range Capacitance Manometer; Interval [s]\n# Gauge Units: TORR Torr\n"
+
+def writeLog(name, rows, chamber=None, mode='w'):
+	with open(os.path.join(tmp, name), mode) as f:
+		if mode == 'w':
+			f.write(header(chamber))
+		for k in rows:
+			f.write(row(k))
+
+daemonLog = "vacuum-2-2024-05-07-14-00-00.csv"
+readerLog = "vacuum-2024-05-07-14-00-00.csv"
+writeLog(daemonLog, range(0, 20))
+writeLog(readerLog, range(100, 110), chamber="1")
+with open(os.path.join(tmp, "notes.csv"), 'w') as f:
+	f.write("not a log\n")
+
+class CountingIndex(LogIndex):
+	""" Remembers where each scan of each file started """
+	def __init__(self, *args, **kwargs):
+		LogIndex.__init__(self, *args, **kwargs)
+		self.scans = []
+	def _scan(self, name, entry):
+		self.scans.append((name, entry["end"]))
+		LogIndex._scan(self, name, entry)
+
+print("Test: files are indexed with their chamber, range, rows and marks")
+index = CountingIndex(tmp, stride=4)
+index.update()
+e, r = index.entries.get(daemonLog), index.entries.get(readerLog)
+if sorted(index.entries) != sorted([daemonLog, readerLog]):
+	print("FAILURE! Only the two vacuum logs should be indexed, got ", sorted(index.entries))
+	fails.append("index files")
+elif (e["chamber"], e["rows"], e["first"], e["last"]) != ("2", 20, base, base + 190) or r["chamber"] != "1":
+	print("FAILURE! Wrong entries: ", e, r)
+	fails.append("index entries")
+elif [m[0] for m in e["marks"]] != [base + 40 * i for i in range(5)]:
+	print("FAILURE! Expected a mark every 4 rows, got ", e["marks"])
+	fails.append("marks")
+else:
+	print("PASS: indexed")
+
+print("Test: an unchanged directory is not rescanned, even by a new index object")
+again = CountingIndex(tmp, stride=4)
+again.update()
+if again.scans or again.entries != index.entries:
+	print("FAILURE! The saved index should be reused as is, rescanned ", again.scans)
+	fails.append("reuse")
+else:
+	print("PASS: saved index reused")
+
+print("Test: appended rows are scanned from where the last scan ended")
+end = again.entries[daemonLog]["end"]
+time.sleep(0.01) # a new mtime even on coarse clocks
+writeLog(daemonLog, range(20, 30), mode='a')
+again.update()
+e = again.entries[daemonLog]
+if again.scans != [(daemonLog, end)] or e["rows"] != 30 or e["last"] != base + 290:
+	print("FAILURE! Expected one rescan of the tail from %d, got " % end, again.scans, e["rows"])
+	fails.append("incremental rescan")
+else:
+	print("PASS: incremental rescan")
+
+print("Test: a file rewritten shorter is scanned again from the start, and deleted files are forgotten")
+writeLog(daemonLog, range(0, 5))
+os.remove(os.path.join(tmp, readerLog))
+again.scans = []
+again.update()
+if again.scans != [(daemonLog, 0)] or again.entries[daemonLog]["rows"] != 5 or readerLog in again.entries:
+	print("FAILURE! Expected a full rescan and the deleted file dropped, got ", again.scans, sorted(again.entries))
+	fails.append("rewrite and delete")
+else:
+	print("PASS: rewrite and delete")
+writeLog(daemonLog, range(0, 30))
+writeLog(readerLog, range(100, 110), chamber="1")
+index = LogIndex(tmp, stride=4)
+index.update()
+
+print("Test: a time-range query returns exactly the rows in range, across marks")
+got = [(name, t, values) for name, t, values in index.query(base + 55, base + 125)]
+if [t for name, t, values in got] != [base + 10 * k for k in range(6, 13)] or got[0][2] != [6., 12., -6., 10.]:
+	print("FAILURE! Expected rows 6..12, got ", [(t - base) / 10 for name, t, values in got])
+	fails.append("query range")
+elif list(index.query(base + 1000, base + 1090, chamber="2")) or len(list(index.query(base + 1000, base + 1090, chamber="1"))) != 10:
+	print("FAILURE! The chamber filter should select only the chamber-1 rows")
+	fails.append("query chamber")
+else:
+	print("PASS: query")
+
+print("Test: aggregates per bucket")
+stats = index.aggregate(base, base + 119, 60., chamber="2")
+expected = [(base, 6, [0., 0., -5., 10.], [5., 10., 0., 10.], [2.5, 5., -2.5, 10.]),
+			(base + 60, 6, [6., 12., -11., 10.], [11., 22., -6., 10.], [8.5, 17., -8.5, 10.])]
+if stats != expected:
+	print("FAILURE! Expected two 6-row buckets, got ", stats)
+	fails.append("aggregate")
+else:
+	print("PASS: aggregate")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
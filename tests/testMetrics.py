@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import os, socket, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import metrics
+from fakeSerial import MockPirani
+from pressure_gauges import Pirani, ack_error
+
+# checks the text exposition of the metrics, and that gauge replies are counted
+
+fails = []
+
+print("Test: histogram buckets are cumulative")
+h = metrics.histogram("test_seconds", "test histogram", buckets=(.1, 1.), kind="a")
+for v in (.05, .5, .5, 5.):
+	h.observe(v)
+text = metrics.REGISTRY.render()
+expected = ['test_seconds_bucket{kind="a",le="0.1"} 1', 'test_seconds_bucket{kind="a",le="1.0"} 3', 'test_seconds_bucket{kind="a",le="+Inf"} 4', 'test_seconds_count{kind="a"} 4']
+missing = [line for line in expected if line not in text.splitlines()]
+if missing or "# TYPE test_seconds histogram" not in text:
+	print("FAILURE! Missing lines in the exposition: ", missing)
+	fails.append("histogram exposition")
+else:
+	print("PASS: histogram exposition")
+
+print("Test: the same name and labels give the same metric")
+if metrics.histogram("test_seconds", "test histogram", kind="a") is not h:
+	print("FAILURE! histogram() should return the registered metric")
+	fails.append("registry lookup")
+else:
+	print("PASS: registry lookup")
+
+print("Test: gauge round trips and ack errors are counted")
+pirani = Pirani(MockPirani(), False)
+pirani.getPressure()
+count = pirani.rtt.counts
+if sum(count) != 1:
+	print("FAILURE! One round trip should be recorded, instead got ", sum(count))
+	fails.append("count round trips")
+else:
+	print("PASS: count round trips")
+pirani.innerSerial.cmdToFile[Pirani.pressureCommand].read(1) # misalign the canned replies
+try:
+	pirani.getPressure()
+except (ack_error, ValueError):
+	pass
+if pirani.ackErrors.value + pirani.parseFailures.value != pirani.retries + 1:
+	print("FAILURE! A misaligned reply should count an ack error or parse failure per attempt")
+	fails.append("count bad replies")
+else:
+	print("PASS: count bad replies")
+
+print("Test: each gauge's metrics are labelled with its chamber and port")
+from read_vacuum import VacuumReader
+readers = [VacuumReader(chamber, False) for chamber in ("a", "b")]
+for reader in readers:
+	reader.testMode = True # mock gauges, as a daemon test chamber has
+	reader.setUpPirani()
+readers[0].pirani.timeouts.inc()
+text = metrics.REGISTRY.render().splitlines()
+series = ['vacuum_serial_timeouts_total{chamber="a",gauge="pirani",port="mockpirani"} 1', 'vacuum_serial_timeouts_total{chamber="b",gauge="pirani",port="mockpirani"} 0']
+if [line for line in series if line not in text]:
+	print("FAILURE! Expected a series per chamber, got ", [line for line in text if line.startswith("vacuum_serial_timeouts_total")])
+	fails.append("gauge labels")
+else:
+	print("PASS: per-chamber series")
+for reader in readers:
+	reader.pirani.close()
+
+print("Test: serving over a Unix socket")
+path = os.path.join(tempfile.mkdtemp(), "metrics.sock")
+server = metrics.MetricsServer(path)
+client = socket.socket(socket.AF_UNIX)
+client.connect(path)
+received = b""
+while True:
+	chunk = client.recv(65536)
+	if not chunk:
+		break
+	received += chunk
+client.close()
+server.close()
+if b"vacuum_serial_rtt_seconds_count" not in received:
+	print("FAILURE! The socket should serve the registry, instead got ", received[:200])
+	fails.append("unix socket server")
+else:
+	print("PASS: unix socket server")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from read_vacuum import VacuumReader, setUp
+
+# checks that a headless reader never loads matplotlib, and that a live plot can be attached, refreshed and
+# detached mid-run (on the non-interactive Agg backend, so no display is needed)
+
+fails = []
+tmp = tempfile.mkdtemp()
+os.chdir(tmp) # setUp() opens the output file in the working directory
+
+print("Test: a headless reader records without importing matplotlib")
+reader = VacuumReader(-1, False)
+reader.echo = False
+reader = setUp(reader)
+for k in range(3):
+	reader.recordRow(reader.sampler.sample())
+if 'matplotlib' in sys.modules or 'live_plot' in sys.modules:
+	print("FAILURE! Setting up and recording headless should not import matplotlib")
+	fails.append("headless import")
+else:
+	print("PASS: matplotlib not loaded")
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+
+print("Test: attaching a plot mid-run draws the rows recorded from then on")
+reader.attachPlot()
+for k in range(4):
+	reader.recordRow(reader.sampler.sample())
+	reader.refreshPlot()
+lines = reader.plot.lines
+if len(lines) != 3 or any(len(line.get_xdata()) != 4 for line in lines):
+	print("FAILURE! Expected 3 lines of 4 points, got ", [len(line.get_xdata()) for line in lines])
+	fails.append("attach refresh")
+elif not lines[0].get_label().startswith("Pirani") or not plt.fignum_exists(reader.plot.figure.number):
+	print("FAILURE! The figure should be open with labelled lines")
+	fails.append("attach figure")
+else:
+	print("PASS: attach and refresh")
+
+print("Test: detaching closes the figure and recording carries on")
+figure = reader.plot.figure
+reader.detachPlot()
+for k in range(2):
+	reader.recordRow(reader.sampler.sample())
+	reader.refreshPlot()
+if reader.plot is not None or plt.fignum_exists(figure.number) or len(reader.store.latest()[0]) != 6:
+	print("FAILURE! Expected no plot, the figure closed and 6 rows in the store, got ", len(reader.store.latest()[0]))
+	fails.append("detach")
+else:
+	print("PASS: detach")
+
+print("Test: a blitting plot redraws only the lines while the limits hold")
+from live_plot import LivePlot
+plot = LivePlot(reader.store, ("a", "b", "c"), blit=True)
+plot.refresh()
+background = plot.background
+plot.axes.set_autoscale_on(False) # fixed limits, so the next refresh can blit
+plot.limits = (plot.axes.get_xlim(), plot.axes.get_ylim())
+plot.refresh()
+if background is None or plot.background is not background:
+	print("FAILURE! The saved background should be reused while the limits do not move")
+	fails.append("blit")
+else:
+	print("PASS: blit")
+plot.close()
+reader.closeAll()
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
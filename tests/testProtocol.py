@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from protocol import PIRANI, CAPACITANCE
+
+# checks the reply decoders, one reply at a time and in batches
+
+fails = []
+fullscale = [1000., 1.]
+minscale = [1e-1, 1e-4]
+
+print("Test: capacitance replies")
+cases = [
+	("000.50 0.5010", [0.5, 0.501]),
+	("7.60E+2 - 1.0E-3", [760., 1e-4]), # split minus sign, clamped to minscale
+	("Off 0.0100", [1000., 0.01]),
+]
+for raw, expected in cases:
+	res = CAPACITANCE.pressures(raw, fullscale, minscale)
+	if res != expected:
+		print("FAILURE! Decoding %r should give %s, instead got %s" % (raw, expected, res))
+		fails.append("decode capacitance reply %r" % raw)
+	else:
+		print("PASS: %r" % raw)
+
+res = CAPACITANCE.batch(b"000.50 0.5010\r\n7.60E+2 - 1.0E-3\r\nOff 0.0100\r\n", fullscale, minscale)
+if res.tolist() != [expected for raw, expected in cases]:
+	print("FAILURE! Batch decode gave ", res.tolist())
+	fails.append("batch decode capacitance replies")
+else:
+	print("PASS: capacitance batch")
+
+print("Test: pirani replies")
+res = PIRANI.split(b"@253ACK7.60E+2;FF")
+if res != (b"253", b"ACK", b"7.60E+2"):
+	print("FAILURE! Split should give address, ack and value, instead got ", res)
+	fails.append("split pirani reply")
+else:
+	print("PASS: pirani split")
+
+addrs, values = PIRANI.batch(b"@253ACK7.60E+2;FF@001NAK160;FF@253ACK1.00E-3;FF")
+if addrs.tolist() != [b"253", b"001", b"253"] or values[0] != 760. or values[2] != 1e-3 or values[1] == values[1]:
+	print("FAILURE! Batch decode gave ", addrs, values)
+	fails.append("batch decode pirani replies")
+else:
+	print("PASS: pirani batch, NAK reads as NaN")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
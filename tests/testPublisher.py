@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+import json, os, socket, sys, tempfile, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from publisher import Publisher, subscribe, connect
+
+# checks catch-up from the recent-sample ring, chamber filtering, and drop-oldest for slow subscribers
+
+fails = []
+path = os.path.join(tempfile.mkdtemp(), "live.sock")
+pub = Publisher(path, history=10, backlog=5)
+for i in range(20):
+	pub.publish("1" if i % 2 else "2", 1000. + i, float(i), 1e-3, [1e-3, 1e-3])
+
+print("Test: a new subscriber catches up from the history")
+stream = subscribe(path, catchup=4, chambers=["1"])
+got = [next(stream)["seq"] for i in range(4)]
+if got != [14, 16, 18, 20]:
+	print("FAILURE! Catch-up of chamber 1 should be seq [14, 16, 18, 20], instead got ", got)
+	fails.append("catch-up")
+else:
+	print("PASS: catch-up")
+
+print("Test: live samples follow the catch-up")
+time.sleep(0.1)
+pub.publish("1", 2000., 100., 1e-4, [1e-4, 1e-4])
+pub.publish("2", 2001., 101., 1e-4, [1e-4, 1e-4])
+pub.publish("1", 2002., 102., 1e-4, [1e-4, 1e-4])
+got = [next(stream)["time"] for i in range(2)]
+if got != [2000., 2002.]:
+	print("FAILURE! Live samples of chamber 1 should have times [2000, 2002], instead got ", got)
+	fails.append("live samples")
+else:
+	print("PASS: live samples")
+stream.close()
+
+print("Test: a failed gauge's NaN is sent as null, so the line is strict JSON")
+def strict(constant):
+	raise ValueError("not JSON: " + constant)
+nan = float('nan')
+pub.publish("3", 3000., 200., nan, [nan, 1e-4], analytics={"pirani": {"eta": float('inf')}})
+line = pub.history[-1][2]
+try:
+	sample = json.loads(line.decode('utf8'), parse_constant=strict)
+except ValueError as err:
+	sample = err
+if not isinstance(sample, dict) or sample["pirani"] is not None or sample["capacitance"] != [None, 1e-4] or sample["analytics"]["pirani"]["eta"] is not None:
+	print("FAILURE! Expected nulls for the non-finite values, got ", line)
+	fails.append("strict json")
+else:
+	print("PASS: non-finite values sent as null")
+
+print("Test: a malformed request closes the connection and unregisters the subscriber")
+before = len(pub.subscribers) # the closed stream above may still be registered until its next send
+closed = []
+for request in (b'{"catchup": "many"}\n', b'{"since": "yesterday"}\n', b'{"chambers": 5}\n'):
+	bad = connect(path)
+	bad.settimeout(2.)
+	bad.sendall(request)
+	try:
+		closed.append(bad.recv(4096) == b"")
+	except OSError:
+		closed.append(False)
+	bad.close()
+deadline = time.monotonic() + 2.
+while len(pub.subscribers) > before and time.monotonic() < deadline:
+	time.sleep(0.01)
+if closed != [True, True, True] or len(pub.subscribers) > before:
+	print("FAILURE! Bad requests should be closed and unregistered, got ", closed, len(pub.subscribers))
+	fails.append("bad request")
+else:
+	print("PASS: bad requests dropped")
+
+print("Test: a subscriber that does not read loses its oldest samples, not the publisher's time")
+slow = connect(path)
+slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+slow.sendall(b"{}\n")
+time.sleep(0.1)
+start = time.monotonic()
+for i in range(20000):
+	pub.publish("1", 3000. + i, 0., 1e-5, [1e-5, 1e-5])
+elapsed = time.monotonic() - start
+subscriber = [s for s in pub.subscribers][0]
+if subscriber.dropped == 0 or elapsed > 5.:
+	print("FAILURE! Publishing to a stuck subscriber should drop samples and not block; dropped %d in %.2f s" % (subscriber.dropped, elapsed))
+	fails.append("drop oldest")
+else:
+	print("PASS: drop oldest")
+slow.close()
+pub.close()
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
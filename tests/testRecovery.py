@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+import math, os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from gaugeSimulator import Simulation
+from pressure_gauges import Pirani, Capacitance, gauge_unavailable
+from acquisition import ConcurrentSampler
+from fakeSerial import MockPirani
+from gauge_broker import broker_error, RemotePirani, RemoteCapacitance
+
+# checks bounded retries, backing off a dead gauge, reopening its port, and that the other gauges keep recording
+
+fails = []
+
+class QuickPirani(Pirani):
+	timeout = 0.05
+	backoff = 0.001
+	downtime = 0.2
+
+sim = Simulation(seed=2)
+piraniPort, capPort = sim.addChamber("a")
+piraniPort.opened = 0
+piraniPort.open = lambda: setattr(piraniPort, 'opened', piraniPort.opened + 1)
+pirani = QuickPirani(piraniPort, False)
+cap = Capacitance(capPort, False)
+
+print("Test: a corrupted reply is retried")
+good = piraniPort.reply
+calls = []
+def flakyOnce(cmd):
+	calls.append(cmd)
+	if len(calls) == 1:
+		return b'@253NAK160;FF'
+	return good(cmd)
+piraniPort.reply = flakyOnce
+value = pirani.getPressure()
+if len(calls) != 2 or not value[0] > 0:
+	print("FAILURE! A NAK should be retried once and then succeed, instead sent %d commands" % len(calls))
+	fails.append("retry")
+else:
+	print("PASS: retry")
+
+print("Test: a dead gauge is reopened, backed off, and recorded as NaN while the other gauge records")
+piraniPort.reply = lambda cmd: b''
+sampler = ConcurrentSampler([("pirani", pirani), ("capacitance", cap)], False, timeout=2.)
+rows = [sampler.sample() for i in range(4)]
+commands = piraniPort.commands
+start = time.monotonic()
+row = sampler.sample()
+quick = time.monotonic() - start
+if not all(math.isnan(r["pirani"].values[0]) for r in rows) or piraniPort.opened != 1:
+	print("FAILURE! Pirani should read NaN and its port be reopened once, instead reopened %d times" % piraniPort.opened)
+	fails.append("reconnect")
+elif piraniPort.commands != commands or quick > 0.05 or "not responding" not in row["pirani"].error:
+	print("FAILURE! While backed off, the dead gauge should not be queried; took %.3f s" % quick)
+	fails.append("back off")
+elif any(math.isnan(v) for r in rows for v in r["capacitance"].values):
+	print("FAILURE! The capacitance gauge should keep recording")
+	fails.append("isolate failures")
+else:
+	print("PASS: reconnect, back off and isolate")
+
+print("Test: the gauge recovers after its downtime")
+piraniPort.reply = good
+time.sleep(0.25)
+row = sampler.sample()
+if row["pirani"].error is not None or pirani.failures != 0:
+	print("FAILURE! Pirani should read again after the downtime, instead got ", row["pirani"])
+	fails.append("recover")
+else:
+	print("PASS: recover")
+sampler.close()
+
+print("Test: gauges sharing a port have it reopened once, by its owner")
+sim = Simulation(seed=3)
+sharedPort, other = sim.addChamber("b")
+sharedPort.opened = 0
+sharedPort.open = lambda: setattr(sharedPort, 'opened', sharedPort.opened + 1)
+first, second = QuickPirani(sharedPort, False), QuickPirani(sharedPort, False)
+sharedPort.reply = lambda cmd: b''
+sampler = ConcurrentSampler([("first", first), ("second", second)], False, timeout=2.)
+rows = [sampler.sample() for i in range(3)]
+owner = first.sharedPort
+sampler.close()
+if owner is None or second.sharedPort is not None or sharedPort.opened != 1:
+	print("FAILURE! Expected a SharedPort, released on close, and one reopen for both gauges, got %d" % sharedPort.opened)
+	fails.append("shared port")
+else:
+	print("PASS: shared port reopened once")
+
+print("Test: a reopened mock port serves its canned replies again")
+mock = Pirani(MockPirani(), False)
+mock.innerSerial.close()
+mock.reopen()
+try:
+	value = mock.getPressure()
+except Exception as err:
+	value = [err]
+if not isinstance(value[0], float):
+	print("FAILURE! The mock should answer after reopening, got ", value)
+	fails.append("mock reopen")
+else:
+	print("PASS: mock reopen")
+
+print("Test: a remote gauge leaves retrying a failed gauge to the broker, and reconnects only when its connection fails")
+class FakeConnection(object):
+	""" Stands in for a BrokerConnection: raises the queued errors in turn, then answers """
+	port = "fake-broker-port"
+	def __init__(self, errors):
+		self.errors = list(errors)
+		self.requests = 0
+		self.opened = 0
+	def request(self, kind, command):
+		self.requests += 1
+		if self.errors:
+			raise self.errors.pop(0)
+		return "1.00E-3"
+	def open(self):
+		self.opened += 1
+	def close(self):
+		pass
+class QuickRemotePirani(RemotePirani):
+	backoff = 0.001
+	reconnectAfter = 1
+gaugeFailed = FakeConnection([broker_error("gauge not responding")])
+remote = QuickRemotePirani(gaugeFailed, False)
+try:
+	remote.getPressure()
+	got = "no error"
+except broker_error:
+	got = "broker_error"
+connectionFailed = FakeConnection([ConnectionResetError("broker went away")] * 3)
+remote = QuickRemotePirani(connectionFailed, False)
+try:
+	remote.getPressure()
+except OSError:
+	pass
+remote.retryAt = None # skip the downtime
+value = remote.getPressure()
+if got != "broker_error" or gaugeFailed.requests != 1 or gaugeFailed.opened:
+	print("FAILURE! A gauge error from the broker should be raised after one request, got %s after %d" % (got, gaugeFailed.requests))
+	fails.append("broker error not retried")
+elif connectionFailed.requests != 4 or connectionFailed.opened != 1 or value != [1e-3]:
+	print("FAILURE! A failed connection should be retried and reopened, got %d requests, %d reopens" % (connectionFailed.requests, connectionFailed.opened))
+	fails.append("connection retried")
+else:
+	print("PASS: retries in one layer")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
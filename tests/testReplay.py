@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+import binascii, json, os, sys, tempfile, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from serialCapture import ReplaySerial, CapturingSerial, loadCapture
+from fakeSerial import MockPirani
+from pressure_gauges import Pirani
+
+# checks that captured traffic replays in order, at the recorded pace scaled by the speed-up
+
+fails = []
+
+capture = os.path.join(tempfile.mkdtemp(), "pirani.jsonl")
+with open(capture, 'w') as f:
+	f.write(json.dumps({"capture": 1, "port": "/dev/ttyUSB0", "baudrate": 9600}) + "\n")
+	for i, reply in enumerate((b"@253ACK7.60E+2;FF", b"@253ACK1.00E-3;FF")):
+		f.write(json.dumps({"t": i * 9., "w": binascii.hexlify(b"@253PR1?;FF").decode()}) + "\n")
+		f.write(json.dumps({"t": i * 9. + 0.1, "r": binascii.hexlify(reply).decode()}) + "\n")
+
+print("Test: replay in order, wrapping at the end of the capture")
+pirani = Pirani(ReplaySerial(capture, None), False)
+res = [pirani.getPressure()[0] for i in range(3)]
+if res != [760., 1e-3, 760.]:
+	print("FAILURE! Replayed pressures should be [760.0, 0.001, 760.0], instead got ", res)
+	fails.append("replay exchanges in order")
+else:
+	print("PASS: replay order")
+
+print("Test: reply delay is scaled by the speed-up")
+pirani = Pirani(ReplaySerial(capture, 10.), False)
+start = time.monotonic()
+pirani.getPressure()
+elapsed = time.monotonic() - start
+if not 0.005 <= elapsed < 0.05:
+	print("FAILURE! A 0.1 s reply at 10x should take about 0.01 s, instead took ", elapsed)
+	fails.append("scale reply delay")
+else:
+	print("PASS: reply delay scaled")
+
+print("Test: a capture carries on through a reconnect of its port")
+recorded = os.path.join(tempfile.mkdtemp(), "pirani.jsonl")
+port = CapturingSerial(MockPirani(), recorded)
+pirani = Pirani(port, False)
+try:
+	res = [pirani.getPressure()[0]]
+	pirani.reopen()
+	res.append(pirani.getPressure()[0])
+except Exception as err:
+	res.append(err)
+pirani.close()
+closedEarly = port.capture.closed
+port.finish()
+exchanges = loadCapture(recorded)
+if res != [1e-05, 1e-05] or closedEarly:
+	print("FAILURE! The gauge should read before and after the reconnect with the capture file open, got ", res)
+	fails.append("capture through reconnect")
+elif [cmd for cmd, chunks in exchanges] != ["@253PR1?;FF"] * 2 or not port.capture.closed:
+	print("FAILURE! Both commands should be in the capture, and finish() should close it, got ", exchanges)
+	fails.append("capture finished")
+else:
+	print("PASS: capture through reconnect")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
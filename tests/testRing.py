@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+import multiprocessing, os, sys, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from sample_ring import SampleRing, RingReader, ringPath, RECORD_SIZE, HEADER_SIZE, SEQ
+
+# checks the ring layout rules, and that a reader in another process never sees a half-written sample
+
+def sample(k):
+	# every field is derived from k, so a torn record shows up as a mismatch
+	return (1e9 + k, k * 0.5, 1e-3 * k, 2e-3 * k, 3e-3 * k)
+
+def write(ring, k):
+	t, elapsed, p, c0, c1 = sample(k)
+	ring.append(t, elapsed, p, [c0, c1])
+
+def consistent(s):
+	return tuple(s[1:]) == sample(s.index)
+
+def hammer(path, n, ready):
+	# runs in a child process, which may import this module afresh (spawn, forkserver): it only uses its arguments
+	ring = SampleRing(path, "t", capacity=8)
+	ready.set()
+	for k in range(n):
+		write(ring, k)
+	ring.close()
+
+if __name__ == '__main__':
+	fails = []
+	tmp = tempfile.mkdtemp()
+	path = ringPath("t", tmp)
+
+	print("Test: newest samples, oldest first, limited to the capacity")
+	ring = SampleRing(path, "t", capacity=4)
+	reader = RingReader(path)
+	for k in range(10):
+		write(ring, k)
+	latest = reader.latest(3)
+	all4 = reader.latest(100)
+	if [s.index for s in latest] != [7, 8, 9] or [s.index for s in all4] != [6, 7, 8, 9] or not all(consistent(s) for s in all4):
+		print("FAILURE! Expected samples 7-9 and 6-9, got ", latest, all4)
+		fails.append("latest")
+	elif reader.chamber != "t" or reader.written() != 10:
+		print("FAILURE! Header should hold chamber t and 10 written, got ", reader.chamber, reader.written())
+		fails.append("header")
+	else:
+		print("PASS: latest samples")
+
+	print("Test: poll returns each sample once")
+	first = reader.poll()
+	write(ring, 10)
+	second = reader.poll()
+	if [s.index for s in first] != [6, 7, 8, 9] or [s.index for s in second] != [10] or reader.poll() != []:
+		print("FAILURE! Unexpected polls ", first, second)
+		fails.append("poll")
+	else:
+		print("PASS: poll")
+
+	print("Test: a record being written is not returned")
+	offset = HEADER_SIZE + (10 % 4) * RECORD_SIZE
+	SEQ.pack_into(ring.map, offset, 2 * 10 + 1) # as if the writer stopped in the middle of record 10
+	if reader.read(10) is not None or reader.read(9) is None:
+		print("FAILURE! An odd sequence number should hide the record")
+		fails.append("seqlock")
+	else:
+		print("PASS: half-written record hidden")
+	SEQ.pack_into(ring.map, offset, 2 * 10 + 2)
+
+	print("Test: a new run replaces the ring")
+	ring2 = SampleRing(path, "t", capacity=4)
+	if not reader.stale() or RingReader(path).written() != 0:
+		print("FAILURE! The old reader should be stale and the new ring empty")
+		fails.append("stale")
+	else:
+		print("PASS: stale after a new run")
+	reader.close()
+	ring.close()
+	ring2.close()
+
+	print("Test: a reader in another process sees only whole samples")
+	ready = multiprocessing.Event()
+	path = ringPath("h", tmp)
+	writer = multiprocessing.Process(target=hammer, args=(path, 200000, ready))
+	writer.start()
+	ready.wait()
+	reader = RingReader(path)
+	seen = torn = 0
+	while writer.is_alive() or seen == 0:
+		for s in reader.latest(8):
+			seen += 1
+			if not consistent(s):
+				torn += 1
+	writer.join()
+	if torn or not seen:
+		print("FAILURE! %d of %d samples read were torn" % (torn, seen))
+		fails.append("concurrent reads")
+	else:
+		print("PASS: %d samples read while writing, none torn" % seen)
+	reader.close()
+
+	print("TEST RESULTS")
+	print("Failures: ", len(fails))
+	for fail in fails:
+		print(fail)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import math, os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from sample_store import SampleStore
+
+# checks that the sample store wraps at its capacity and keeps its downsampled tiers up to date
+
+fails = []
+
+store = SampleStore(("a", "b"), capacity=10, tiers=((60, 5),))
+for i in range(25):
+	store.append(i * 10., [i, -i])
+
+print("Test: raw ring buffer keeps only the newest samples")
+t, v = store.latest()
+if len(store) != 10 or list(t) != [i * 10. for i in range(15, 25)] or list(v[:, 1]) != [-i for i in range(15, 25)]:
+	print("FAILURE! Should hold samples 15..24, instead got ", t)
+	fails.append("wrap raw ring buffer")
+else:
+	print("PASS: raw ring buffer wraps")
+
+print("Test: 1-minute tier")
+tier = store.tier(60)
+rows = tier.rows()
+# 25 samples 10 s apart fill buckets 0..3 (6 samples each) and open bucket 4 (1 sample)
+if list(tier.times(rows)) != [0., 60., 120., 180., 240.]:
+	print("FAILURE! Bucket start times wrong: ", tier.times(rows))
+	fails.append("tier bucket times")
+elif list(tier.minimum(rows, 0)) != [0, 6, 12, 18, 24] or list(tier.maximum(rows, 0)) != [5, 11, 17, 23, 24]:
+	print("FAILURE! Bucket min/max wrong: ", tier.minimum(rows, 0), tier.maximum(rows, 0))
+	fails.append("tier min/max")
+elif list(tier.mean(rows, 1)) != [-2.5, -8.5, -14.5, -20.5, -24]:
+	print("FAILURE! Bucket means wrong: ", tier.mean(rows, 1))
+	fails.append("tier mean")
+else:
+	print("PASS: tier buckets")
+
+print("Test: a failed reading (NaN) is left out of its bucket")
+nan = float('nan')
+store = SampleStore(("a", "b"), capacity=10, tiers=((60, 5),))
+for i, values in enumerate([[nan, 1.], [2., nan], [4., nan], [nan, nan], [3., 5.], [nan, nan], [nan, nan]]):
+	store.append(i * 10., values)
+tier = store.tier(60)
+rows = tier.rows()
+got = [(tier.minimum(rows, c)[0], tier.maximum(rows, c)[0], tier.mean(rows, c)[0]) for c in (0, 1)]
+if got != [(2., 4., 3.), (1., 5., 3.)]:
+	print("FAILURE! The first bucket should hold the statistics of its readings, got ", got)
+	fails.append("nan in bucket")
+elif not all(math.isnan(v) for v in (tier.minimum(rows, 0)[1], tier.maximum(rows, 1)[1], tier.mean(rows, 0)[1])):
+	print("FAILURE! A bucket with no reading should be NaN, got ", rows[1])
+	fails.append("empty bucket")
+else:
+	print("PASS: NaN readings skipped")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import math, os, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from gaugeSimulator import Simulation
+from pressure_gauges import Pirani, Capacitance
+from acquisition import ConcurrentSampler
+
+# checks, against gauges that take 0.1 s to reply, that the sampler reads different ports at the same time,
+# reads the gauges of a shared port one after the other, and keeps the skew between readings bounded
+
+fails = []
+latency = 0.1
+
+sim = Simulation(seed=3, latency=latency)
+piraniA, capA = sim.addChamber("a")
+piraniB, capB = sim.addChamber("b")
+
+def overlaps(device):
+	""" Counts the commands written to device while the reply to an earlier one was still pending """
+	device.overlaps = 0
+	write = device.write
+	def checkedWrite(data):
+		device._release()
+		if device.scheduled:
+			device.overlaps += 1
+		return write(data)
+	device.write = checkedWrite
+
+def timedSample(sampler):
+	start = time.time()
+	row = sampler.sample()
+	return row, time.time() - start, start
+
+print("Test: gauges on different ports are read in parallel")
+sampler = ConcurrentSampler([("pirani a", Pirani(piraniA, False)), ("capacitance a", Capacitance(capA, False)),
+							 ("pirani b", Pirani(piraniB, False)), ("capacitance b", Capacitance(capB, False))], False)
+row, elapsed, start = timedSample(sampler)
+if any(math.isnan(v) for r in row.readings for v in r.values):
+	print("FAILURE! Every gauge should read, got ", row.readings)
+	fails.append("parallel values")
+elif elapsed > 2 * latency:
+	print("FAILURE! Four ports should take about one reply time, not %.3f s (one after the other: %.1f s)" % (elapsed, 4 * latency))
+	fails.append("parallel")
+elif any(r.timestamp - start < latency for r in row.readings):
+	print("FAILURE! Readings should be stamped when their reply arrived, got ", [r.timestamp - start for r in row.readings])
+	fails.append("reply timestamps")
+else:
+	print("PASS: 4 ports in %.3f s" % elapsed)
+
+print("Test: the skew between ports stays within a fraction of a reply time")
+skews = [sampler.sample().skew() for i in range(5)]
+if max(skews) > latency / 2:
+	print("FAILURE! Expected skews well under %.2f s, got " % (latency / 2), skews)
+	fails.append("skew")
+else:
+	print("PASS: largest skew %.4f s" % max(skews))
+sampler.close()
+
+print("Test: gauges sharing a port are read one after the other, while the other port is read alongside")
+overlaps(piraniA)
+sampler = ConcurrentSampler([("pirani 1", Pirani(piraniA, False)), ("pirani 2", Pirani(piraniA, False)),
+							 ("capacitance", Capacitance(capA, False))], False)
+rows = [timedSample(sampler) for i in range(3)]
+gaps = [row["pirani 2"].timestamp - row["pirani 1"].timestamp for row, elapsed, start in rows]
+alongside = [row["capacitance"].timestamp - row["pirani 1"].timestamp for row, elapsed, start in rows]
+if piraniA.overlaps:
+	print("FAILURE! A command was sent to the shared port before the last reply, %d times" % piraniA.overlaps)
+	fails.append("shared port interleaved")
+elif min(gaps) < 0.9 * latency or any(elapsed < 2 * latency for row, elapsed, start in rows):
+	print("FAILURE! The second gauge should be read after the first has replied, got gaps ", gaps)
+	fails.append("shared port serial")
+elif max(abs(a) for a in alongside) > latency / 2:
+	print("FAILURE! The capacitance gauge should be read alongside the first Pirani, got ", alongside)
+	fails.append("shared port parallel")
+elif max(row.skew() for row, elapsed, start in rows) > 1.5 * latency:
+	print("FAILURE! The skew should stay about one reply time on a two-gauge port, got ", [row.skew() for row, elapsed, start in rows])
+	fails.append("shared port skew")
+else:
+	print("PASS: shared port read in turn, %.3f s apart" % min(gaps))
+sampler.close()
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
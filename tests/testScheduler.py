@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from acquisition import FixedRateScheduler, AdaptiveScheduler, Deadband
+
+# checks the fixed-rate scheduler against a fake clock: deadlines stay on the grid, overruns are skipped and counted
+
+fails = []
+
+class FakeClock(object):
+	def __init__(self):
+		self.now = 100.
+	def __call__(self):
+		return self.now
+	def sleep(self, dt):
+		self.now += dt
+
+clock = FakeClock()
+scheduler = FixedRateScheduler(0.5, sleep=clock.sleep, clock=clock)
+
+print("Test: deadlines do not drift when each sample takes time")
+deadlines = []
+for i in range(4):
+	deadlines.append(scheduler.wait())
+	clock.now += 0.2 # work done between samples
+if deadlines != [100., 100.5, 101., 101.5]:
+	print("FAILURE! Deadlines should be every 0.5 s from 100, instead got ", deadlines)
+	fails.append("keep deadlines on the grid")
+else:
+	print("PASS: deadlines on the grid")
+
+print("Test: a long stall skips missed deadlines")
+clock.now = 103. # next deadline was 102.0 -> 102.0 and 102.5 missed
+res = scheduler.wait()
+stats = scheduler.stats()
+if res != 103. or stats["missed"] != 2:
+	print("FAILURE! Should resume at 103.0 with 2 missed, instead got ", res, stats["missed"])
+	fails.append("skip and count missed deadlines")
+else:
+	print("PASS: missed deadlines skipped")
+
+if abs(scheduler.elapsed() - 3.) > 1e-9:
+	print("FAILURE! Elapsed should be 3.0, instead got ", scheduler.elapsed())
+	fails.append("sub-second elapsed time")
+else:
+	print("PASS: elapsed time")
+
+print("Test: the adaptive period shortens at once when the pressure moves, and grows back slowly")
+clock = FakeClock()
+scheduler = AdaptiveScheduler(0.5, 9., target=0.02, growth=1.5, smoothing=1., sleep=clock.sleep, clock=clock)
+periods = []
+pressure = 1e-5
+for i in range(14):
+	t = scheduler.wait()
+	if 3 <= i < 5:
+		pressure *= 10. # a vent: a decade per sample
+	scheduler.observe(t, [pressure])
+	periods.append(scheduler.period)
+if periods[3] != 0.5 or periods[4] != 0.5 or periods[5] != 0.75 or periods[-1] != 9.:
+	print("FAILURE! Period should drop to 0.5 s during the vent, then grow by 1.5x per sample back to 9 s, instead got ", periods)
+	fails.append("adaptive period")
+else:
+	print("PASS: adaptive period")
+
+print("Test: the deadband passes changes and heartbeats only")
+deadband = Deadband(0.05, heartbeat=60.)
+passed = [deadband.accept(t, [v]) for t, v in ((0., 1.), (9., 1.01), (18., 1.1), (27., 1.09), (90., 1.09))]
+if passed != [True, False, True, False, True] or deadband.skipped != 2:
+	print("FAILURE! Expected [True, False, True, False, True], instead got ", passed)
+	fails.append("deadband")
+else:
+	print("PASS: deadband")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+import os, sys, tempfile, threading, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from session_cache import SessionCache, forChamber
+from read_vacuum import VacuumReader, setUpOutput
+from acquisition import Reading, Row
+from pressure_gauges import response_timeout
+
+# checks the session cache rules, and that a warm start takes the gauge units from the cache and validates them later
+
+fails = []
+tmp = tempfile.mkdtemp()
+
+print("Test: lookup honours the key, the ttl and invalidation")
+path = os.path.join(tmp, "cache.json")
+cache = SessionCache(path, ttl=60.)
+key = {"pirani": "/dev/ttyUSB0", "capacitance": "/dev/ttyUSB1"}
+cache.store(key, {"pirani_units": "TORR", "capacitance_units": "Torr"})
+again = SessionCache(path, ttl=60.)
+if again.lookup(key) != {"pirani_units": "TORR", "capacitance_units": "Torr"}:
+	print("FAILURE! Stored settings should be read back, got ", again.lookup(key))
+	fails.append("store and reload")
+elif again.lookup({"pirani": "/dev/ttyUSB2", "capacitance": "/dev/ttyUSB1"}) is not None:
+	print("FAILURE! A different port mapping should miss")
+	fails.append("key mismatch")
+else:
+	print("PASS: reload and key check")
+again.data["validated"] -= 61.
+if again.lookup(key) is not None:
+	print("FAILURE! An entry older than the ttl should miss")
+	fails.append("ttl")
+else:
+	print("PASS: ttl")
+cache.invalidate()
+if SessionCache(path, ttl=60.).lookup(key) is not None:
+	print("FAILURE! An invalidated entry should miss")
+	fails.append("invalidate")
+else:
+	print("PASS: invalidate")
+with open(path, 'w') as f:
+	f.write("{not json")
+if SessionCache(path).lookup(key) is not None:
+	print("FAILURE! A corrupt file should be an empty cache")
+	fails.append("corrupt file")
+else:
+	print("PASS: corrupt file ignored")
+
+def start(n):
+	reader = VacuumReader(-1, False)
+	reader.echo = False
+	reader.session = forChamber(-1, tmp)
+	reader.setUpPirani()
+	reader.setUpCapacitance()
+	reader.setUpSampler()
+	queried = []
+	for gauge in (reader.pirani, reader.capacitance):
+		getUnits = gauge.getUnits
+		def counted(getUnits=getUnits):
+			queried.append(time.monotonic())
+			return getUnits()
+		gauge.getUnits = counted
+	setUpOutput(reader, os.path.join(tmp, "vacuum-%d.csv" % n))
+	return reader, queried
+
+print("Test: a cold start queries the units, a warm start does not")
+reader, queried = start(1)
+reader.closeAll()
+if len(queried) != 2:
+	print("FAILURE! A cold start should query both gauges, queried %d" % len(queried))
+	fails.append("cold start")
+else:
+	print("PASS: cold start queried the gauges")
+reader, queried = start(2)
+if queried or reader.pirani_units != "TORR" or reader.capacitance_units != "Torr":
+	print("FAILURE! A warm start should use the cached units, queried %d, got %s %s" % (len(queried), reader.pirani_units, reader.capacitance_units))
+	fails.append("warm start")
+else:
+	print("PASS: warm start used the cache")
+
+print("Test: the warm start is validated in the background, and a failure invalidates the cache")
+before = reader.session.validated()
+reader.validateSession()
+deadline = time.time() + 5.
+while reader.session.validated() == before and time.time() < deadline:
+	time.sleep(0.01)
+if len(queried) != 2 or reader.session.lookup(reader.sessionKey())["capacitance_fullscale_reported"] != "000.01 0.0100":
+	print("FAILURE! Validation should re-read both gauges and the reported fullscale, got ", reader.session.data)
+	fails.append("background validation")
+else:
+	print("PASS: validated")
+row = reader.sampler.sample()
+bad = Row([row["pirani"], Reading("capacitance", time.time(), [float('nan')] * 2, "no reply")])
+reader.recordRow(bad)
+reader.closeAll()
+if forChamber(-1, tmp).lookup(reader.sessionKey()) is not None:
+	print("FAILURE! A gauge failure should invalidate the cache")
+	fails.append("invalidate on failure")
+else:
+	print("PASS: failure invalidated the cache")
+
+print("Test: a silent fullscale query neither fails the gauge nor the validation")
+reader, queried = start(3)
+cap = reader.capacitance
+send = cap._sendCmdGetResp
+asked = []
+def noFullscale(cmd, send=send):
+	if cmd == cap.fullscaleCommand:
+		asked.append(cmd)
+		raise response_timeout(cmd, b"")
+	return send(cmd)
+cap._sendCmdGetResp = noFullscale
+before = reader.session.validated()
+reader.validateSession()
+deadline = time.time() + 5.
+while (reader.validating or reader.session.validated() == before) and time.time() < deadline:
+	time.sleep(0.01)
+entry = reader.session.lookup(reader.sessionKey())
+if len(asked) != 1 or cap.failures != 0 or cap.retryAt is not None or entry is None or entry["capacitance_fullscale_reported"] is not None:
+	print("FAILURE! Expected one uncounted fullscale attempt and a valid entry, got ", asked, cap.failures, entry)
+	fails.append("fullscale probe")
+else:
+	print("PASS: fullscale probe")
+
+print("Test: recovery does not revalidate before the ttl has passed")
+started = []
+validate = reader.validateSession
+reader.validateSession = lambda: (started.append(1), validate())
+row = reader.sampler.sample()
+reader.recordRow(Row([row["pirani"], Reading("capacitance", time.time(), [float('nan')] * 2, "no reply")]))
+reader.recordRow(reader.sampler.sample())
+early = len(started)
+reader.lastValidation -= reader.session.ttl + 1.
+reader.recordRow(reader.sampler.sample())
+reader.closeAll()
+if early != 0 or len(started) != 1:
+	print("FAILURE! Expected no validation on recovery and one after the ttl, got %d and %d" % (early, len(started)))
+	fails.append("revalidation")
+else:
+	print("PASS: validation once per ttl")
+
+print("Test: concurrent writers leave a readable file")
+path = os.path.join(tmp, "concurrent.json")
+cache = SessionCache(path)
+errors = []
+def hammer(n):
+	try:
+		for k in range(200):
+			cache.store(key, {"n": n, "k": k})
+			cache.invalidate()
+	except Exception as err:
+		errors.append(err)
+threads = [threading.Thread(target=hammer, args=(n,)) for n in range(4)]
+for t in threads:
+	t.start()
+for t in threads:
+	t.join()
+cache.store(key, {"n": "last"})
+if errors or SessionCache(path).lookup(key) != {"n": "last"} or [f for f in os.listdir(tmp) if f.endswith(".tmp")]:
+	print("FAILURE! Expected no errors, the last entry and no leftover temporary files, got ", errors)
+	fails.append("concurrent save")
+else:
+	print("PASS: concurrent save")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from gaugeSimulator import ChamberModel, SimClock, SimulatedCapacitance, SimulatedPirani, Simulation
+from pressure_gauges import Capacitance, Pirani
+
+# checks that the simulated gauges follow the pumpdown model and speak the real protocols
+
+fails = []
+
+print("Test: the simulated clock jumps forward on sleep")
+clock = SimClock()
+before = clock.now()
+clock.sleep(3600.)
+if not 3600. <= clock.now() - before < 3601.:
+	print("FAILURE! sleep(3600) should advance the clock by an hour, instead advanced ", clock.now() - before)
+	fails.append("simulated clock")
+else:
+	print("PASS: simulated clock")
+
+print("Test: Pirani follows the pumpdown")
+sim = Simulation(seed=3)
+pirani, cap = sim.addChamber("a", noise=0.)
+gauge = Pirani(pirani, False)
+start = gauge.getPressure()[0]
+sim.clock.sleep(3600.)
+later = gauge.getPressure()[0]
+if not (700. < start <= 760. and later < 1e-2):
+	print("FAILURE! Pirani should read about 760 at first and below 1e-2 an hour later, instead got ", start, later)
+	fails.append("pirani pumpdown")
+else:
+	print("PASS: pirani pumpdown")
+
+print("Test: capacitance reads Off over range and negative near zero")
+gauge = Capacitance(SimulatedCapacitance(ChamberModel(base=0., outgas=0., noise=0.), SimClock()), False)
+gauge.minscale = [-1., -1.]
+cap = gauge.innerSerial
+cap.clock.sleep(3600.)
+values = [gauge.getPressure()[1] for i in range(50)]
+if not any(v < 0 for v in values):
+	print("FAILURE! The low range head should read slightly negative at base pressure, instead got ", values[:5])
+	fails.append("negative capacitance")
+else:
+	print("PASS: negative capacitance")
+cap.clock.skipped = 0.
+if gauge.getPressure()[1] != gauge.fullscale[1]:
+	print("FAILURE! The low range head should be Off (fullscale) at atmosphere")
+	fails.append("capacitance Off")
+else:
+	print("PASS: capacitance Off")
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+import io, os, sys, tempfile, threading, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import writers
+from writers import BufferedWriter, FlushPolicy, flushAll, writer_error
+
+# checks when a BufferedWriter flushes, and that a failing sink is reported instead of hanging its callers
+
+fails = []
+tmp = tempfile.mkdtemp()
+
+class CountingSink(io.StringIO):
+	""" Keeps what was written, and what had been written at each flush """
+	def __init__(self):
+		io.StringIO.__init__(self)
+		self.flushed = []
+	def flush(self):
+		self.flushed.append(self.getvalue())
+
+class BrokenSink(CountingSink):
+	""" Fails like a full disk once `after` lines have been written """
+	def __init__(self, after):
+		CountingSink.__init__(self)
+		self.after = after
+		self.lines = 0
+	def write(self, s):
+		self.lines += 1
+		if self.lines > self.after:
+			raise OSError(28, "No space left on device")
+		return CountingSink.write(self, s)
+
+def waitFor(condition, timeout=2.):
+	deadline = time.monotonic() + timeout
+	while not condition() and time.monotonic() < deadline:
+		time.sleep(0.005)
+	return condition()
+
+print("Test: the row limit flushes every N lines")
+sink = CountingSink()
+writer = BufferedWriter([sink], FlushPolicy(rows=3, seconds=None, checkpointSeconds=None))
+for k in range(7):
+	writer.write("%d\n" % k)
+waitFor(lambda: len(sink.flushed) >= 2)
+time.sleep(0.05)
+if sink.flushed != ["0\n1\n2\n", "0\n1\n2\n3\n4\n5\n"]:
+	print("FAILURE! Expected flushes after rows 3 and 6, got ", sink.flushed)
+	fails.append("rows policy")
+else:
+	print("PASS: rows policy")
+writer.close()
+
+print("Test: the seconds limit flushes an old line without more writes")
+sink = CountingSink()
+writer = BufferedWriter([sink], FlushPolicy(rows=None, seconds=0.1, checkpointSeconds=None))
+writer.write("only\n")
+time.sleep(0.03)
+early = list(sink.flushed)
+flushed = waitFor(lambda: sink.flushed, 1.)
+if early or not flushed or sink.flushed[0] != "only\n":
+	print("FAILURE! Expected one flush about 0.1 s after the write, got ", early, sink.flushed)
+	fails.append("seconds policy")
+else:
+	print("PASS: seconds policy")
+writer.close()
+
+print("Test: checkpoint() fsyncs file sinks, and a pipe-like sink is skipped")
+synced = []
+realFsync = writers.os.fsync
+def countingFsync(fd):
+	synced.append(fd)
+	realFsync(fd)
+writers.os.fsync = countingFsync
+f = open(os.path.join(tmp, "checkpoint.csv"), 'w')
+plain = CountingSink() # fileno() raises io.UnsupportedOperation, like a StringIO stdout
+writer = BufferedWriter([f, plain], FlushPolicy(rows=None, seconds=None, checkpointSeconds=None), owned=[f])
+writer.write("a\n")
+writer.checkpoint()
+writers.os.fsync = realFsync
+with open(f.name) as g:
+	content = g.read()
+if synced != [f.fileno()] or content != "a\n" or plain.flushed != ["a\n"]:
+	print("FAILURE! Expected one fsync of the file and both sinks flushed, got ", synced, content, plain.flushed)
+	fails.append("checkpoint")
+else:
+	print("PASS: checkpoint")
+
+print("Test: close() writes out what is queued and closes only the owned sinks")
+writer.write("b\n")
+writer.close()
+with open(f.name) as g:
+	content = g.read()
+if content != "a\nb\n" or not f.closed or plain.closed or writer in writers._openWriters:
+	print("FAILURE! Expected both lines, the file closed, the other sink open and the writer unregistered")
+	fails.append("close")
+else:
+	print("PASS: close")
+
+print("Test: flushAll() flushes every open writer")
+sinks = [CountingSink() for k in range(3)]
+open3 = [BufferedWriter([s], FlushPolicy(rows=None, seconds=None, checkpointSeconds=None)) for s in sinks]
+for k, w in enumerate(open3):
+	w.write("%d\n" % k)
+flushAll()
+if [s.flushed[-1] if s.flushed else None for s in sinks] != ["0\n", "1\n", "2\n"]:
+	print("FAILURE! Every writer should have flushed, got ", [s.flushed for s in sinks])
+	fails.append("flushAll")
+else:
+	print("PASS: flushAll")
+for w in open3:
+	w.close()
+
+print("Test: a failing owned sink is raised from the callers, and nothing hangs")
+broken = BrokenSink(2)
+echo = CountingSink()
+writer = BufferedWriter([broken, echo], FlushPolicy(rows=None, seconds=None, checkpointSeconds=None), owned=[broken], syncTimeout=2.)
+for k in range(4):
+	writer.write("%d\n" % k)
+start = time.monotonic()
+errors = []
+for call in (writer.flush, writer.checkpoint, lambda: writer.write("4\n")):
+	try:
+		call()
+	except OSError as err:
+		errors.append(err.errno)
+done = threading.Event()
+threading.Thread(target=lambda: (flushAll(), done.set()), daemon=True).start()
+flushed = done.wait(2.)
+try:
+	writer.close()
+	errors.append("close did not raise")
+except OSError as err:
+	errors.append(err.errno)
+elapsed = time.monotonic() - start
+if errors != [28, 28, 28, 28] or not flushed or elapsed > 1. or not broken.closed:
+	print("FAILURE! Expected ENOSPC from flush, checkpoint, write and close within a second, got ", errors, flushed, elapsed)
+	fails.append("failing sink")
+elif writer.thread.is_alive():
+	print("FAILURE! The writer thread should stop on close")
+	fails.append("thread stopped")
+else:
+	print("PASS: failing sink raised, %.3f s" % elapsed)
+
+print("Test: a failing sink that is not owned is dropped, and the file keeps being written")
+f = open(os.path.join(tmp, "dropped.csv"), 'w')
+stdoutLike = BrokenSink(1)
+writer = BufferedWriter([f, stdoutLike], FlushPolicy(rows=None, seconds=None, checkpointSeconds=None), owned=[f])
+for k in range(3):
+	writer.write("%d\n" % k)
+writer.close()
+with open(f.name) as g:
+	content = g.read()
+if content != "0\n1\n2\n" or stdoutLike.getvalue() != "0\n":
+	print("FAILURE! Expected all lines in the file and one on the broken echo, got ", content, stdoutLike.getvalue())
+	fails.append("unowned sink")
+else:
+	print("PASS: unowned sink dropped")
+
+print("Test: a flush that cannot finish times out")
+stuck = threading.Event()
+class SlowSink(CountingSink):
+	def write(self, s):
+		stuck.wait()
+		return CountingSink.write(self, s)
+writer = BufferedWriter([SlowSink()], FlushPolicy(rows=None, seconds=None, checkpointSeconds=None), syncTimeout=0.1)
+writer.write("x\n")
+try:
+	writer.flush()
+	print("FAILURE! flush() should time out while the sink is stuck")
+	fails.append("sync timeout")
+except writer_error:
+	print("PASS: flush timed out")
+stuck.set()
+writer.close()
+
+print("TEST RESULTS")
+print("Failures: ", len(fails))
+for fail in fails:
+	print(fail)
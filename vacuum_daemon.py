@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Acquisition service for several vacuum chambers in one process.
+
+Reads a JSON config listing the chambers and the serial ports of their gauges, opens every port once
+(gauges that name the same device share one serial.Serial), samples all gauges of all chambers together
+on one ConcurrentSampler, and writes a separate vacuum-<chamber>-<time>.csv stream per chamber, in the same
+format read_vacuum.py writes.
+
+Example config:
+
+    {
+        "delaytime": 9.0,
+        "chambers": [
+            {"name": "1", "pirani": "/dev/ttyUSB0", "capacitance": "/dev/ttyUSB1"},
+            {"name": "2", "pirani": "/dev/ttyUSB2", "capacitance": "/dev/ttyUSB3",
+             "capacitance_fullscale": [1000.0, 1.0], "capacitance_minscale": [0.1, 0.0001]},
+            {"name": "sim", "test": true}
+        ]
+    }
+
+A chamber with "test": true uses the mock gauges instead of serial ports.
+Pirani gauges daisy-chained on one RS-485 line are listed with the same "pirani" port and each its own
+"pirani_address" (1-253); the line is then polled by one PiraniBus (see pirani_bus.py).
+Optional top-level key "bus_depth" maps such a port to the number of commands kept in flight on it, e.g.
+{"/dev/ttyUSB0": 4}. Only for 4-wire (full-duplex) RS-485 lines: on a 2-wire line, leave it out (depth 1).
+Optional top-level key "binary": true also records a .vbin binary log (see binary_log.py) per chamber.
+Optional top-level keys "flush_rows", "flush_seconds" and "checkpoint_seconds" set the FlushPolicy of every
+chamber's output stream (null disables that limit).
+Optional top-level key "min_period" turns on adaptive sampling: the period then varies between min_period and
+delaytime with how fast the fastest-moving chamber's pressure changes ("adaptive_target" decades per sample,
+default 0.02; see acquisition.AdaptiveScheduler).
+Optional top-level keys "deadband" (a fraction, e.g. 0.02) and "heartbeat" (seconds, default 300) only write
+rows in which some reading moved by more than that fraction (see acquisition.Deadband).
+Optional top-level key "analytics" (seconds) keeps running pumpdown statistics per chamber and writes them to its
+stream that often (see analytics.py); "threshold" (a pressure) adds time-to-threshold estimates.
+Optional top-level key "publish" streams every chamber's samples to live subscribers (see publisher.py) at
+"HOST:PORT" or a Unix socket path.
+Optional top-level key "session_ttl" (seconds, default 86400; 0 disables) lets a restart take each chamber's gauge
+units from its .vacuum-session-<chamber>.json cache instead of querying the gauges (see session_cache.py).
+Optional top-level key "ring": true also writes each chamber's samples to a shared-memory ring,
+/dev/shm/vacuum-<chamber>.ring, for local readers (see sample_ring.py).
+Optional top-level key "interlock" names a JSON rules file (see interlock.py) that every chamber's samples are
+checked against as they are recorded; rules may be limited to some chambers.
+Optional top-level key "metrics" serves Prometheus metrics (see metrics.py) at "HOST:PORT" or a Unix socket path.
+Numbers may be given as JSON numbers or as strings ("1e-4"); anything else is a config_error when the daemon starts.
+"""
+
+import json, serial, signal, sys
+from read_vacuum import VacuumReader, setUpOutput, handleExit
+from writers import FlushPolicy
+from acquisition import ConcurrentSampler, FixedRateScheduler, AdaptiveScheduler, Deadband, portKey
+from session_cache import forChamber
+from sample_ring import SampleRing, ringPath
+import interlock
+import metrics
+
+# numeric config keys: key -> (conversion, whether null is allowed)
+NUMBERS = {"delaytime": (float, False), "min_period": (float, True), "adaptive_target": (float, False),
+           "flush_rows": (int, True), "flush_seconds": (float, True), "checkpoint_seconds": (float, True),
+           "deadband": (float, True), "heartbeat": (float, False), "analytics": (float, True),
+           "threshold": (float, True), "session_ttl": (float, False)}
+CHAMBER_NUMBERS = {"pirani_address": (int, True)}
+
+
+class config_error(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr("Bad daemon config: %s" % self.message)
+
+
+def _convert(where, key, value, convert, nullable):
+    if value is None and nullable:
+        return None
+    try:
+        if isinstance(value, bool):
+            raise ValueError("not a number")
+        return convert(value)
+    except (TypeError, ValueError):
+        raise config_error("%s%r is not %s: %r" % (where, key, "an integer" if convert is int else "a number", value))
+
+
+def checkConfig(config):
+    """ Returns a copy of a parsed JSON config with its numbers converted from strings; raises config_error for a bad value """
+    config = dict(config)
+    for key, (convert, nullable) in NUMBERS.items():
+        if key in config:
+            config[key] = _convert("", key, config[key], convert, nullable)
+    config["bus_depth"] = dict((port, _convert("bus_depth ", port, depth, int, False)) for port, depth in config.get("bus_depth", {}).items())
+    chambers = []
+    for chamber in config.get("chambers", []):
+        chamber = dict(chamber)
+        where = "chamber %s " % chamber.get("name")
+        for key, (convert, nullable) in CHAMBER_NUMBERS.items():
+            if key in chamber:
+                chamber[key] = _convert(where, key, chamber[key], convert, nullable)
+        for key in ("capacitance_fullscale", "capacitance_minscale"):
+            if key in chamber:
+                if not isinstance(chamber[key], list):
+                    raise config_error("%s%r is not a list: %r" % (where, key, chamber[key]))
+                chamber[key] = [_convert(where, key, v, float, False) for v in chamber[key]]
+        chambers.append(chamber)
+    config["chambers"] = chambers
+    return config
+
+
+class VacuumDaemon(object):
+    """
+    Owns the serial ports, one VacuumReader per chamber, and the sampler shared by all of them.
+    """
+
+    def __init__(self, config, debug):
+        """
+        Constructor
+        arguments:
+        config -- dict parsed from the JSON config (see module docstring); raises config_error for a bad number
+        debug -- True to print debug statements, False otherwise
+        """
+        self.config = config = checkConfig(config)
+        self.debug = debug
+        self.delaytime = config.get("delaytime", 9.0)
+        self.ports = {}
+        self.readers = []
+        self.sampler = None
+        self.publisher = None
+        self.dispatcher = None # runs the interlock actions of every chamber
+        if config.get("min_period") is not None:
+            self.scheduler = AdaptiveScheduler(config["min_period"], self.delaytime, config.get("adaptive_target", 0.02))
+        else:
+            self.scheduler = FixedRateScheduler(self.delaytime)
+        defaults = FlushPolicy()
+        self.flushPolicy = FlushPolicy(config.get("flush_rows", defaults.rows), config.get("flush_seconds", defaults.seconds), config.get("checkpoint_seconds", defaults.checkpointSeconds))
+
+    def openPort(self, port):
+        """ Returns the serial.Serial for port, opening it on first use """
+        if port not in self.ports:
+            self.ports[port] = self.newSerial(port)
+        return self.ports[port]
+
+    def newSerial(self, port):
+        """ Opens a serial port; tests substitute simulated devices here """
+        return serial.Serial(port, 9600, 8, 'N', 1)
+
+    def setUp(self):
+        """ Opens all ports, sets up one reader and output stream per chamber, and builds the shared sampler """
+        gauges = []
+        if self.config.get("publish"):
+            from publisher import Publisher
+            self.publisher = Publisher(self.config["publish"])
+        rules = None
+        if self.config.get("interlock"):
+            rules = interlock.load(self.config["interlock"])
+            self.dispatcher = interlock.Dispatcher()
+        for chamber in self.config["chambers"]:
+            name = str(chamber["name"])
+            reader = VacuumReader(name, self.debug)
+            reader.testMode = bool(chamber.get("test", False))
+            reader.echo = False
+            reader.publisher = self.publisher
+            if rules is not None:
+                reader.interlock = interlock.Interlock(rules, name, self.dispatcher)
+            if self.config.get("ring"):
+                reader.ring = SampleRing(ringPath(name), name)
+            if self.config.get("deadband") is not None:
+                reader.deadband = Deadband(self.config["deadband"], self.config.get("heartbeat", 300.))
+            if self.config.get("analytics") is not None:
+                reader.setUpAnalytics(self.config.get("threshold"), self.config["analytics"])
+            reader.flushPolicy = self.flushPolicy
+            reader.recordBinary = bool(self.config.get("binary", False))
+            if "capacitance_fullscale" in chamber:
+                reader.capacitance_fullscale = chamber["capacitance_fullscale"]
+            if "capacitance_minscale" in chamber:
+                reader.capacitance_minscale = chamber["capacitance_minscale"]
+            reader.pirani_address = chamber.get("pirani_address")
+            if self.config.get("session_ttl", 86400.) > 0:
+                reader.session = forChamber(name, ttl=self.config.get("session_ttl", 86400.))
+            self.readers.append(reader)
+            if reader.testMode:
+                reader.setUpPirani()
+                reader.setUpCapacitance()
+            else:
+                reader.setUpPirani(self.openPort(chamber["pirani"]))
+                reader.setUpCapacitance(self.openPort(chamber["capacitance"]))
+            setUpOutput(reader, "vacuum-%s-%s.csv" % (name, reader.isonow()))
+            for gaugeName, gauge in reader.gauges():
+                gauges.append(((name, gaugeName), gauge))
+        busDepth = dict((portKey(self.ports[port]), depth) for port, depth in self.config["bus_depth"].items() if port in self.ports)
+        self.sampler = ConcurrentSampler(gauges, self.debug, self.delaytime, busDepth)
+        for reader in self.readers:
+            reader.sampler = self.sampler
+            reader.validateSession()
+
+    def run(self, samples=None):
+        """ Samples every chamber at a fixed rate of one sample per delaytime seconds until interrupted (or `samples` times) """
+        readers = dict((r.chamber, r) for r in self.readers)
+        while samples is None or samples > 0:
+            if samples is not None:
+                samples -= 1
+            self.scheduler.wait()
+            self.sampler.timeout = self.scheduler.period # the current period, which min_period shortens
+            row = self.sampler.sample()
+            for name, chamberRow in row.split().items():
+                timeT, pirani_val, capacitance_val = readers[name].recordRow(chamberRow)
+                self.scheduler.observe(timeT, [pirani_val] + capacitance_val, name)
+
+    def closeAll(self):
+        """ Stops the sampler, then closes every chamber's output file and gauges """
+        if self.sampler != None:
+            self.sampler.close()
+        sys.stderr.write("Samples: %(fired)d, missed deadlines: %(missed)d, jitter mean/max: %(jitter_mean).4f/%(jitter_max).4f s\n" % self.scheduler.stats())
+        for reader in self.readers:
+            sys.stderr.write("Chamber %s:\n" % reader.chamber)
+            reader.closeAll()
+        if self.publisher != None:
+            self.publisher.close()
+        if self.dispatcher != None:
+            self.dispatcher.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stdout.write("Usage: `python vacuum_daemon.py config.json`\n")
+        sys.exit()
+
+    signal.signal(signal.SIGHUP, handleExit)
+    signal.signal(signal.SIGINT, handleExit)
+    signal.signal(signal.SIGQUIT, handleExit)
+    signal.signal(signal.SIGTERM, handleExit)
+
+    with open(sys.argv[1]) as f:
+        config = json.load(f)
+    if config.get("metrics"):
+        metrics.serve(config["metrics"])
+    try:
+        daemon = VacuumDaemon(config, False)
+    except config_error as err:
+        sys.stderr.write("%s: %s\n" % (sys.argv[1], err.message))
+        sys.exit(1)
+    try:
+        daemon.setUp()
+        sys.stderr.write("Recording %d chambers\n" % len(daemon.readers))
+        sys.stderr.flush()
+        daemon.run()
+    except SystemExit:
+        None
+    except:
+        sys.stderr.write("Caught Unexpected Exception: %s\n" % sys.exc_info()[0])
+        sys.stderr.write("%s\n" % sys.exc_info()[1])
+        sys.stderr.flush()
+
+    daemon.closeAll()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""
+Buffered output for the data streams.
+
+BufferedWriter takes text from the acquisition loop without blocking on the disk: lines go onto a queue and a
+background thread writes them to one or more sinks (the output file, stdout). When the sinks are flushed is
+decided by a FlushPolicy -- every N rows, every T seconds, and an fsync checkpoint every C seconds -- instead
+of after every line.
+
+Every open writer is registered in this module, so flushAll() can push out what is buffered from a signal
+handler before the process exits.
+
+If writing to or flushing an owned sink fails (disk full, EIO, a closed file), the writer stops writing, wakes
+everything waiting on a flush, and raises the error from the next write(), flush(), checkpoint() or close().
+A failing sink it does not own (stdout, a closed pipe) is reported and dropped; the file keeps being written.
+"""
+
+from sys import stderr
+import metrics
+import errno, io, os, queue, threading, time, weakref
+
+_openWriters = weakref.WeakSet()
+
+
+class writer_error(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return repr("BufferedWriter: %s" % self.message)
+
+
+def flushAll():
+    """ Flushes every open BufferedWriter; called from the exit signal handlers, so it reports errors instead of raising """
+    for writer in list(_openWriters):
+        try:
+            writer.flush()
+        except Exception as err:
+            stderr.write("BufferedWriter: could not flush before exiting: %s\n" % err)
+
+
+def _queueDepth():
+    return sum(writer.pending() for writer in list(_openWriters))
+
+metrics.level("vacuum_writer_queue_depth", "Lines queued in all BufferedWriters and not yet written", fn=_queueDepth)
+
+
+class _Patch(object):
+    """ Queued bytes to write at an offset of the owned sinks (see BufferedWriter.writeAt) """
+    def __init__(self, offset, data):
+        self.offset = offset
+        self.data = data
+
+
+class FlushPolicy(object):
+    """
+    When a BufferedWriter flushes its sinks. Any of the limits may be None to disable it.
+    rows -- flush after this many lines have been written since the last flush
+    seconds -- flush when the oldest unflushed line is this old
+    checkpointSeconds -- also fsync file sinks this often, so data survives a power cut
+    """
+
+    def __init__(self, rows=100, seconds=10., checkpointSeconds=300.):
+        self.rows = rows
+        self.seconds = seconds
+        self.checkpointSeconds = checkpointSeconds
+
+
+class BufferedWriter(object):
+    """
+    Writes lines to its sinks from a background thread, flushing according to a FlushPolicy.
+    write() never waits on the disk; flush() and checkpoint() wait until everything queued before them is out.
+    """
+
+    def __init__(self, sinks, policy=None, owned=(), syncTimeout=30.):
+        """
+        Constructor
+        arguments:
+        sinks -- file-like objects every line is written to
+        policy -- a FlushPolicy; defaults to FlushPolicy()
+        owned -- the sinks this writer closes when it is closed (e.g. the output file, but not stdout);
+                 an error on one of them fails the writer
+        syncTimeout -- longest wait in flush(), checkpoint() and close() before they raise writer_error
+        """
+        self.sinks = list(sinks)
+        self.policy = policy if policy is not None else FlushPolicy()
+        self.owned = list(owned)
+        self.queue = queue.SimpleQueue() # put() is reentrant, so flushAll() is safe inside a signal handler
+        self.unflushed = 0
+        self.oldestUnflushed = None
+        self.lastCheckpoint = time.monotonic()
+        self.closed = False
+        self.syncTimeout = syncTimeout
+        self.error = None # the exception that stopped the writer thread from writing
+        self.thread = threading.Thread(target=self._run, name="BufferedWriter")
+        self.thread.daemon = True
+        self.thread.start()
+        _openWriters.add(self)
+
+    def write(self, ostr):
+        """ Queues ostr for writing and returns immediately; raises the error that failed the writer, if any """
+        self._raiseError()
+        self.queue.put(ostr)
+
+    def writeAt(self, offset, data):
+        """
+        Queues data to be written at offset of the owned sinks (seekable files), in order with the other writes,
+        e.g. to update a header in place; the position is restored afterwards. Other sinks are skipped.
+        """
+        self._raiseError()
+        self.queue.put(_Patch(offset, data))
+
+    def pending(self):
+        """ Number of items queued but not yet written """
+        return self.queue.qsize()
+
+    def flush(self):
+        """ Blocks until everything written so far has been flushed to the sinks """
+        self._sync(False)
+
+    def checkpoint(self):
+        """ Blocks until everything written so far has been flushed and fsynced """
+        self._sync(True)
+
+    def _raiseError(self):
+        if self.error is not None:
+            raise self.error
+
+    def _sync(self, fsync):
+        if self.closed:
+            return
+        self._raiseError()
+        done = threading.Event()
+        self.queue.put((done, fsync))
+        if not done.wait(self.syncTimeout):
+            raise writer_error("no flush within %g s (%d items still queued)" % (self.syncTimeout, self.pending()))
+        self._raiseError()
+
+    def close(self):
+        """
+        Writes out and checkpoints everything queued, stops the thread and closes the owned sinks.
+        The owned sinks are closed even if the writer failed; the error is raised afterwards.
+        """
+        if self.closed:
+            return
+        try:
+            self.checkpoint()
+        finally:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join(self.syncTimeout)
+            _openWriters.discard(self)
+            for sink in self.owned:
+                try:
+                    sink.close()
+                except (OSError, ValueError) as err:
+                    stderr.write("BufferedWriter: could not close %s: %s\n" % (sink, err))
+
+    def _timeout(self):
+        """ Seconds until a time-based flush or checkpoint is due, or None to wait indefinitely """
+        now = time.monotonic()
+        due = []
+        if self.policy.seconds is not None and self.oldestUnflushed is not None:
+            due.append(self.oldestUnflushed + self.policy.seconds - now)
+        if self.policy.checkpointSeconds is not None:
+            due.append(self.lastCheckpoint + self.policy.checkpointSeconds - now)
+        if not due:
+            return None
+        return max(0., min(due))
+
+    def _sinkFailed(self, sink, err):
+        """ Fails the writer if sink is owned; otherwise reports the error and stops writing to that sink """
+        if any(sink is owned for owned in self.owned):
+            raise err
+        stderr.write("BufferedWriter: stopped writing to %s: %s\n" % (sink, err))
+        self.sinks = [s for s in self.sinks if s is not sink]
+
+    def _writeSinks(self, item):
+        for sink in list(self.sinks):
+            try:
+                sink.write(item)
+            except (OSError, ValueError) as err:
+                self._sinkFailed(sink, err)
+
+    def _patchSinks(self, patch):
+        for sink in list(self.sinks):
+            if not any(sink is owned for owned in self.owned):
+                continue
+            try:
+                sink.flush()
+                end = sink.tell()
+                sink.seek(patch.offset)
+                sink.write(patch.data)
+                sink.seek(end)
+            except (OSError, ValueError) as err:
+                self._sinkFailed(sink, err)
+
+    def _flushSinks(self, fsync):
+        for sink in list(self.sinks):
+            try:
+                sink.flush()
+                if fsync:
+                    try:
+                        fd = sink.fileno()
+                    except (AttributeError, io.UnsupportedOperation):
+                        fd = None
+                    if fd is not None:
+                        try:
+                            os.fsync(fd)
+                        except OSError as err:
+                            # stdout may be a pipe or a tty, which cannot be fsynced; that loses no data
+                            if err.errno not in (errno.EINVAL, errno.ENOTSUP):
+                                raise
+            except (OSError, ValueError) as err:
+                self._sinkFailed(sink, err)
+        self.unflushed = 0
+        self.oldestUnflushed = None
+        if fsync:
+            self.lastCheckpoint = time.monotonic()
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=None if self.error is not None else self._timeout())
+            except queue.Empty:
+                item = ""
+            if item is None:
+                return
+            try:
+                self._handle(item)
+            except Exception as err:
+                # keep serving the queue, so nothing waits forever on a flush; the callers get the error
+                if self.error is None:
+                    self.error = err
+                    stderr.write("BufferedWriter: writing failed, no more data will be written: %s\n" % err)
+            if isinstance(item, tuple):
+                item[0].set()
+
+    def _handle(self, item):
+        """ Writes one queued item, or flushes for a (done, fsync) item, then flushes as the policy says """
+        if self.error is not None:
+            return # failed: discard what is queued
+        if isinstance(item, tuple):
+            self._flushSinks(item[1])
+            return
+        if isinstance(item, _Patch):
+            self._patchSinks(item)
+            return
+        if item:
+            self._writeSinks(item)
+            self.unflushed += 1
+            if self.oldestUnflushed is None:
+                self.oldestUnflushed = time.monotonic()
+        now = time.monotonic()
+        policy = self.policy
+        if policy.checkpointSeconds is not None and now - self.lastCheckpoint >= policy.checkpointSeconds:
+            self._flushSinks(True)
+        elif policy.rows is not None and self.unflushed >= policy.rows:
+            self._flushSinks(False)
+        elif policy.seconds is not None and self.oldestUnflushed is not None and now - self.oldestUnflushed >= policy.seconds:
+            self._flushSinks(False)